@@ -0,0 +1,387 @@
+"""Versioned JSON API (/api/v1) for POS terminals and sync jobs.
+
+Every collection is described by a Resource: the table it reads, the
+fields a client may select (name -> SQL expression) and the filters it
+accepts (query parameter -> SQL condition + converter). One generic handler
+turns a request into a single SELECT:
+
+    GET /api/v1/movies?fields=movie_id,title&release_year=1994&limit=20
+    GET /api/v1/movies?after=<next_cursor>                  next page
+    GET /api/v1/rentals?status=OPEN&format=ndjson           every row, streamed
+    GET /api/v1/customers/7                                 one row
+    GET /api/v1/changes?since=<seq>&tables=rental,payment   rows changed since (changelog.py)
+
+Pages are keyset-paginated on the primary key (see pagination.py). With
+``format=ndjson`` (or ``Accept: application/x-ndjson``) the whole filtered
+collection is streamed one JSON object per line straight off the cursor,
+so exporting the full rental table runs in constant memory.
+
+The movie catalog (and the index) can be read by anyone, as on the HTML
+side. Customers, rentals, payments and the change feed need either a
+logged-in admin or one of the app's API tokens (``API_TOKENS``), sent as
+``Authorization: Bearer <token>``; without one the API answers 401, to a
+logged-in non-admin 403.
+
+The blueprint is built by create_blueprint(get_connection, api_tokens) so
+this module does not import app.py; app.py registers it.
+"""
+import hmac
+import json
+from collections import namedtuple
+
+from flask import Blueprint, Response, g, jsonify, request, session, stream_with_context, url_for
+
+import changelog
+import pagination
+import search
+
+API_VERSION = "v1"
+MAX_LIMIT = 500
+STREAM_CHUNK = 500    # rows fetched (and written) per step of an NDJSON export
+
+# source: FROM clause; key: primary key expression (keyset + item lookup)
+# default_fields: returned when the client does not pass ?fields=
+# seek_filters: IN (subquery) filters whose index should drive the query;
+#   left alone SQLite walks the primary key in order and tests every row
+Resource = namedtuple("Resource", "source key fields default_fields filters seek_filters")
+
+# collections anyone may read; the rest need an admin or an API token
+PUBLIC = {"movies"}
+
+
+def _status(value):
+    return value.upper()
+
+
+def _match(value):
+    match = search.match_query(value)
+    if match is None:
+        raise ValueError(value)
+    return match
+
+
+_MOVIE_COLUMNS = ("movie_id", "title", "release_year", "mpaa_rating", "length_minutes",
+                  "movie_rating", "description", "rental_rate", "late_fee")
+
+RESOURCES = {
+    "movies": Resource(
+        source="movie m",
+        key="m.movie_id",
+        fields={
+            **{name: f"m.{name}" for name in _MOVIE_COLUMNS},
+            "categories": """(SELECT GROUP_CONCAT(c.category_name)
+                              FROM movie_category mc JOIN category c ON c.category_id = mc.category_id
+                              WHERE mc.movie_id = m.movie_id)""",
+            "actors": """(SELECT GROUP_CONCAT(a.actor_name)
+                          FROM movie_actor ma JOIN actor a ON a.actor_id = ma.actor_id
+                          WHERE ma.movie_id = m.movie_id)""",
+            "total_copies": "m.total_copies",
+            "available_copies": "m.available_copies",
+        },
+        default_fields=_MOVIE_COLUMNS,
+        filters={
+            "q": ("m.movie_id IN (SELECT rowid FROM movie_search WHERE movie_search MATCH ?)", _match),
+            "release_year": ("m.release_year = ?", int),
+            "mpaa_rating": ("m.mpaa_rating = ?", str),
+            "min_rating": ("m.movie_rating >= ?", float),
+            "category_id": ("EXISTS (SELECT 1 FROM movie_category mc "
+                            "WHERE mc.movie_id = m.movie_id AND mc.category_id = ?)", int),
+            "actor_id": ("EXISTS (SELECT 1 FROM movie_actor ma "
+                         "WHERE ma.movie_id = m.movie_id AND ma.actor_id = ?)", int),
+        },
+        seek_filters=("q",),
+    ),
+    "customers": Resource(
+        source="customer c",
+        key="c.customer_id",
+        fields={name: f"c.{name}" for name in (
+            "customer_id", "first_name", "last_name", "email", "phone", "address", "signup_date")},
+        default_fields=("customer_id", "first_name", "last_name", "email", "phone", "address", "signup_date"),
+        filters={
+            "email": ("c.email = ?", str),
+            "last_name": ("c.last_name = ?", str),
+            "signup_since": ("c.signup_date >= ?", str),
+        },
+        seek_filters=(),
+    ),
+    "rentals": Resource(
+        source="rental r",
+        key="r.rental_id",
+        fields={
+            **{name: f"r.{name}" for name in (
+                "rental_id", "customer_id", "copy_id", "rental_date", "due_date", "return_date")},
+            "status": "r.rental_status",
+            "movie_id": "(SELECT ic.movie_id FROM inventory_copy ic WHERE ic.copy_id = r.copy_id)",
+        },
+        default_fields=("rental_id", "customer_id", "copy_id", "rental_date", "due_date",
+                        "return_date", "status"),
+        filters={
+            "customer_id": ("r.customer_id = ?", int),
+            "copy_id": ("r.copy_id = ?", int),
+            "movie_id": ("r.copy_id IN (SELECT copy_id FROM inventory_copy WHERE movie_id = ?)", int),
+            "status": ("r.rental_status = ?", _status),
+            "since": ("r.rental_date >= ?", str),
+            "until": ("r.rental_date < ?", str),
+        },
+        seek_filters=("movie_id",),
+    ),
+    "payments": Resource(
+        source="payment p",
+        key="p.payment_id",
+        fields={
+            **{name: f"p.{name}" for name in (
+                "payment_id", "rental_id", "amount", "payment_date", "payment_method")},
+            "customer_id": "(SELECT r.customer_id FROM rental r WHERE r.rental_id = p.rental_id)",
+        },
+        default_fields=("payment_id", "rental_id", "amount", "payment_date", "payment_method"),
+        filters={
+            "rental_id": ("p.rental_id = ?", int),
+            "customer_id": ("p.rental_id IN (SELECT rental_id FROM rental WHERE customer_id = ?)", int),
+            "method": ("p.payment_method = ?", str),
+            "since": ("p.payment_date >= ?", str),
+            "until": ("p.payment_date < ?", str),
+        },
+        seek_filters=("customer_id",),
+    ),
+}
+
+# query parameters every collection understands
+_CONTROL_PARAMS = {"fields", "limit", "after", "format"}
+
+
+class ApiError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+
+def select_fields(resource, args):
+    """The field names asked for with ?fields=a,b (in that order)."""
+    raw = args.get("fields", "").strip()
+    if not raw:
+        return list(resource.default_fields)
+    names = [name.strip() for name in raw.split(",") if name.strip()]
+    unknown = [name for name in names if name not in resource.fields]
+    if unknown:
+        raise ApiError(f"unknown field(s): {', '.join(unknown)}; "
+                       f"available: {', '.join(resource.fields)}")
+    return list(dict.fromkeys(names))
+
+
+def build_filters(resource, args):
+    """WHERE conditions + params for the filter parameters in ``args``.
+
+    Also returns the expression to page/sort by: the primary key, or
+    ``+key`` when a seek filter is used (the unary plus stops SQLite from
+    walking the primary key, so the filter's index drives the query and
+    only the matching rows get sorted).
+    """
+    unknown = [name for name in args if name not in resource.filters and name not in _CONTROL_PARAMS]
+    if unknown:
+        raise ApiError(f"unknown parameter(s): {', '.join(unknown)}; "
+                       f"filters: {', '.join(resource.filters)}")
+    conditions, params = [], []
+    for name, (condition, convert) in resource.filters.items():
+        if name not in args:
+            continue
+        try:
+            value = convert(args[name])
+        except ValueError:
+            raise ApiError(f"invalid value for {name}: {args[name]!r}")
+        conditions.append(condition)
+        params.append(value)
+    seek = any(name in args for name in resource.seek_filters)
+    return conditions, params, f"+{resource.key}" if seek else resource.key
+
+
+def build_query(resource, fields, conditions, limit=None, order_key=None):
+    """SELECT for ``fields``; the key is always selected last as _key."""
+    columns = ", ".join(f"{resource.fields[name]} AS {name}" for name in fields)
+    sql = f"SELECT {columns}, {resource.key} AS _key FROM {resource.source}"
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    sql += f" ORDER BY {order_key or resource.key}"
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
+
+def _record(fields, row):
+    return {name: row[i] for i, name in enumerate(fields)}
+
+
+def stream_rows(conn, sql, params, fields):
+    """Yield NDJSON for every row of a query, STREAM_CHUNK rows at a time."""
+    cur = conn.execute(sql, params)
+    try:
+        while True:
+            rows = cur.fetchmany(STREAM_CHUNK)
+            if not rows:
+                break
+            yield "".join(json.dumps(_record(fields, row), separators=(",", ":")) + "\n" for row in rows)
+    finally:
+        cur.close()
+
+
+def wants_ndjson():
+    if request.args.get("format") == "ndjson":
+        return True
+    if request.args.get("format") not in (None, "json"):
+        raise ApiError("format must be json or ndjson")
+    best = request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"])
+    return best == "application/x-ndjson"
+
+
+def _bearer_token():
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    return token.strip() if scheme.lower() == "bearer" else None
+
+
+def create_blueprint(get_connection, api_tokens=tuple):
+    """The /api/v1 blueprint.
+
+    ``get_connection()`` returns the request's connection, ``api_tokens()``
+    the tokens that grant access to the protected collections.
+    """
+    bp = Blueprint(f"api_{API_VERSION}", __name__, url_prefix=f"/api/{API_VERSION}")
+
+    @bp.errorhandler(ApiError)
+    def api_error(exc):
+        response = jsonify(error=exc.message)
+        if exc.status == 401:
+            response.headers["WWW-Authenticate"] = 'Bearer realm="api"'
+        return response, exc.status
+
+    @bp.before_request
+    def authorize():
+        name = (request.view_args or {}).get("name")
+        if request.endpoint == f"{bp.name}.index" or name in PUBLIC:
+            return None
+        token = _bearer_token()
+        if token is not None:
+            # bytes: compare_digest refuses str with non-ASCII characters
+            if any(hmac.compare_digest(token.encode(), known.encode()) for known in api_tokens()):
+                return None
+            raise ApiError("invalid API token", 401)
+        if "user_id" not in session:
+            raise ApiError("authentication required: log in as an admin or send an API token", 401)
+        if session.get("role") != "admin":
+            raise ApiError("admin access required", 403)
+        return None
+
+    def resource_for(name):
+        resource = RESOURCES.get(name)
+        if resource is None:
+            raise ApiError(f"unknown collection {name!r}; available: {', '.join(RESOURCES)}", 404)
+        return resource
+
+    @bp.route("/")
+    def index():
+        return jsonify(
+            version=API_VERSION,
+            collections={
+                name: {
+                    "url": url_for(".collection", name=name),
+                    "fields": list(resource.fields),
+                    "default_fields": list(resource.default_fields),
+                    "filters": list(resource.filters),
+                }
+                for name, resource in RESOURCES.items()
+            },
+            changes=url_for(".changes"),
+        )
+
+    @bp.route("/changes")
+    def changes():
+        unknown = [name for name in request.args if name not in ("since", "limit", "tables")]
+        if unknown:
+            raise ApiError(f"unknown parameter(s): {', '.join(unknown)}; use since, limit, tables")
+        try:
+            since = int(request.args.get("since", 0))
+            limit = int(request.args.get("limit", changelog.BATCH_SIZE))
+        except ValueError:
+            raise ApiError("since and limit must be integers")
+        if limit < 1:
+            raise ApiError("limit must be at least 1")
+        tracked = [table for table, _, _ in changelog.TRACKED]
+        tables = [name.strip() for name in request.args.get("tables", "").split(",") if name.strip()]
+        if any(name not in tracked for name in tables):
+            raise ApiError(f"tables must be among: {', '.join(tracked)}")
+        conn = get_connection()
+        try:
+            batch = changelog.read_changes(conn, since, limit, tables)
+        except changelog.Purged as exc:
+            # too far behind: export the collections again, then follow from last_seq
+            return jsonify(error=str(exc), purged_through=exc.purged_through,
+                           last_seq=changelog.last_seq(conn)), 410
+        args = request.args.to_dict()
+        args["since"] = batch.next_since
+        return jsonify(
+            data=batch.changes,
+            next_since=batch.next_since,
+            more=batch.more,
+            last_seq=batch.last_seq,
+            next=url_for(".changes", **args) if batch.more else None,
+        )
+
+    @bp.route("/<name>")
+    def collection(name):
+        resource = resource_for(name)
+        fields = select_fields(resource, request.args)
+        conditions, params, order_key = build_filters(resource, request.args)
+        conn = get_connection()
+
+        if wants_ndjson():
+            # no LIMIT: the whole filtered collection, straight off the cursor
+            sql = build_query(resource, fields, conditions, order_key=order_key)
+
+            # Flask runs the teardown hooks once when the view returns and
+            # again when the stream ends; the flag keeps the connection
+            # checked out (see app.close_connection) until the second time.
+            g.streaming_response = True
+
+            def body():
+                try:
+                    yield from stream_rows(conn, sql, params, fields)
+                finally:
+                    g.streaming_response = False
+
+            return Response(stream_with_context(body()), mimetype="application/x-ndjson")
+
+        try:
+            limit = min(int(request.args.get("limit", pagination.PAGE_SIZE)), MAX_LIMIT)
+        except ValueError:
+            raise ApiError("limit must be an integer")
+        if limit < 1:
+            raise ApiError("limit must be at least 1")
+        after = pagination.decode_cursor(request.args.get("after"), 1)
+        if after is not None:
+            conditions = conditions + [f"{order_key} > ?"]
+            params = params + after
+        sql = build_query(resource, fields, conditions, limit + 1, order_key)
+        rows = conn.execute(sql, params).fetchall()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = pagination.encode_cursor([rows[-1]["_key"]])
+        args = request.args.to_dict()
+        args.pop("after", None)
+        return jsonify(
+            data=[_record(fields, row) for row in rows],
+            next_cursor=next_cursor,
+            next=url_for(".collection", name=name, **args, after=next_cursor) if next_cursor else None,
+        )
+
+    @bp.route("/<name>/<int:item_id>")
+    def item(name, item_id):
+        resource = resource_for(name)
+        fields = select_fields(resource, request.args)
+        sql = build_query(resource, fields, [f"{resource.key} = ?"])
+        row = get_connection().execute(sql, (item_id,)).fetchone()
+        if row is None:
+            raise ApiError(f"{name} {item_id} not found", 404)
+        return jsonify(data=_record(fields, row))
+
+    return bp
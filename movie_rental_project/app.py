@@ -1,10 +1,40 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session
+from flask import Flask, Response, render_template, request, redirect, url_for, flash, session, g, jsonify, has_app_context, has_request_context
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import datetime
+import atexit
+import json
+import logging
 import os
+import tempfile
+import time
 from functools import wraps
 import hashlib
 
+import click
+from markupsafe import Markup
+
+import api
+import archive
+import availability
+import backup
+import changelog
+import cache
+import dataversion
+import db
+import importer
+import instrument
+import latefees
+import maintenance
+import migrations
+import pagination
+import queries
+import query_plans
+import recommend
+import rentals
+import rollups
+import search
+import stats
+
 app = Flask(__name__)
 app.secret_key = "change_this_secret_key_for_production"
 
@@ -36,21 +66,288 @@ def hash_password(password):
 # SQLite database file path (no password needed)
 DB_PATH = os.path.join(os.path.dirname(__file__), "movierental.db")
 
+app.config.setdefault("DATABASE", DB_PATH)
+app.config.setdefault("DB_POOL_SIZE", 8)
+app.config.setdefault("DB_POOL_TIMEOUT", 30.0)
+# Storage settings (see db.storage_pragmas)
+app.config.setdefault("DB_JOURNAL_MODE", "WAL")
+app.config.setdefault("DB_SYNCHRONOUS", "NORMAL")
+app.config.setdefault("DB_MMAP_SIZE", 256 * 1024 * 1024)
+app.config.setdefault("DB_CACHE_SIZE", -64000)
+app.config.setdefault("DB_SERIALIZE_WRITES", True)
+app.config.setdefault("DB_CACHED_STATEMENTS", db.CACHED_STATEMENTS)
+# Archive of old returned rentals (see archive.py); None = movierental-archive.db next to DATABASE
+app.config.setdefault("ARCHIVE_DATABASE", None)
+app.config.setdefault("ARCHIVE_AFTER_DAYS", archive.ARCHIVE_AFTER_DAYS)
+# Reference-data cache (categories, release years, actors)
+app.config.setdefault("REF_CACHE_TTL", 300.0)
+app.config.setdefault("REF_CACHE_SIZE", 64)
+# Rendered catalog fragments, keyed on filters + data version (see dataversion.py)
+app.config.setdefault("FRAGMENT_CACHE_TTL", 300.0)
+app.config.setdefault("FRAGMENT_CACHE_SIZE", 256)
+# SQL instrumentation (see instrument.py)
+app.config.setdefault("SQL_INSTRUMENTATION", True)
+app.config.setdefault("SLOW_QUERY_MS", 100.0)
+app.config.setdefault("SLOW_QUERY_LOG", os.path.join(os.path.dirname(__file__), "slow_queries.log"))
+app.config.setdefault("METRICS_WINDOW", 300.0)
+# Background maintenance (maintenance.py): seconds between runs per job,
+# merged over maintenance.INTERVALS; None runs a job only on demand
+app.config.setdefault("MAINTENANCE_ENABLED", True)
+app.config.setdefault("MAINTENANCE_INTERVALS", {})
+app.config.setdefault("MAINTENANCE_JITTER", maintenance.JITTER)
+app.config.setdefault("MAINTENANCE_WORKERS", maintenance.WORKERS)
+# configure_app(): add the sample data to a new, empty store
+app.config.setdefault("SEED_SAMPLE_DATA", False)
+# Bearer tokens for the protected /api/v1 collections (api.py), e.g. one
+# per POS terminal or sync job; MOVIE_RENTAL_API_TOKENS='["..."]'
+app.config.setdefault("API_TOKENS", [])
+# MOVIE_RENTAL_* environment variables override the defaults above for every
+# entry point: wsgi.py, python app.py and `flask --app app <command>`
+app.config.from_prefixed_env("MOVIE_RENTAL")
+
+# ============== Connection Pool ==============
+def get_pool():
+    """Return the app's connection pool, creating it on first use."""
+    pool = app.extensions.get("db_pool")
+    if pool is None or pool.db_path != app.config["DATABASE"]:
+        if pool is not None:
+            pool.close()
+        pool = db.ConnectionPool(
+            app.config["DATABASE"],
+            max_size=app.config["DB_POOL_SIZE"],
+            timeout=app.config["DB_POOL_TIMEOUT"],
+            pragmas=db.storage_pragmas(
+                journal_mode=app.config["DB_JOURNAL_MODE"],
+                synchronous=app.config["DB_SYNCHRONOUS"],
+                mmap_size=app.config["DB_MMAP_SIZE"],
+                cache_size=app.config["DB_CACHE_SIZE"],
+            ),
+            cached_statements=app.config["DB_CACHED_STATEMENTS"],
+            setup=attach_archive,
+        )
+        app.extensions["db_pool"] = pool
+        app.extensions["db_writer"] = db.WriterQueue(enabled=app.config["DB_SERIALIZE_WRITES"])
+        # cached lookups belong to the database they were read from
+        app.extensions["ref_cache"] = cache.TTLCache(
+            maxsize=app.config["REF_CACHE_SIZE"], ttl=app.config["REF_CACHE_TTL"])
+        app.extensions["fragment_cache"] = cache.TTLCache(
+            maxsize=app.config["FRAGMENT_CACHE_SIZE"], ttl=app.config["FRAGMENT_CACHE_TTL"])
+        if "data_version" in app.extensions:
+            app.extensions["data_version"].close()
+        app.extensions["data_version"] = dataversion.DataVersion(app.config["DATABASE"] + "-version")
+    return pool
+
+def archive_path():
+    return app.config["ARCHIVE_DATABASE"] or archive.default_path(app.config["DATABASE"])
+
+def attach_archive(conn):
+    """Connection setup: ATTACH the rental archive and create the *_history views."""
+    archive.attach(conn, archive_path())
+
+def write_transaction(conn, immediate=False):
+    """Run a block of writes through the app's single writer queue.
+
+    Usage: ``with write_transaction(conn): ...; conn.commit()``
+    """
+    get_pool()
+    return app.extensions["db_writer"].transaction(conn, immediate=immediate)
+
 def get_connection():
-    conn = sqlite3.connect(DB_PATH, timeout=10)
-    conn.row_factory = sqlite3.Row
-    conn.execute("PRAGMA busy_timeout = 5000;")
-    conn.execute("PRAGMA foreign_keys = ON;")
-    return conn
+    # Inside a request (or app context) every call shares one pooled
+    # connection, stored on flask.g and given back in close_connection().
+    if has_app_context():
+        if "db_conn" not in g:
+            g.db_conn = get_pool().acquire()
+            if app.config["SQL_INSTRUMENTATION"]:
+                g.db_conn = instrument.TimedConnection(
+                    g.db_conn, instrument.RequestStats(app.config["SLOW_QUERY_MS"] / 1000))
+        return g.db_conn
+    return db.open_connection(app.config["DATABASE"], setup=attach_archive)
+
+@app.teardown_appcontext
+def close_connection(exception):
+    if g.get("streaming_response"):
+        return   # still streaming; released when the stream ends
+    conn = g.pop("db_conn", None)
+    if conn is not None:
+        if isinstance(conn, instrument.TimedConnection):
+            finish_sql_stats(conn)
+            conn = conn.detach()
+        get_pool().release(conn)
+
+# ============== SQL Instrumentation ==============
+# Per request: query count, time in SQLite and the slowest statement
+# (Server-Timing header, DEBUG log on movie_rental.sql). Statements over
+# SLOW_QUERY_MS go to SLOW_QUERY_LOG with their query plan, and every
+# request feeds the per-route histograms at /admin/metrics/prometheus.
+def route_metrics():
+    metrics = app.extensions.get("route_metrics")
+    if metrics is None:
+        metrics = app.extensions["route_metrics"] = instrument.RouteMetrics(app.config["METRICS_WINDOW"])
+        log_path = app.config["SLOW_QUERY_LOG"]
+        if log_path and not instrument.slow_query_log.handlers:
+            handler = logging.FileHandler(log_path, delay=True)
+            handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+            instrument.slow_query_log.addHandler(handler)
+    return metrics
+
+def finish_sql_stats(conn):
+    """Close out the connection's statistics once; log its slow statements."""
+    if not conn.stats.finish():
+        return
+    if conn.stats.slow:
+        route_metrics()
+        instrument.log_slow_queries(conn.wrapped, conn.stats,
+                                    request.endpoint if has_request_context() else "cli")
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def add_server_timing(response):
+    g.response_status = response.status_code
+    conn = g.get("db_conn")
+    if isinstance(conn, instrument.TimedConnection) and not g.get("streaming_response"):
+        response.headers["Server-Timing"] = instrument.server_timing(conn.stats)
+    return response
+
+@app.teardown_request
+def record_request_metrics(exception):
+    if g.get("streaming_response"):
+        return
+    started = g.pop("request_started", None)
+    if started is None:
+        return
+    duration = time.perf_counter() - started
+    conn = g.get("db_conn")
+    stats = None
+    if isinstance(conn, instrument.TimedConnection):
+        stats = conn.stats
+        finish_sql_stats(conn)
+        if instrument.request_log.isEnabledFor(logging.DEBUG):
+            slowest = stats.slowest or (0.0, "-")
+            instrument.request_log.debug(
+                "%s %s: %d queries (%d of %d executes prepared), %.2f ms in SQLite, slowest %.2f ms: %s",
+                request.method, request.path, stats.queries, stats.statement_hits,
+                stats.statement_hits + stats.statement_misses, stats.db_time * 1000, slowest[0] * 1000,
+                " ".join(slowest[1].split()))
+    status = 500 if exception is not None else g.pop("response_status", 200)
+    route_metrics().observe(request.endpoint or "unmatched", status, duration, stats)
+
+# ============== Background Maintenance ==============
+# ANALYZE, WAL checkpoints, report recounts, overdue flags and
+# recommendation rebuilds run on the scheduler's threads, started with the
+# first request of each process (not under app.testing); the schedule and
+# its single-flight leases are shared through the database.
+def maintenance_scheduler():
+    scheduler = app.extensions.get("maintenance")
+    if scheduler is None:
+        scheduler = app.extensions["maintenance"] = maintenance.Scheduler(
+            lambda: get_pool().acquire(),
+            lambda conn: get_pool().release(conn),
+            write_transaction,
+            intervals={**maintenance.INTERVALS, **app.config["MAINTENANCE_INTERVALS"]},
+            jitter=app.config["MAINTENANCE_JITTER"],
+            workers=app.config["MAINTENANCE_WORKERS"],
+            on_change=bump_data_version,
+        )
+        atexit.register(scheduler.stop)
+    return scheduler
+
+@app.before_request
+def start_maintenance():
+    if app.config["MAINTENANCE_ENABLED"] and not app.testing:
+        maintenance_scheduler().start()
+
+# ============== Reference Data Cache ==============
+# Dropdown data that only changes through add_movie / seed_db. Whoever
+# writes one of these tables must invalidate its key after committing.
+CATEGORIES_KEY = "categories"
+RELEASE_YEARS_KEY = "release_years"
+ACTORS_KEY = "actors"
+
+def reference_cache():
+    get_pool()
+    return app.extensions["ref_cache"]
+
+def cached_categories(cur):
+    def load():
+        cur.execute(queries.CATEGORIES)
+        return tuple(cur.fetchall())
+    return reference_cache().get_or_load(CATEGORIES_KEY, load)
+
+def cached_release_years(cur):
+    def load():
+        cur.execute(queries.RELEASE_YEARS)
+        return tuple(row["release_year"] for row in cur.fetchall())
+    return reference_cache().get_or_load(RELEASE_YEARS_KEY, load)
+
+def cached_actors(cur):
+    def load():
+        cur.execute(queries.ACTORS)
+        return tuple(cur.fetchall())
+    return reference_cache().get_or_load(ACTORS_KEY, load)
+
+# ============== Conditional GET / Fragment Cache ==============
+# Rent, return, add movie and imports call bump_data_version() after
+# committing. Catalog pages get an ETag from the version, the URL and the
+# logged-in user (the navbar shows who it is) and answer 304 without a
+# database connection when the browser already has that page. Rendered
+# fragments are cached under the version; a bump leaves the old entries
+# unreachable until the LRU drops them.
+def data_version():
+    get_pool()
+    return app.extensions["data_version"]
+
+def fragment_cache():
+    get_pool()
+    return app.extensions["fragment_cache"]
+
+def bump_data_version():
+    return data_version().bump()
+
+def current_date():
+    return datetime.now().date()
+
+def conditional_get(f=None, vary=None):
+    """ETag / 304 for a page that only changes with the data version.
+
+    ``vary()`` returns what else the page depends on, e.g. current_date
+    for views of "the last N days", and goes into the ETag as well.
+    """
+    if f is None:
+        return lambda f: conditional_get(f, vary)
 
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        # read before the view queries: its content is at least this new
+        g.data_version, changed = data_version().current()
+        # flashed messages are shown once, so that page is not reusable
+        if "_flashes" in session:
+            return f(*args, **kwargs)
+        tag = dataversion.etag(g.data_version, request.full_path,
+                               session.get("user_id"), session.get("username"), session.get("role"),
+                               vary() if vary else None)
+        if request.if_none_match.contains_weak(tag):
+            response = Response(status=304)
+        else:
+            response = app.make_response(f(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        # Last-Modified is informational; only the ETag is validated, since
+        # it also covers the URL and the user and changes within a second
+        response.set_etag(tag)
+        if changed:
+            response.last_modified = changed
+        response.cache_control.no_cache = True
+        return response
+    return decorated_function
 
-def init_db():
-    """Create tables and sample data if database is empty."""
-    conn = get_connection()
-    cur = conn.cursor()
 
-    # Create tables (similar to MySQL schema, but in SQLite syntax)
-    cur.executescript("""
+# Original tables (similar to MySQL schema, but in SQLite syntax). Later
+# changes are migrations (migrations.py); never edit this, add a migration.
+SCHEMA_SQL = """
     PRAGMA foreign_keys = ON;
 
     CREATE TABLE IF NOT EXISTS customer (
@@ -138,13 +435,9 @@ def init_db():
         role      TEXT NOT NULL DEFAULT 'user',
         created_at TEXT NOT NULL
     );
-    """)
+    """
 
-    # If there is no movie data yet, insert sample data
-    cur.execute("SELECT COUNT(*) FROM movie")
-    (count,) = cur.fetchone()
-    if count == 0:
-        cur.executescript("""
+SAMPLE_DATA_SQL = """
         -- Categories
         INSERT INTO category (category_name) VALUES ('Comedy');
         INSERT INTO category (category_name) VALUES ('Crime');
@@ -330,25 +623,437 @@ def init_db():
         INSERT INTO payment (rental_id, amount, payment_date, payment_method) VALUES (5, 4.99, '2025-11-26 16:00:00', 'CASH');
         INSERT INTO payment (rental_id, amount, payment_date, payment_method) VALUES (6, 3.99, '2025-11-29 14:00:00', 'CARD');
         INSERT INTO payment (rental_id, amount, payment_date, payment_method) VALUES (7, 5.99, '2025-12-02 11:00:00', 'CARD');
-        """)
-        
+        """
+
+
+def schema_fingerprint():
+    """Fingerprint of SCHEMA_SQL plus every migration, as a PRAGMA user_version.
+
+    user_version is a signed 32-bit integer in the database header, so this
+    is the first 31 bits of a SHA-256 (never 0, the value of a new file).
+    """
+    digest = hashlib.sha256(" ".join(SCHEMA_SQL.split()).encode())
+    for version, description, _ in sorted(migrations.MIGRATIONS, key=lambda m: m[0]):
+        digest.update(f"\n{version}:{description}".encode())
+    return int.from_bytes(digest.digest()[:4], "big") & 0x7FFFFFFF or 1
+
+
+def init_db(force=False):
+    """Create the tables and apply pending migrations.
+
+    A database that init_db already brought up to date carries the schema
+    fingerprint in PRAGMA user_version; for those this is one header read,
+    with no DDL and no write lock, unless ``force``. Returns True if the
+    schema was (re)checked. Sample data is separate: see seed_db().
+    """
+    fingerprint = schema_fingerprint()
+    conn = get_connection()
+    (stored,) = conn.execute("PRAGMA user_version").fetchone()
+    if stored == fingerprint and not force:
+        conn.close()
+        return False
+
+    conn.executescript(SCHEMA_SQL)
+    attach_archive(conn)   # a new file: the *_history views need the tables
+    # Bring older database files up to the current schema (indexes etc.)
+    migrations.migrate(conn)
+    attach_archive(conn)   # archive tables take the columns migrations added
+    if stored != fingerprint:
+        conn.execute(f"PRAGMA user_version = {fingerprint}")
+    conn.close()
+    reference_cache().clear()
+    bump_data_version()   # a replaced or rebuilt file must not match old ETags
+    return True
+
+
+def seed_db():
+    """Add the sample data to an empty store and the default users if missing.
+
+    Returns a list of what was added.
+    """
+    conn = get_connection()
+    added = []
+    with write_transaction(conn, immediate=False):
+        (count,) = conn.execute(queries.MOVIE_COUNT).fetchone()
+        if count == 0:
+            for statement in migrations.split_statements(SAMPLE_DATA_SQL):
+                conn.execute(statement)
+            added.append("sample data")
+
         # Add default users (password: admin123 for admin, user123 for user)
-        admin_pw = hashlib.sha256("admin123".encode()).hexdigest()
-        user_pw = hashlib.sha256("user123".encode()).hexdigest()
-        cur.execute("INSERT INTO user (username, password, role, created_at) VALUES (?, ?, 'admin', datetime('now'))", ("admin", admin_pw))
-        cur.execute("INSERT INTO user (username, password, role, created_at) VALUES (?, ?, 'user', datetime('now'))", ("user", user_pw))
-    
-    # Always check if default users exist (for existing databases)
-    cur.execute("SELECT COUNT(*) FROM user WHERE username = 'admin'")
-    (admin_count,) = cur.fetchone()
-    if admin_count == 0:
-        admin_pw = hashlib.sha256("admin123".encode()).hexdigest()
-        user_pw = hashlib.sha256("user123".encode()).hexdigest()
-        cur.execute("INSERT INTO user (username, password, role, created_at) VALUES (?, ?, 'admin', datetime('now'))", ("admin", admin_pw))
-        cur.execute("INSERT INTO user (username, password, role, created_at) VALUES (?, ?, 'user', datetime('now'))", ("user", user_pw))
-
-    conn.commit()
+        if conn.execute(queries.USER_ID_BY_NAME, ("admin",)).fetchone() is None:
+            admin_pw = hashlib.sha256("admin123".encode()).hexdigest()
+            user_pw = hashlib.sha256("user123".encode()).hexdigest()
+            conn.execute(queries.INSERT_USER, ("admin", admin_pw, "admin"))
+            conn.execute(queries.INSERT_USER, ("user", user_pw, "user"))
+            added.append("default users")
+        conn.commit()
+    conn.close()
+    if added:
+        reference_cache().clear()
+        bump_data_version()
+    return added
+
+# ============== CLI Commands ==============
+@app.cli.command("init-db")
+@click.option("--seed", is_flag=True, help="Also add the sample data (see seed-db).")
+def init_db_command(seed):
+    """Create tables and apply migrations, even if the fingerprint matches."""
+    init_db(force=True)
+    click.echo(f"Database ready at {app.config['DATABASE']} (schema {schema_fingerprint():#010x})")
+    if seed:
+        _echo_seeded(seed_db())
+
+@app.cli.command("seed-db")
+def seed_db_command():
+    """Add the sample movies/customers/rentals and the default users."""
+    init_db()
+    _echo_seeded(seed_db())
+
+def _echo_seeded(added):
+    click.echo(f"Added {' and '.join(added)}" if added else "Nothing to seed: the store already has data and users")
+
+@app.cli.command("bump-data-version")
+def bump_data_version_command():
+    """Invalidate cached catalog pages after editing the database outside the app."""
+    click.echo(f"Data version is now {bump_data_version()}")
+
+@app.cli.command("migrate")
+@click.option("--target", type=int, default=None, help="Stop after this schema version.")
+def migrate_command(target):
+    """Apply pending schema migrations."""
+    conn = get_connection()
+    before = migrations.current_version(conn)
+    applied = migrations.migrate(conn, target=target)
+    conn.close()
+    if applied:
+        click.echo(f"Migrated schema {before} -> {applied[-1]} (applied {', '.join(map(str, applied))})")
+    else:
+        click.echo(f"Schema already at version {before}")
+
+@app.cli.command("rebuild-search")
+def rebuild_search_command():
+    """Re-index every movie in the full-text search table."""
+    conn = get_connection()
+    with write_transaction(conn):
+        search.rebuild_search_index(conn)
+        conn.commit()
+    conn.close()
+    click.echo("Search index rebuilt")
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """Recompute the report summary tables from scratch."""
+    conn = get_connection()
+    with write_transaction(conn):
+        drift = stats.rebuild(conn)
+        conn.commit()
+    conn.close()
+    if drift:
+        bump_data_version()
+    for name, (old, new) in sorted(drift.items()):
+        click.echo(f"  {name}: {old} -> {new}")
+    click.echo(f"Report statistics rebuilt ({len(drift)} counters corrected)")
+
+@app.cli.command("rebuild-copy-counters")
+@click.option("--check", is_flag=True, help="Only report drift; exit 1 if any is found.")
+def rebuild_copy_counters_command(check):
+    """Recount movie.total_copies / available_copies from inventory_copy."""
+    conn = get_connection()
+    with write_transaction(conn):
+        drift = availability.drift(conn) if check else availability.rebuild(conn)
+        conn.commit()
+    conn.close()
+    if drift and not check:
+        bump_data_version()
+    for d in drift:
+        click.echo(f"  movie {d.movie_id}: total {d.total_copies} -> {d.actual_total}, "
+                   f"available {d.available_copies} -> {d.actual_available}")
+    if check:
+        click.echo(f"{len(drift)} movies with drifted copy counters")
+        if drift:
+            raise SystemExit(1)
+    else:
+        click.echo(f"Copy counters rebuilt ({len(drift)} movies corrected)")
+
+@app.cli.command("rebuild-recommendations")
+def rebuild_recommendations_command():
+    """Recompute the "also rented" lists from the whole rental history (needs NumPy)."""
+    conn = get_connection()
+    try:
+        timings = recommend.refresh(conn, write_transaction)
+    except RuntimeError as exc:
+        raise click.ClickException(str(exc))
     conn.close()
+    bump_data_version()
+    caught_up = timings["folded"]   # rentals made while computing
+    click.echo(f"Rebuilt {timings['rows']} recommendations from {timings['pairs']} customer/movie pairs "
+               f"(load {timings['load']:.2f}s, count {timings['count']:.2f}s, store {timings['store']:.2f}s"
+               f"{f', {caught_up} newer rentals folded' if caught_up else ''})")
+
+@app.cli.command("rebuild-rollups")
+def rebuild_rollups_command():
+    """Recompute the hourly and daily trend rollups from the whole history."""
+    conn = get_connection()
+    with write_transaction(conn):
+        written, seconds, how = rollups.rebuild(conn)
+        conn.commit()
+    conn.close()
+    bump_data_version()
+    click.echo(f"Rollups rebuilt: {written} rows in {seconds:.1f}s ({how})")
+
+@app.cli.command("assess-late-fees")
+@click.option("--batch-size", type=int, default=latefees.BATCH_SIZE, show_default=True,
+              help="Rentals assessed per transaction.")
+@click.option("--pause", type=float, default=0.0, show_default=True, help="Seconds to wait between batches.")
+def assess_late_fees_command(batch_size, pause):
+    """Flag overdue rentals and bring their late fees up to date now."""
+    conn = get_connection()
+    report = latefees.assess(conn, write_transaction, batch_size=batch_size, pause=pause)
+    conn.close()
+    if report["changed"]:
+        bump_data_version()
+    click.echo(f"{report['assessed']} overdue rentals, ${report['accruing']:.2f} in late fees accruing "
+               f"({report['changed'] and 'updated' or 'unchanged'}, {report['cleared']} flags cleared, "
+               f"{report['batches']} batches in {report['elapsed']:.2f}s)")
+
+@app.cli.command("archive-rentals")
+@click.option("--older-than", "days", type=int, default=None,
+              help="Move rentals returned more than this many days ago (default: ARCHIVE_AFTER_DAYS).")
+@click.option("--batch-size", type=int, default=archive.BATCH_SIZE, show_default=True,
+              help="Rentals moved per transaction.")
+@click.option("--limit", type=int, default=None, help="Stop after this many rentals.")
+@click.option("--pause", type=float, default=0.0, show_default=True, help="Seconds to wait between batches.")
+@click.option("--vacuum", is_flag=True, help="VACUUM the hot file afterwards to give the freed pages back.")
+def archive_rentals_command(days, batch_size, limit, pause, vacuum):
+    """Move old returned rentals and their payments to the archive database."""
+    days = app.config["ARCHIVE_AFTER_DAYS"] if days is None else days
+    before = archive.cutoff_for(days)
+    conn = get_connection()
+
+    def progress(report):
+        click.echo(f"  {report['rentals']} rentals moved in {report['batches']} batches, {report['elapsed']:.1f}s")
+
+    report = archive.archive_rentals(conn, write_transaction, before, batch_size=batch_size, limit=limit,
+                                     pause=pause, progress=progress)
+    if vacuum:
+        conn.execute("VACUUM main")
+    status = archive.status(conn)
+    conn.close()
+    # nothing a page shows changes: report totals and recommendations keep
+    # counting archived rentals, so there is no data version bump
+    click.echo(f"Archived {report['rentals']} rentals returned before {before} in {report['elapsed']:.1f}s")
+    for schema, label in (("main", "hot"), (archive.SCHEMA, "archive")):
+        sizes = status[schema]
+        click.echo(f"  {label}: {sizes['rental']} rentals, {sizes['payment']} payments, "
+                   f"{sizes['bytes'] / 2**20:.1f} MB ({sizes['free_bytes'] / 2**20:.1f} MB free)")
+
+@app.cli.command("changes")
+@click.option("--since", type=int, default=0, show_default=True, help="Last seq already applied.")
+@click.option("--tables", default="", help="Comma-separated tables (default: all of them).")
+@click.option("--batch-size", type=int, default=changelog.BATCH_SIZE, show_default=True,
+              help="Entries read per query.")
+@click.option("--follow", is_flag=True, help="Keep polling for new changes until interrupted.")
+@click.option("--poll", type=float, default=2.0, show_default=True, help="Seconds between polls with --follow.")
+def changes_command(since, tables, batch_size, follow, poll):
+    """Print the change log after seq SINCE as JSON lines (one per entry)."""
+    tables = [name.strip() for name in tables.split(",") if name.strip()]
+    conn = get_connection()
+    try:
+        while True:
+            batch = changelog.read_changes(conn, since, batch_size, tables)
+            for change in batch.changes:
+                click.echo(json.dumps(change, separators=(",", ":")))
+            since = batch.next_since
+            if batch.more:
+                continue
+            if not follow:
+                break
+            time.sleep(poll)
+    except changelog.Purged as exc:
+        raise click.ClickException(f"{exc}; export again, then follow from seq {changelog.last_seq(conn)}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        conn.close()
+    click.echo(f"next since: {since}", err=True)
+
+@app.cli.command("compact-changes")
+@click.option("--retention-days", type=int, default=changelog.RETENTION_DAYS, show_default=True,
+              help="Purge entries older than this.")
+def compact_changes_command(retention_days):
+    """Purge old change log entries and drop superseded ones now."""
+    conn = get_connection()
+    purged = changelog.purge(conn, write_transaction, retention_days)
+    compacted = changelog.compact(conn, write_transaction)
+    status = changelog.status(conn)
+    conn.close()
+    click.echo(f"Purged {purged} and compacted {compacted} entries; {status['entries']} left "
+               f"(seq {status['oldest_seq']}..{status['last_seq']}, purged through {status['purged_through']})")
+
+def restore_backup(path):
+    """Restore a snapshot (backup.restore) over the configured database and archive.
+
+    The restored schema is re-checked and migrated if it is older, and the
+    data version bumped; leases the snapshot caught jobs holding are let go.
+    The change log is fenced (changelog.fence) past the seq it had reached,
+    so sync readers export again instead of skipping the reused numbers.
+    """
+    conn = get_connection()
+    seq_before = changelog.last_seq(conn)
+    conn.close()
+    manifest = backup.restore(path, app.config["DATABASE"], archive_path())
+    init_db(force=True)
+    conn = get_connection()
+    with write_transaction(conn):
+        conn.execute(queries.RELEASE_MAINTENANCE_LEASES)
+        changelog.fence(conn, seq_before)
+        conn.commit()
+    conn.close()
+    return manifest
+
+@app.cli.command("backup")
+@click.option("--dir", "directory", default=None, help="Snapshot directory (default: backups/ next to the database).")
+@click.option("--keep", type=int, default=backup.KEEP, show_default=True,
+              help="Snapshots to keep; older ones are deleted (0 keeps all).")
+@click.option("--pages", type=int, default=backup.PAGES, show_default=True, help="Pages copied per step.")
+@click.option("--pause", type=float, default=backup.PAUSE, show_default=True, help="Seconds to wait between steps.")
+@click.option("--list", "list_only", is_flag=True, help="List the snapshots instead of taking one.")
+def backup_command(directory, keep, pages, pause, list_only):
+    """Take an online snapshot of the database and its archive."""
+    directory = directory or backup.default_dir(app.config["DATABASE"])
+    if list_only:
+        for path, manifest in backup.snapshots(directory):
+            size = sum(entry["bytes"] for entry in manifest["files"].values())
+            click.echo(f"{path}  {manifest['created']}  {size / 2**20:.1f} MB")
+        return
+    conn = get_connection()
+    manifest = backup.snapshot(conn, directory, keep=keep, pages=pages, pause=pause)
+    conn.close()
+    click.echo(f"Snapshot {manifest['path']} in {manifest['seconds']:.2f}s")
+    for filename, entry in manifest["files"].items():
+        click.echo(f"  {filename}: {entry['bytes'] / 2**20:.1f} MB in {entry['steps']} steps "
+                   f"({entry['restarts']} restarts), sha256 {entry['sha256'][:16]}...")
+    for path in manifest["removed"]:
+        click.echo(f"  removed {path}")
+
+@app.cli.command("verify-backup")
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+def verify_backup_command(path):
+    """Check a snapshot's files against their checksums."""
+    try:
+        manifest = backup.verify(path)
+    except backup.SnapshotError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"OK: {', '.join(manifest['files'])} match their checksums (taken {manifest['created']})")
+
+@app.cli.command("restore-backup")
+@click.argument("path", type=click.Path(exists=True, file_okay=False))
+@click.confirmation_option(prompt="Overwrite the database (and archive) with this snapshot?")
+def restore_backup_command(path):
+    """Verify a snapshot, then restore it over the database and archive."""
+    try:
+        manifest = restore_backup(path)
+    except backup.SnapshotError as exc:
+        raise click.ClickException(f"{exc}; nothing was restored")
+    click.echo(f"Restored {app.config['DATABASE']} from {path} (taken {manifest['created']})")
+
+@app.cli.command("clone-db")
+@click.argument("template", type=click.Path(exists=True, dir_okay=False))
+@click.argument("target", type=click.Path(dir_okay=False))
+def clone_db_command(template, target):
+    """Copy a template database (and its archive) to TARGET, e.g. for test fixtures."""
+    started = time.perf_counter()
+    backup.clone(template, target)
+    click.echo(f"Cloned {template} to {target} in {time.perf_counter() - started:.2f}s")
+
+@app.cli.command("run-maintenance")
+@click.argument("jobs", nargs=-1, type=click.Choice(list(maintenance.JOBS)))
+def run_maintenance_command(jobs):
+    """Run maintenance jobs now; with no JOBS, every scheduled job that is due.
+
+    Stands in for the in-process scheduler where MAINTENANCE_ENABLED is off
+    (e.g. from cron): the schedule and its leases are the same.
+    """
+    scheduler = maintenance_scheduler()
+    conn = get_connection()
+    names = jobs or [job for job, interval in scheduler.intervals.items() if interval is not None]
+    for job in names:
+        result = scheduler.run(conn, job, force=bool(jobs))
+        if result is None:
+            click.echo(f"  {job}: not due, or running elsewhere")
+            continue
+        outcome, seconds, detail = result
+        click.echo(f"  {job}: {outcome} in {seconds * 1000:.1f} ms {detail}")
+        if outcome == "error" and jobs:
+            conn.close()
+            raise SystemExit(1)
+    conn.close()
+
+@app.cli.command("import-catalog")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(importer.FORMATS), default=None,
+              help="Input format (default: from the file extension).")
+@click.option("--chunk-size", type=int, default=importer.CHUNK_SIZE, show_default=True,
+              help="Records per transaction.")
+@click.option("--restart", is_flag=True, help="Import from the top even if this file was seen before.")
+def import_catalog_command(path, fmt, chunk_size, restart):
+    """Bulk-import movies from a CSV or JSON Lines file (resumable)."""
+    conn = get_connection()
+
+    def progress(report):
+        click.echo(f"  {report['rows_done']} records, {report['movies_added']} movies, "
+                   f"{report['rows_per_sec']:.0f} rows/s")
+
+    try:
+        report = importer.import_file(conn, write_transaction, path, fmt=fmt, chunk_size=chunk_size,
+                                      restart=restart, progress=progress)
+    except importer.ImportFailed as exc:
+        conn.close()
+        raise click.ClickException(str(exc))
+    finally:
+        reference_cache().clear()
+        bump_data_version()
+    conn.close()
+    for error in report["errors"]:
+        click.echo(f"  skipped {error}")
+    click.echo(
+        f"Imported {report['movies_added']} movies and {report['copies_added']} copies from "
+        f"{report['source']} ({report['rows_skipped']} records skipped, "
+        f"{report['categories_created']} categories and {report['actors_created']} actors created) "
+        f"in {report['elapsed']:.1f}s, {report['rows_per_sec']:.0f} rows/s"
+        + (f"; resumed at record {report['resumed_from']}" if report["resumed_from"] else "")
+    )
+
+@app.cli.command("check-query-plans")
+def check_query_plans_command():
+    """Fail if any route query or registry statement does a full table scan."""
+    conn = get_connection()
+    failures = query_plans.check(conn) + query_plans.check_registry(conn)
+    conn.close()
+    for route, name, scans, plan in failures:
+        click.echo(f"FULL SCAN {route} [{name}]: {', '.join(scans)}")
+        for step in plan:
+            click.echo(f"    {step}")
+    if failures:
+        raise SystemExit(1)
+    count = len(queries.statements())
+    click.echo(f"OK: {len(query_plans.ROUTE_QUERIES)} route queries and {count} registry statements use indexes")
+    if count > app.config["DB_CACHED_STATEMENTS"]:
+        click.echo(f"warning: DB_CACHED_STATEMENTS ({app.config['DB_CACHED_STATEMENTS']}) "
+                   f"is smaller than the {count} registry statements")
+
+@app.template_global()
+def page_url(prefix="", after=None, before=None):
+    """URL of the current page with a different keyset cursor."""
+    args = request.args.to_dict()
+    args.pop(prefix + "after", None)
+    args.pop(prefix + "before", None)
+    if after:
+        args[prefix + "after"] = after
+    if before:
+        args[prefix + "before"] = before
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
 
 @app.route("/")
 def home():
@@ -367,7 +1072,7 @@ def login():
         
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("SELECT user_id, username, password, role FROM user WHERE username = ?", (username,))
+        cur.execute(queries.USER_BY_NAME, (username,))
         user = cur.fetchone()
         conn.close()
         
@@ -405,19 +1110,17 @@ def register():
         conn = get_connection()
         cur = conn.cursor()
         
-        # Check if username exists
-        cur.execute("SELECT user_id FROM user WHERE username = ?", (username,))
-        if cur.fetchone():
-            conn.close()
-            flash("Username already exists.", "error")
-            return render_template("register.html")
-        
-        # Create new user
-        cur.execute(
-            "INSERT INTO user (username, password, role, created_at) VALUES (?, ?, 'user', datetime('now'))",
-            (username, hash_password(password))
-        )
-        conn.commit()
+        with write_transaction(conn):
+            # Check if username exists
+            cur.execute(queries.USER_ID_BY_NAME, (username,))
+            if cur.fetchone():
+                conn.close()
+                flash("Username already exists.", "error")
+                return render_template("register.html")
+            
+            # Create new user
+            cur.execute(queries.INSERT_USER, (username, hash_password(password), "user"))
+            conn.commit()
         conn.close()
         
         flash("Registration successful! Please log in.", "success")
@@ -432,90 +1135,31 @@ def logout():
     return redirect(url_for("home"))
 
 @app.route("/movies")
+@conditional_get
 def browse_movies():
     keyword = request.args.get("keyword", "").strip()
     category_id = request.args.get("category_id", "").strip()
     year = request.args.get("year", "").strip()
     min_rating = request.args.get("min_rating", "").strip()
-    sort_by = request.args.get("sort_by", "title")
+    match = search.match_query(keyword)
+    sort_by = request.args.get("sort_by", "relevance" if match else "title")
     sort_dir = request.args.get("sort_dir", "asc")
 
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT category_id, category_name FROM category ORDER BY category_name;")
-    categories = cur.fetchall()
+    categories = cached_categories(cur)
+    years = cached_release_years(cur)
 
-    cur.execute(
-        """
-        SELECT DISTINCT release_year
-        FROM movie
-        WHERE release_year IS NOT NULL
-        ORDER BY release_year DESC;
-        """
-    )
-    years = [row["release_year"] for row in cur.fetchall()]
-
-    base_query = """
-        SELECT
-            m.movie_id,
-            m.title,
-            m.release_year,
-            m.mpaa_rating,
-            m.movie_rating,
-            GROUP_CONCAT(DISTINCT c.category_name) AS categories
-        FROM movie m
-        LEFT JOIN movie_category mc ON m.movie_id = mc.movie_id
-        LEFT JOIN category c ON mc.category_id = c.category_id
-    """
-
-    conditions = []
-    params = []
-
-    if keyword:
-        conditions.append("m.title LIKE ?")
-        params.append(f"%{keyword}%")
-
-    if category_id:
-        conditions.append("c.category_id = ?")
-        params.append(category_id)
-
-    if year:
-        conditions.append("m.release_year = ?")
-        params.append(year)
-
-    if min_rating:
-        conditions.append("m.movie_rating >= ?")
-        params.append(min_rating)
-
-    if conditions:
-        base_query += " WHERE " + " AND ".join(conditions)
-
-    base_query += """
-        GROUP BY
-            m.movie_id,
-            m.title,
-            m.release_year,
-            m.mpaa_rating,
-            m.movie_rating
-    """
-
-    sort_map = {
-        "title": "m.title",
-        "year": "m.release_year",
-        "rating": "m.movie_rating",
-    }
-    order_col = sort_map.get(sort_by, "m.title")
-    order_dir = "DESC" if sort_dir == "desc" else "ASC"
-    base_query += f" ORDER BY {order_col} {order_dir};"
-
-    cur.execute(base_query, params)
-    movies = cur.fetchall()
+    # the grid depends on nothing but the query string and the data
+    key = ("movie_grid", tuple(sorted(request.args.items(multi=True))), g.data_version)
+    movie_grid = fragment_cache().get_or_load(
+        key, lambda: movie_grid_html(cur, keyword, match, category_id, year, min_rating, sort_by, sort_dir))
     conn.close()
 
     return render_template(
         "browse_movies.html",
-        movies=movies,
+        movie_grid=Markup(movie_grid),
         keyword=keyword,
         categories=categories,
         years=years,
@@ -527,27 +1171,60 @@ def browse_movies():
     )
 
 
+def keyword_filter(keyword):
+    """How /movies and /rent search for ``keyword``: (text_search, params).
+
+    The FTS5 index (title, description, actors, roles, categories) when the
+    keyword has anything indexable, else a plain title LIKE (only
+    punctuation), else no filter. See queries.TEXT_SEARCHES.
+    """
+    match = search.match_query(keyword)
+    if match:
+        return "match", [match]
+    if keyword:
+        return "like", [f"%{keyword}%"]
+    return None, []
+
+
+def movie_grid_html(cur, keyword, match, category_id, year, min_rating, sort_by, sort_dir):
+    """Run the /movies query and render its results grid (_movie_grid.html)."""
+    if sort_by == "relevance" and match:
+        sort, descending = "relevance", False
+    else:
+        sort = sort_by if sort_by in ("title", "year", "rating") else "title"
+        descending = sort_dir == "desc"
+    keyset = queries.movie_keyset(sort, descending)
+
+    text_search, params = keyword_filter(keyword)
+    for value in (category_id, year, min_rating):
+        if value:
+            params.append(value)
+    cursor_values, backwards = keyset.cursor_from(request.args)
+    if cursor_values is not None:
+        params.extend(keyset.condition(cursor_values, backwards)[1])
+    params.append(pagination.PAGE_SIZE + 1)
+
+    sql = queries.movie_page(text_search, bool(category_id), bool(year), bool(min_rating),
+                             sort, keyset.descending != backwards, cursor_values is not None)
+    cur.execute(sql, params)
+    page = keyset.page(cur.fetchall(), pagination.PAGE_SIZE, cursor_values, backwards)
+    return render_template("_movie_grid.html", movies=page.rows, page=page, keyword=keyword)
+
+
 @app.route("/movies/<int:movie_id>")
+@conditional_get
 def movie_detail(movie_id):
     conn = get_connection()
     cur = conn.cursor()
 
-    cur.execute("SELECT * FROM movie WHERE movie_id = ?", (movie_id,))
+    # total_copies / available_copies are kept on the row by triggers (availability.py)
+    cur.execute(queries.MOVIE_BY_ID, (movie_id,))
     movie = cur.fetchone()
-
-    cur.execute(
-        """
-        SELECT COUNT(*) AS total_copies,
-               SUM(CASE WHEN status = 'AVAILABLE' THEN 1 ELSE 0 END) AS available_copies
-        FROM inventory_copy
-        WHERE movie_id = ?
-        """,
-        (movie_id,),
-    )
-    availability = cur.fetchone()
+    # "customers who rented this also rented", precomputed (recommend.py)
+    also_rented = recommend.similar(conn, movie_id) if movie else []
 
     conn.close()
-    return render_template("movie_detail.html", movie=movie, availability=availability)
+    return render_template("movie_detail.html", movie=movie, also_rented=also_rented)
 
 # ============== Admin: Add Movie ==============
 @app.route("/admin/movies/add", methods=["GET", "POST"])
@@ -572,43 +1249,43 @@ def add_movie():
         
         if not title:
             flash("Movie title is required.", "error")
-            cur.execute("SELECT * FROM category ORDER BY category_name")
-            categories = cur.fetchall()
-            cur.execute("SELECT * FROM actor ORDER BY actor_name")
-            actors = cur.fetchall()
+            categories = cached_categories(cur)
+            actors = cached_actors(cur)
             conn.close()
             return render_template("add_movie.html", categories=categories, actors=actors)
         
         try:
-            # Insert movie
-            cur.execute("""
-                INSERT INTO movie (title, release_year, mpaa_rating, length_minutes, movie_rating, description, rental_rate, late_fee)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                title,
-                int(release_year) if release_year else None,
-                mpaa_rating or None,
-                int(length_minutes) if length_minutes else None,
-                float(movie_rating) if movie_rating else None,
-                description or None,
-                float(rental_rate),
-                float(late_fee)
-            ))
-            movie_id = cur.lastrowid
+            with write_transaction(conn):
+                # Insert movie
+                cur.execute(queries.INSERT_MOVIE, (
+                    title,
+                    int(release_year) if release_year else None,
+                    mpaa_rating or None,
+                    int(length_minutes) if length_minutes else None,
+                    float(movie_rating) if movie_rating else None,
+                    description or None,
+                    float(rental_rate),
+                    float(late_fee)
+                ))
+                movie_id = cur.lastrowid
             
-            # Insert movie-category relationships
-            for cat_id in category_ids:
-                cur.execute("INSERT INTO movie_category (movie_id, category_id) VALUES (?, ?)", (movie_id, cat_id))
+                # Insert movie-category relationships
+                for cat_id in category_ids:
+                    cur.execute(queries.INSERT_MOVIE_CATEGORY, (movie_id, cat_id))
             
-            # Insert movie-actor relationships
-            for actor_id in actor_ids:
-                cur.execute("INSERT INTO movie_actor (movie_id, actor_id) VALUES (?, ?)", (movie_id, actor_id))
+                # Insert movie-actor relationships
+                for actor_id in actor_ids:
+                    cur.execute(queries.INSERT_MOVIE_ACTOR, (movie_id, actor_id))
             
-            # Insert inventory copies
-            for _ in range(int(num_copies)):
-                cur.execute("INSERT INTO inventory_copy (movie_id, status, store_location) VALUES (?, 'AVAILABLE', ?)", (movie_id, store_location))
+                # Insert inventory copies
+                for _ in range(int(num_copies)):
+                    cur.execute(queries.INSERT_COPY, (movie_id, store_location))
             
-            conn.commit()
+                conn.commit()
+            # a new movie can add a year to the browse filter; categories
+            # and actors are only linked, not created, here
+            reference_cache().invalidate(RELEASE_YEARS_KEY)
+            bump_data_version()
             flash(f"Movie '{title}' added successfully with {num_copies} copies!", "success")
             conn.close()
             return redirect(url_for("movie_detail", movie_id=movie_id))
@@ -618,21 +1295,108 @@ def add_movie():
             flash(f"Error adding movie: {str(e)}", "error")
     
     # GET: show form
-    cur.execute("SELECT * FROM category ORDER BY category_name")
-    categories = cur.fetchall()
-    cur.execute("SELECT * FROM actor ORDER BY actor_name")
-    actors = cur.fetchall()
+    categories = cached_categories(cur)
+    actors = cached_actors(cur)
     conn.close()
     return render_template("add_movie.html", categories=categories, actors=actors)
 
+# ============== Admin: Import Catalog ==============
+@app.route("/admin/import", methods=["GET", "POST"])
+@admin_required
+def import_catalog():
+    conn = get_connection()
+
+    if request.method == "POST":
+        upload = request.files.get("catalog")
+        if upload is None or not upload.filename:
+            flash("Choose a CSV or JSON Lines file to import.", "error")
+            conn.close()
+            return redirect(url_for("import_catalog"))
+
+        # the importer streams from disk and fingerprints the file to resume
+        fd, path = tempfile.mkstemp(suffix=os.path.splitext(upload.filename)[1])
+        try:
+            with os.fdopen(fd, "wb") as f:
+                upload.save(f)
+            report = importer.import_file(conn, write_transaction, path, source=upload.filename,
+                                          restart=bool(request.form.get("restart")))
+        except importer.ImportFailed as exc:
+            flash(str(exc), "error")
+        else:
+            flash(
+                f"Imported {report['movies_added']} movies and {report['copies_added']} copies from "
+                f"{report['source']} in {report['elapsed']:.1f}s ({report['rows_per_sec']:.0f} rows/s)."
+                + (f" Resumed at record {report['resumed_from']}." if report["resumed_from"] else ""),
+                "success",
+            )
+            if report["rows_skipped"]:
+                flash(f"{report['rows_skipped']} record(s) skipped: " + "; ".join(report["errors"]), "error")
+        finally:
+            os.remove(path)
+            reference_cache().clear()
+            bump_data_version()
+        conn.close()
+        return redirect(url_for("import_catalog"))
+
+    jobs = importer.recent_jobs(conn)
+    conn.close()
+    return render_template("import_catalog.html", jobs=jobs, chunk_size=importer.CHUNK_SIZE)
+
 @app.route("/customers")
 def customers():
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT * FROM customer ORDER BY last_name, first_name")
-    customers = cur.fetchall()
+    keyset = pagination.Keyset(queries.CUSTOMER_COLUMNS)
+    cursor_values, backwards = keyset.cursor_from(request.args)
+    params = []
+    if cursor_values is not None:
+        params = keyset.condition(cursor_values, backwards)[1]
+    params.append(pagination.PAGE_SIZE + 1)
+    cur.execute(queries.customer_page(backwards, cursor_values is not None), params)
+    page = keyset.page(cur.fetchall(), pagination.PAGE_SIZE, cursor_values, backwards)
+
+    cur.execute(queries.CUSTOMER_COUNT)
+    total_customers = cur.fetchone()["total"]
     conn.close()
-    return render_template("customers.html", customers=customers)
+    return render_template("customers.html", customers=page.rows, page=page, total_customers=total_customers)
+
+def fold_recommendations(conn):
+    """Fold new rentals into the "also rented" lists (recommend.fold).
+
+    Runs after the checkout has committed, in its own short BEGIN IMMEDIATE
+    transaction, so two folds never read the same lists and both write them.
+    If the database is busy it gives up; the next fold picks the rentals up.
+    Any other failure is logged: the checkout has committed either way.
+    """
+    try:
+        with write_transaction(conn, immediate=True):
+            folded = recommend.fold(conn)
+            conn.commit()
+    except sqlite3.OperationalError as exc:
+        if not rentals.is_busy(exc):
+            app.logger.exception("folding new rentals into the recommendations failed")
+        return 0
+    except Exception:
+        app.logger.exception("folding new rentals into the recommendations failed")
+        return 0
+    return folded
+
+def customer_choices(cur):
+    """One keyset page of the /rent customer dropdown (cust_after/cust_before)."""
+    keyset = pagination.Keyset(queries.CUSTOMER_COLUMNS)
+    cursor_values, backwards = keyset.cursor_from(request.args, prefix="cust_")
+    params = []
+    if cursor_values is not None:
+        params = keyset.condition(cursor_values, backwards)[1]
+    params.append(pagination.PAGE_SIZE + 1)
+    cur.execute(queries.customer_choices(backwards, cursor_values is not None), params)
+    return keyset.page(cur.fetchall(), pagination.PAGE_SIZE, cursor_values, backwards)
+
+def checkout_integrity_message(exc):
+    """What to tell the clerk when a checkout breaks a constraint."""
+    if rentals.is_unknown_customer(exc):
+        return "Unknown customer."
+    return "A customer with that email already exists."
 
 @app.route("/rent", methods=["GET", "POST"])
 def rent_movie():
@@ -659,122 +1423,169 @@ def rent_movie():
                 flash("Please fill in first name, last name, and email for the new customer.", "error")
 
             
-                cur.execute("SELECT movie_id, title FROM movie ORDER BY title")
+                cur.execute(queries.MOVIE_TITLES)
                 movies = cur.fetchall()
-                cur.execute(
-                    """
-                    SELECT customer_id,
-                           first_name || ' ' || last_name AS name
-                    FROM customer
-                    ORDER BY last_name, first_name
-                    """
-                )
-                customers = cur.fetchall()
-                cur.execute("SELECT * FROM category ORDER BY category_name")
-                categories = cur.fetchall()
+                customer_page = customer_choices(cur)
+                categories = cached_categories(cur)
                 conn.close()
-                return render_template("rent.html", movies=movies, customers=customers, categories=categories, keyword=keyword, selected_category=category_id)
-
-        
-            cur.execute(
-                """
-                INSERT INTO customer (first_name, last_name, email, phone, address, signup_date)
-                VALUES (?, ?, ?, ?, ?, DATE('now'))
-                """,
-                (first_name, last_name, email, phone, address),
-            )
-            customer_id = cur.lastrowid 
+                return render_template("rent.html", movies=movies, customers=customer_page.rows, customer_page=customer_page, categories=categories, keyword=keyword, selected_category=category_id)
 
-    
-        cur.execute(
-            """
-            SELECT copy_id
-            FROM inventory_copy
-            WHERE movie_id = ? AND status = 'AVAILABLE'
-            LIMIT 1
-            """,
-            (movie_id,),
-        )
-        copy = cur.fetchone()
+        new_customer = None
+        if customer_id == "new":
+            new_customer = {"first_name": first_name, "last_name": last_name,
+                            "email": email, "phone": phone, "address": address}
 
-        if not copy:
-            flash("No available copies for this movie.", "error")
+        # claim a copy and book the rental in one BEGIN IMMEDIATE
+        # transaction, retried with backoff while the database is busy
+        try:
+            rental = rentals.checkout(conn, write_transaction, customer_id, movie_id,
+                                      new_customer=new_customer)
+        except sqlite3.IntegrityError as exc:
+            flash(checkout_integrity_message(exc), "error")
+        except sqlite3.OperationalError as exc:
+            if not rentals.is_busy(exc):
+                raise
+            flash("The store is busy right now, please try again.", "error")
         else:
-            copy_id = copy["copy_id"]
-            rental_date = datetime.now()
-            due_date = rental_date + timedelta(days=5)
-
-        
-            cur.execute(
-                """
-                INSERT INTO rental (customer_id, copy_id, rental_date, due_date, rental_status)
-                VALUES (?, ?, ?, ?, 'OPEN')
-                """,
-                (
-                    customer_id,
-                    copy_id,
-                    rental_date.isoformat(timespec="seconds"),
-                    due_date.isoformat(timespec="seconds"),
-                ),
-            )
-
-        
-            cur.execute(
-                """
-                UPDATE inventory_copy
-                SET status = 'RENTED'
-                WHERE copy_id = ?
-                """,
-                (copy_id,),
-            )
-
-            conn.commit()
-            flash("Rental created successfully.", "success")
+            if rental is None:
+                flash("No available copies for this movie.", "error")
+            else:
+                fold_recommendations(conn)
+                bump_data_version()
+                flash("Rental created successfully.", "success")
 
         conn.close()
         return redirect(url_for("rent_movie"))
 
     # GET: show form with search
-    # Build movie query with filters
-    movie_query = """
-        SELECT DISTINCT m.movie_id, m.title,
-               (SELECT COUNT(*) FROM inventory_copy ic WHERE ic.movie_id = m.movie_id AND ic.status = 'AVAILABLE') as available
-        FROM movie m
-        LEFT JOIN movie_category mc ON m.movie_id = mc.movie_id
-        WHERE 1=1
-    """
-    params = []
-    
-    if keyword:
-        movie_query += " AND m.title LIKE ?"
-        params.append(f"%{keyword}%")
-    
+    text_search, params = keyword_filter(keyword)
     if category_id:
-        movie_query += " AND mc.category_id = ?"
         params.append(category_id)
-    
-    movie_query += " ORDER BY m.title"
-    
-    cur.execute(movie_query, params)
+    cur.execute(queries.rent_movies(text_search, bool(category_id)), params)
     movies = cur.fetchall()
     
     # Get categories for filter dropdown
-    cur.execute("SELECT * FROM category ORDER BY category_name")
-    categories = cur.fetchall()
+    categories = cached_categories(cur)
 
-    cur.execute(
-        """
-        SELECT customer_id,
-               first_name || ' ' || last_name AS name
-        FROM customer
-        ORDER BY last_name, first_name
-        """
-    )
-    customers = cur.fetchall()
+    customer_page = customer_choices(cur)
 
     conn.close()
-    return render_template("rent.html", movies=movies, customers=customers, categories=categories, keyword=keyword, selected_category=category_id)
+    return render_template("rent.html", movies=movies, customers=customer_page.rows, customer_page=customer_page, categories=categories, keyword=keyword, selected_category=category_id)
+
+
+# ============== Batch Rent / Return ==============
+def batch_request(list_field):
+    """Read a batch from a JSON body or a form post.
 
+    Returns (fields, ids, is_json): ``fields`` is the JSON object or the
+    form, ``ids`` the list under ``list_field``.
+    """
+    payload = request.get_json(silent=True) if request.is_json else None
+    if isinstance(payload, dict):
+        ids = payload.get(list_field) or []
+        return payload, ids if isinstance(ids, list) else [ids], True
+    return request.form, request.form.getlist(list_field), False
+
+def batch_error(message, is_json, endpoint):
+    if is_json:
+        return jsonify(error=message), 400
+    flash(message, "error")
+    return redirect(url_for(endpoint))
+
+def batch_result(items, is_json, endpoint, done_message, **extra):
+    """JSON per-item results, or one flash line per basket for the form."""
+    done = sum(item.ok for item in items)
+    if is_json:
+        return jsonify(
+            results=[
+                {"id": item.key, "ok": item.ok, "rental_id": item.rental_id,
+                 "copy_id": item.copy_id, "error": item.error}
+                for item in items
+            ],
+            succeeded=done,
+            failed=len(items) - done,
+            **extra,
+        )
+    if done:
+        flash(done_message.format(done=done, total=len(items)), "success")
+    for item in items:
+        if not item.ok:
+            flash(f"#{item.key}: {item.error}", "error")
+    return redirect(url_for(endpoint))
+
+NEW_CUSTOMER_FIELDS = ("first_name", "last_name", "email", "phone", "address")
+
+@app.route("/rent/batch", methods=["POST"])
+def rent_batch():
+    """Rent several titles to one customer in a single transaction."""
+    fields, movie_ids, is_json = batch_request("movie_ids")
+    if not movie_ids:
+        return batch_error("Choose at least one movie.", is_json, "rent_movie")
+    if len(movie_ids) > rentals.MAX_BATCH:
+        return batch_error(f"At most {rentals.MAX_BATCH} movies per rental.", is_json, "rent_movie")
+
+    customer_id = fields.get("customer_id")
+    new_customer = None
+    if is_json and fields.get("new_customer") is not None:
+        details = fields["new_customer"]
+        if not isinstance(details, dict) or not all(
+                isinstance(details.get(key), (str, type(None))) for key in NEW_CUSTOMER_FIELDS):
+            return batch_error("new_customer must be an object whose "
+                               + ", ".join(NEW_CUSTOMER_FIELDS) + " are strings.", is_json, "rent_movie")
+        new_customer = {key: (details.get(key) or "").strip() for key in NEW_CUSTOMER_FIELDS}
+    elif not is_json and customer_id == "new":
+        new_customer = {key: (fields.get("new_" + key) or "").strip() for key in NEW_CUSTOMER_FIELDS}
+    if new_customer is not None and not all(new_customer[k] for k in ("first_name", "last_name", "email")):
+        return batch_error("Please fill in first name, last name, and email for the new customer.",
+                           is_json, "rent_movie")
+    if new_customer is None:
+        if customer_id is None or customer_id == "":
+            return batch_error("Choose a customer.", is_json, "rent_movie")
+        customer_id = rentals.parse_id(customer_id)
+        if customer_id is None:
+            return batch_error("Unknown customer.", is_json, "rent_movie")
+
+    conn = get_connection()
+    try:
+        customer_id, items = rentals.checkout_batch(conn, write_transaction, customer_id, movie_ids,
+                                                    new_customer=new_customer)
+    except sqlite3.IntegrityError as exc:
+        return batch_error(checkout_integrity_message(exc), is_json, "rent_movie")
+    except sqlite3.OperationalError as exc:
+        if not rentals.is_busy(exc):
+            raise
+        return batch_error("The store is busy right now, please try again.", is_json, "rent_movie")
+    finally:
+        conn.close()
+    rented = any(item.ok for item in items)
+    if rented:
+        fold_recommendations(conn)
+        bump_data_version()
+    # nothing rented, nothing committed: a new customer was rolled back too
+    return batch_result(items, is_json, "rent_movie", "Rented {done} of {total} movie(s).",
+                        customer_id=customer_id if rented else None)
+
+@app.route("/return/batch", methods=["POST"])
+def return_batch():
+    """Return several rentals in a single transaction."""
+    _, rental_ids, is_json = batch_request("rental_ids")
+    if not rental_ids:
+        return batch_error("Choose at least one rental.", is_json, "return_movie")
+    if len(rental_ids) > rentals.MAX_BATCH:
+        return batch_error(f"At most {rentals.MAX_BATCH} rentals per return.", is_json, "return_movie")
+
+    conn = get_connection()
+    try:
+        items = rentals.return_rentals(conn, write_transaction, rental_ids)
+    except sqlite3.OperationalError as exc:
+        if not rentals.is_busy(exc):
+            raise
+        return batch_error("The store is busy right now, please try again.", is_json, "return_movie")
+    finally:
+        conn.close()
+    if any(item.ok for item in items):
+        bump_data_version()
+    return batch_result(items, is_json, "return_movie", "Returned {done} of {total} rental(s).")
 
 @app.route("/return", methods=["GET", "POST"])
 def return_movie():
@@ -784,171 +1595,213 @@ def return_movie():
     if request.method == "POST":
         rental_id = request.form.get("rental_id")
 
-        cur.execute(
-            """
-            SELECT rental_id, copy_id
-            FROM rental
-            WHERE rental_id = ? AND rental_status = 'OPEN'
-            """,
-            (rental_id,),
-        )
-        rental = cur.fetchone()
-
-        if not rental:
-            flash("Rental not found or already closed.", "error")
-        else:
-            now = datetime.now().isoformat(timespec="seconds")
-
-            cur.execute(
-                """
-                UPDATE rental
-                SET return_date = ?, rental_status = 'RETURNED'
-                WHERE rental_id = ?
-                """,
-                (now, rental_id),
-            )
-
-            cur.execute(
-                """
-                UPDATE inventory_copy
-                SET status = 'AVAILABLE'
-                WHERE copy_id = ?
-                """,
-                (rental["copy_id"],),
-            )
-
-            conn.commit()
+        (item,) = rentals.return_rentals(conn, write_transaction, [rental_id])
+        if item.ok:
+            bump_data_version()
             flash("Movie returned successfully.", "success")
+        else:
+            flash("Rental not found or already closed.", "error")
 
         conn.close()
         return redirect(url_for("return_movie"))
 
-    cur.execute(
-        """
-        SELECT r.rental_id,
-               r.rental_date,
-               c.first_name,
-               c.last_name,
-               m.title
-        FROM rental r
-        JOIN customer c ON r.customer_id = c.customer_id
-        JOIN inventory_copy ic ON r.copy_id = ic.copy_id
-        JOIN movie m ON ic.movie_id = m.movie_id
-        WHERE r.rental_status = 'OPEN'
-        ORDER BY r.rental_date DESC
-        """
-    )
-    rentals = cur.fetchall()
+    # newest first; rental_id breaks ties between same-second rentals
+    keyset = pagination.Keyset(queries.OPEN_RENTAL_COLUMNS, descending=True)
+    cursor_values, backwards = keyset.cursor_from(request.args)
+    params = []
+    if cursor_values is not None:
+        params = keyset.condition(cursor_values, backwards)[1]
+    params.append(pagination.PAGE_SIZE + 1)
+    cur.execute(queries.open_rentals_page(not backwards, cursor_values is not None), params)
+    page = keyset.page(cur.fetchall(), pagination.PAGE_SIZE, cursor_values, backwards)
+
+    cur.execute(queries.OPEN_RENTAL_COUNT)
+    open_rentals = cur.fetchone()["total"]
 
     conn.close()
-    return render_template("return.html", rentals=rentals)
+    return render_template("return.html", rentals=page.rows, page=page, open_rentals=open_rentals)
 
 @app.route("/reports/popular")
+@conditional_get
 def popular_movies():
     conn = get_connection()
+
+    # All figures come from the summary tables kept by triggers (stats.py)
+    # instead of a dozen whole-table aggregates per page view; the same for
+    # every visitor until the next write.
+    report = fragment_cache().get_or_load(("report", g.data_version), lambda: stats.report(conn))
+
+    conn.close()
+    return render_template("popular_movies.html", **report)
+
+@app.route("/reports/trends")
+@conditional_get(vary=current_date)
+def trends():
+    grain = request.args.get("grain", "day")
+    if grain not in rollups.GRAINS:
+        grain = "day"
+    days = max(1, min(request.args.get("days", 30 if grain == "day" else 2, type=int), rollups.MAX_DAYS[grain]))
+    # one dimension at a time: a category (?key=) or a store (?store=)
+    dim = request.args.get("dim", "all")
+    key = {"category": request.args.get("key", ""), "store": request.args.get("store", "")}.get(dim, "")
+    if dim not in rollups.DIMENSIONS or (dim == "category" and not key):
+        dim, key = "all", ""
+
+    conn = get_connection()
     cur = conn.cursor()
+    # only the rollup tables (rollups.py): one row per bucket, whatever
+    # the size of the rental history
+    today = current_date()
+    series = fragment_cache().get_or_load(
+        ("trends", g.data_version, today, grain, days, dim, key),
+        lambda: rollups.trend(conn, grain, days, dim, key, today=today))
+    categories = cached_categories(cur)
+    stores = [row[0] for row in conn.execute(rollups.STORES)]
+    conn.close()
 
-    # Top rented movies
-    cur.execute(
-        """
-        SELECT m.movie_id,
-               m.title,
-               COUNT(*) AS rental_count
-        FROM rental r
-        JOIN inventory_copy ic ON r.copy_id = ic.copy_id
-        JOIN movie m ON ic.movie_id = m.movie_id
-        GROUP BY m.movie_id, m.title
-        ORDER BY rental_count DESC
-        LIMIT 10
-        """
-    )
-    movies = cur.fetchall()
-    
-    # ============== Average Statistics ==============
-    
-    # 1. Average rental duration (for returned rentals)
-    cur.execute(
-        """
-        SELECT AVG(julianday(return_date) - julianday(rental_date)) AS avg_duration
-        FROM rental
-        WHERE return_date IS NOT NULL
-        """
-    )
-    avg_duration_result = cur.fetchone()
-    avg_rental_duration = round(avg_duration_result["avg_duration"], 2) if avg_duration_result["avg_duration"] else 0
-    
-    # 2. Average rental rate per movie
-    cur.execute("SELECT AVG(rental_rate) AS avg_rate FROM movie")
-    avg_rate_result = cur.fetchone()
-    avg_rental_rate = round(avg_rate_result["avg_rate"], 2) if avg_rate_result["avg_rate"] else 0
-    
-    # 3. Average rentals per customer
-    cur.execute(
-        """
-        SELECT AVG(rental_count) AS avg_rentals
-        FROM (
-            SELECT customer_id, COUNT(*) AS rental_count
-            FROM rental
-            GROUP BY customer_id
-        )
-        """
-    )
-    avg_rentals_result = cur.fetchone()
-    avg_rentals_per_customer = round(avg_rentals_result["avg_rentals"], 2) if avg_rentals_result["avg_rentals"] else 0
-    
-    # 4. Average movie rating
-    cur.execute("SELECT AVG(movie_rating) AS avg_rating FROM movie WHERE movie_rating IS NOT NULL")
-    avg_rating_result = cur.fetchone()
-    avg_movie_rating = round(avg_rating_result["avg_rating"], 2) if avg_rating_result["avg_rating"] else 0
-    
-    # 5. Average copies per movie
-    cur.execute(
-        """
-        SELECT AVG(copy_count) AS avg_copies
-        FROM (
-            SELECT movie_id, COUNT(*) AS copy_count
-            FROM inventory_copy
-            GROUP BY movie_id
-        )
-        """
-    )
-    avg_copies_result = cur.fetchone()
-    avg_copies_per_movie = round(avg_copies_result["avg_copies"], 2) if avg_copies_result["avg_copies"] else 0
-    
-    # 6. Average payment amount
-    cur.execute("SELECT AVG(amount) AS avg_payment FROM payment")
-    avg_payment_result = cur.fetchone()
-    avg_payment_amount = round(avg_payment_result["avg_payment"], 2) if avg_payment_result["avg_payment"] else 0
-    
-    # 7. Total statistics
-    cur.execute("SELECT COUNT(*) AS total FROM movie")
-    total_movies = cur.fetchone()["total"]
-    
-    cur.execute("SELECT COUNT(*) AS total FROM customer")
-    total_customers = cur.fetchone()["total"]
-    
-    cur.execute("SELECT COUNT(*) AS total FROM rental")
-    total_rentals = cur.fetchone()["total"]
-    
-    cur.execute("SELECT COUNT(*) AS total FROM rental WHERE rental_status = 'OPEN'")
-    active_rentals = cur.fetchone()["total"]
+    width, height = 800, 160
+    activity_top = max([1] + [point["rentals"] for point in series] + [point["returns"] for point in series])
+    charts = {
+        "activity": [(name, color, rollups.polyline([point[name] for point in series], width, height,
+                                                    top=activity_top))
+                     for name, color in (("rentals", "#0d6efd"), ("returns", "#fd7e14"))],
+        "revenue": [("revenue", "#198754", rollups.polyline([point["revenue"] for point in series], width, height))],
+        "active": [("active", "#dc3545", rollups.polyline([point["active"] for point in series], width, height))],
+    }
+    totals = {name: sum(point[name] for point in series) for name in ("rentals", "returns", "revenue")}
+    return render_template("trends.html", series=series, charts=charts, totals=totals, width=width,
+                           height=height, grain=grain, days=days, dim=dim, key=key,
+                           categories=categories, stores=stores)
+
+@app.route("/reports/overdue")
+@conditional_get(vary=current_date)
+def overdue_rentals():
+    conn = get_connection()
+    cur = conn.cursor()
+
+    # overdue_rental and customer_balance are kept by the late fee engine
+    # (latefees.assess, every 15 minutes) and by triggers on returns
+    def summary():
+        return {"totals": dict(latefees.totals(conn)),
+                "balances": [dict(row) for row in conn.execute(queries.TOP_BALANCES, (10,))]}
+
+    report = fragment_cache().get_or_load(("overdue", g.data_version), summary)
+
+    keyset = pagination.Keyset(queries.OVERDUE_COLUMNS)
+    cursor_values, backwards = keyset.cursor_from(request.args)
+    params = []
+    if cursor_values is not None:
+        params = keyset.condition(cursor_values, backwards)[1]
+    params.append(pagination.PAGE_SIZE + 1)
+    cur.execute(queries.overdue_page(backwards, cursor_values is not None), params)
+    page = keyset.page(cur.fetchall(), pagination.PAGE_SIZE, cursor_values, backwards)
 
     conn.close()
-    return render_template(
-        "popular_movies.html",
-        movies=movies,
-        avg_rental_duration=avg_rental_duration,
-        avg_rental_rate=avg_rental_rate,
-        avg_rentals_per_customer=avg_rentals_per_customer,
-        avg_movie_rating=avg_movie_rating,
-        avg_copies_per_movie=avg_copies_per_movie,
-        avg_payment_amount=avg_payment_amount,
-        total_movies=total_movies,
-        total_customers=total_customers,
-        total_rentals=total_rentals,
-        active_rentals=active_rentals
-    )
+    return render_template("overdue.html", rentals=page.rows, page=page, **report)
+
+# ============== Admin: Metrics ==============
+@app.route("/admin/metrics/pool")
+@admin_required
+def pool_metrics():
+    return jsonify(pool=get_pool().stats(), writer=app.extensions["db_writer"].stats())
+
+@app.route("/admin/metrics/cache")
+@admin_required
+def cache_metrics():
+    version, changed = data_version().current()
+    return jsonify(reference=reference_cache().stats(), fragments=fragment_cache().stats(),
+                   data_version={"version": version, "changed_at": changed})
+
+@app.route("/admin/metrics/prometheus")
+@admin_required
+def prometheus_metrics():
+    """Rolling per-route latency / DB time / query histograms (this process)."""
+    body = route_metrics().prometheus()
+    if "maintenance" in app.extensions:
+        body += app.extensions["maintenance"].prometheus()
+    return Response(body, mimetype="text/plain; version=0.0.4")
+
+@app.route("/admin/maintenance")
+@admin_required
+def maintenance_status():
+    """The shared maintenance schedule, recent runs and this process's scheduler."""
+    conn = get_connection()
+    status = maintenance.status(conn)
+    conn.close()
+    return jsonify(scheduler=maintenance_scheduler().stats(), **status)
+
+@app.route("/admin/maintenance/<job>", methods=["POST"])
+@admin_required
+def trigger_maintenance(job):
+    """Queue a maintenance job to run now, due or not."""
+    if job not in maintenance.JOBS:
+        return jsonify(error=f"unknown maintenance job {job!r}", jobs=list(maintenance.JOBS)), 404
+    if not maintenance_scheduler().submit(job, force=True):
+        return jsonify(job=job, queued=False, error="already running in this process"), 409
+    return jsonify(job=job, queued=True), 202
+
+# ============== JSON API ==============
+app.register_blueprint(api.create_blueprint(get_connection, lambda: app.config["API_TOKENS"]))
+
+# ============== Application Setup ==============
+# Every route above is registered on the module's one Flask object, so
+# there is one app per process and configure_app() configures that object
+# and prepares the database; it is not a factory, and a second call
+# reconfigures the same app (same extensions, same pool). A WSGI server
+# that preloads (gunicorn --preload) calls it once in the master and then
+# forks its workers; the schema work is done by then, and each worker
+# opens its own connections on first use. Process state lives in
+# app.extensions (pool, writer queue, caches, data version mapping,
+# scheduler, metrics) and is created lazily by the helpers above, so
+# forgetting it is all a new process needs.
+PROCESS_STATE = ("db_pool", "db_writer", "ref_cache", "fragment_cache", "data_version",
+                 "maintenance", "route_metrics")
+
+def configure_app(config=None):
+    """Configure the module's app, bring its database up to date and return it.
+
+    ``config`` is applied over the current settings, then the MOVIE_RENTAL_*
+    environment variables again (``MOVIE_RENTAL_DATABASE=/srv/movierental.db``,
+    ``MOVIE_RENTAL_DB_POOL_SIZE=4``; values are parsed as JSON when they
+    can be), so they win here as they do when the module is imported by
+    the CLI. The process's connections and caches are dropped before
+    returning, so the app can be forked right away, and a call with a new
+    DATABASE starts from clean state.
+    """
+    app.config.update(config or {})
+    app.config.from_prefixed_env("MOVIE_RENTAL")
+    reset_process_state()
+    if init_db() and app.config["SEED_SAMPLE_DATA"]:
+        seed_db()      # new or outdated schema: also add sample data if empty
+    reset_process_state()
+    return app
+
+def reset_process_state(inherited=False):
+    """Drop this process's connections, caches and scheduler.
+
+    ``inherited`` state came across fork() from the parent: an SQLite
+    connection must not be used, or closed, in the child, so it is left
+    alone rather than closed.
+    """
+    for name in PROCESS_STATE:
+        state = app.extensions.pop(name, None)
+        if state is None or inherited:
+            continue
+        if name == "maintenance":
+            state.stop()
+        elif hasattr(state, "close"):
+            state.close()
+
+if hasattr(os, "register_at_fork"):
+    _inherited_state = []
+
+    def _after_fork_in_child():
+        # keep the parent's objects referenced so they are never finalized here
+        _inherited_state.append({name: app.extensions.get(name) for name in PROCESS_STATE})
+        reset_process_state(inherited=True)
+
+    os.register_at_fork(after_in_child=_after_fork_in_child)
 
 if __name__ == "__main__":
-    init_db()          # create DB + sample data if needed
-    app.run(debug=True)
+    # development server: one process, debugger and reloader on
+    configure_app({"SEED_SAMPLE_DATA": True}).run(debug=True)
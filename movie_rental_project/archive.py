@@ -0,0 +1,227 @@
+"""Old rental history moved out to an archive database file.
+
+rental and payment only ever grow, but checkout, returns and the open
+rentals list only look at OPEN rentals and recent history. archive_rentals()
+moves RETURNED rentals older than a cutoff, together with their payments,
+into a second file (``movierental-archive.db``) that every app connection
+ATTACHes as ``archive``:
+
+    main.rental / main.payment        open and recent rentals ("hot")
+    archive.rental / archive.payment  same columns, same ids, no constraints
+
+so the hot file, and the indexes the operational queries walk, stay small
+enough to live in the page cache. attach() also creates two TEMP views
+that put both halves back together for whatever needs the whole history:
+
+    rental_history   main.rental UNION ALL archive.rental
+    payment_history  main.payment UNION ALL archive.payment
+
+Moving a row is not a delete as far as the report is concerned: the ids of
+the batch being moved are listed in archive_batch for the length of its
+transaction, and the stats.py delete triggers skip those rows, so the
+report totals keep counting archived rentals (stats.rebuild() recounts
+from the views).
+
+A transaction that writes to both files is not atomic across them in WAL
+mode (SQLite commits one file, then the other), so a batch is two: the
+rows are copied into the archive (INSERT OR REPLACE) and committed, then
+deleted from the hot tables, only if the archive has them, and committed.
+A crash in between leaves the batch in both files (rental_history shows
+it twice) until the next run copies it again and finishes the move; it
+never leaves it in neither.
+"""
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+SCHEMA = "archive"
+
+# rentals returned more than this many days ago are moved by default
+ARCHIVE_AFTER_DAYS = 365
+
+# rentals moved per write transaction; between batches other writers get in
+BATCH_SIZE = 2000
+
+# archived tables, in the order their rows are deleted from main (a
+# payment references its rental)
+ARCHIVED = ("payment", "rental")
+
+TABLES = """
+-- rental ids of the batch being moved, filled and emptied inside one write
+-- transaction. The stats delete triggers skip these rows
+CREATE TABLE IF NOT EXISTS archive_batch (
+    rental_id INTEGER PRIMARY KEY
+);
+"""
+
+# indexes of the archive tables: what rental_history / payment_history are
+# searched by (customer, copy, rental)
+ARCHIVE_INDEXES = """
+CREATE INDEX IF NOT EXISTS archive.idx_rental_customer_copy ON rental (customer_id, copy_id);
+CREATE INDEX IF NOT EXISTS archive.idx_rental_copy ON rental (copy_id);
+CREATE INDEX IF NOT EXISTS archive.idx_payment_rental ON payment (rental_id);
+"""
+
+# oldest returns first: idx_rental_returned (return_date, rental_date)
+_PICK_BATCH = """
+    SELECT rental_id FROM main.rental
+    WHERE rental_status = 'RETURNED' AND return_date < ?
+    ORDER BY return_date
+    LIMIT ?
+"""
+
+# the batch's ids are bound as one JSON array
+_IN_IDS = "rental_id IN (SELECT value FROM json_each(?))"
+
+_GUARD_BATCH = f"""
+    INSERT INTO archive_batch (rental_id)
+    SELECT rental_id FROM archive.rental WHERE {_IN_IDS}
+"""
+
+_IN_BATCH = "rental_id IN (SELECT rental_id FROM archive_batch)"
+
+
+def default_path(db_path):
+    """The archive file next to ``db_path``: movierental.db -> movierental-archive.db."""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-{SCHEMA}{ext or '.db'}"
+
+
+def create_tables(conn):
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _columns(conn, schema, table):
+    return [(row[1], row[2], row[5]) for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def sync_schema(conn):
+    """Create the archive tables, or add the columns main has gained since.
+
+    Returns the list of tables/columns it added.
+    """
+    added = []
+    for table in ARCHIVED:
+        columns = _columns(conn, "main", table)
+        existing = {name for name, _, _ in _columns(conn, SCHEMA, table)}
+        if not existing:
+            definition = ", ".join(
+                f"{name} {decltype}" + (" PRIMARY KEY" if pk else "") for name, decltype, pk in columns)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {SCHEMA}.{table} ({definition})")
+            added.append(f"{SCHEMA}.{table}")
+            continue
+        for name, decltype, _ in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {SCHEMA}.{table} ADD COLUMN {name} {decltype}")
+                added.append(f"{SCHEMA}.{table}.{name}")
+    if added:
+        for statement in ARCHIVE_INDEXES.split(";"):
+            if statement.strip():
+                conn.execute(statement)
+    return added
+
+
+def _create_views(conn):
+    for table in ARCHIVED:
+        names = ", ".join(name for name, _, _ in _columns(conn, "main", table))
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}_history")
+        conn.execute(f"CREATE TEMP VIEW {table}_history AS "
+                     f"SELECT {names} FROM main.{table} UNION ALL SELECT {names} FROM {SCHEMA}.{table}")
+
+
+def attach(conn, path):
+    """ATTACH the archive file at ``path`` and create the *_history views.
+
+    Runs when a connection is opened (db.open_connection's ``setup``);
+    running it again brings the archive tables and views up to date with
+    main. The archive gets the journal mode of the main file, and its
+    tables are created on first use. ``:memory:`` attaches an empty
+    throwaway archive.
+    """
+    attached = {row[1] for row in conn.execute("PRAGMA database_list")}
+    if SCHEMA not in attached:
+        conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+        if path != ":memory:":
+            (journal_mode,) = conn.execute("PRAGMA main.journal_mode").fetchone()
+            (synchronous,) = conn.execute("PRAGMA main.synchronous").fetchone()
+            conn.execute(f"PRAGMA {SCHEMA}.journal_mode = {journal_mode}")
+            conn.execute(f"PRAGMA {SCHEMA}.synchronous = {synchronous}")
+    # main.rental is missing only on a brand-new file, before init_db
+    if _columns(conn, "main", "rental"):
+        sync_schema(conn)
+        _create_views(conn)
+
+
+def _move_batch(conn, cutoff, batch_size):
+    """Move one batch to the archive: two commits, inside the caller's write lock."""
+    ids = json.dumps([row[0] for row in conn.execute(_PICK_BATCH, (cutoff, batch_size))])
+    for table in ARCHIVED:
+        names = ", ".join(name for name, _, _ in _columns(conn, "main", table))
+        conn.execute(f"INSERT OR REPLACE INTO {SCHEMA}.{table} ({names}) "
+                     f"SELECT {names} FROM main.{table} WHERE {_IN_IDS}", (ids,))
+    conn.commit()
+
+    conn.execute("BEGIN IMMEDIATE")
+    moved = conn.execute(_GUARD_BATCH, (ids,)).rowcount
+    for table in ARCHIVED:
+        conn.execute(f"DELETE FROM main.{table} WHERE {_IN_BATCH}")
+    conn.execute("DELETE FROM archive_batch")
+    conn.commit()
+    return moved
+
+
+def cutoff_for(days, now=None):
+    """The return_date before which rentals are archived, ``days`` ago."""
+    now = datetime.now() if now is None else now
+    return (now - timedelta(days=days)).isoformat(timespec="seconds")
+
+
+def archive_rentals(conn, transaction, before, batch_size=BATCH_SIZE, limit=None, pause=0.0,
+                    progress=None):
+    """Move RETURNED rentals returned before ``before`` (and their payments).
+
+    ``transaction(conn, immediate=True)`` takes the write lock
+    (app.write_transaction) for each batch of ``batch_size`` rentals and its
+    two commits; ``pause`` seconds between batches let checkouts through
+    during a long run. Stops after ``limit`` rentals if given. ``progress(report)`` is
+    called after every batch. Returns a report dict.
+    """
+    report = {"rentals": 0, "batches": 0, "elapsed": 0.0}
+    started = time.perf_counter()
+    while limit is None or report["rentals"] < limit:
+        size = batch_size if limit is None else min(batch_size, limit - report["rentals"])
+        with transaction(conn, immediate=True):
+            moved = _move_batch(conn, before, size)
+        if not moved:
+            break
+        report["rentals"] += moved
+        report["batches"] += 1
+        report["elapsed"] = time.perf_counter() - started
+        if progress:
+            progress(report)
+        if pause:
+            time.sleep(pause)
+    report["elapsed"] = time.perf_counter() - started
+    return report
+
+
+def _file_size(conn, schema):
+    (page_size,) = conn.execute(f"PRAGMA {schema}.page_size").fetchone()
+    (pages,) = conn.execute(f"PRAGMA {schema}.page_count").fetchone()
+    (free,) = conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()
+    return {"bytes": page_size * pages, "free_bytes": page_size * free}
+
+
+def status(conn):
+    """Row counts and file sizes of the hot tables and the archive."""
+    result = {}
+    for schema in ("main", SCHEMA):
+        result[schema] = {
+            table: conn.execute(f"SELECT COUNT(*) FROM {schema}.{table}").fetchone()[0]
+            for table in reversed(ARCHIVED)
+        }
+        result[schema].update(_file_size(conn, schema))
+    return result
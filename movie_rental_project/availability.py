@@ -0,0 +1,80 @@
+"""Per-movie copy counters: movie.total_copies and movie.available_copies.
+
+The rent page, the movie page and the browse listing used to count
+inventory_copy rows (COUNT/SUM over a movie's copies) on every view. The two
+columns on movie hold those counts instead, and triggers on inventory_copy
+keep them exact on insert, delete, status change and when a copy is moved
+to another movie. Like the report stats, they live in the database, so
+every write path (rent, return, add movie, imports, the sqlite3 shell)
+keeps them current.
+
+rebuild() recounts from inventory_copy and reports which movies had
+drifted; ``flask --app app rebuild-copy-counters`` runs it, ``--check``
+only reports.
+"""
+from collections import namedtuple
+
+COLUMNS = ("total_copies", "available_copies")
+
+Drift = namedtuple("Drift", "movie_id total_copies available_copies actual_total actual_available")
+
+
+def _add(row, sign):
+    """UPDATE counting copy ``row`` (NEW/OLD) into (+) or out of (-) its movie."""
+    return (f"UPDATE movie SET total_copies = total_copies {sign} 1, "
+            f"available_copies = available_copies {sign} ({row}.status = 'AVAILABLE') "
+            f"WHERE movie_id = {row}.movie_id;")
+
+
+TRIGGERS = {
+    "copies_copy_ai": ("AFTER INSERT ON inventory_copy", [_add("NEW", "+")]),
+    "copies_copy_ad": ("AFTER DELETE ON inventory_copy", [_add("OLD", "-")]),
+    # the common case, a copy rented out or returned: one row update
+    "copies_copy_status_au": (
+        "AFTER UPDATE OF status ON inventory_copy "
+        "WHEN OLD.movie_id = NEW.movie_id AND OLD.status IS NOT NEW.status", [
+            "UPDATE movie SET available_copies = available_copies "
+            "+ (NEW.status = 'AVAILABLE') - (OLD.status = 'AVAILABLE') WHERE movie_id = NEW.movie_id;",
+        ]),
+    "copies_copy_move_au": (
+        "AFTER UPDATE OF movie_id ON inventory_copy WHEN OLD.movie_id IS NOT NEW.movie_id",
+        [_add("OLD", "-"), _add("NEW", "+")]),
+}
+
+# what the counters should be, for every movie whose stored values differ
+_DRIFT = """
+    SELECT m.movie_id, m.total_copies, m.available_copies,
+           COALESCE(c.total, 0) AS actual_total, COALESCE(c.available, 0) AS actual_available
+    FROM movie m
+    LEFT JOIN (SELECT movie_id, COUNT(*) AS total, SUM(status = 'AVAILABLE') AS available
+               FROM inventory_copy GROUP BY movie_id) c ON c.movie_id = m.movie_id
+    WHERE m.total_copies IS NOT COALESCE(c.total, 0)
+       OR m.available_copies IS NOT COALESCE(c.available, 0)
+"""
+
+
+def create_counters(conn):
+    """Add the columns and triggers, then fill the counters (rebuild)."""
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(movie)")}
+    for column in COLUMNS:
+        if column not in existing:
+            conn.execute(f"ALTER TABLE movie ADD COLUMN {column} INTEGER NOT NULL DEFAULT 0")
+    for name, (event, body) in TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n" + "\n".join(body) + "\nEND")
+    rebuild(conn)
+
+
+def drift(conn):
+    """Movies whose counters disagree with inventory_copy (list of Drift)."""
+    return [Drift(*row) for row in conn.execute(_DRIFT)]
+
+
+def rebuild(conn):
+    """Correct every drifted counter; return the list of Drift that was fixed."""
+    found = drift(conn)
+    conn.executemany(
+        "UPDATE movie SET total_copies = ?, available_copies = ? WHERE movie_id = ?",
+        [(d.actual_total, d.actual_available, d.movie_id) for d in found],
+    )
+    return found
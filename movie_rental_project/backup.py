@@ -0,0 +1,265 @@
+"""Online backups: consistent snapshots of a live store, restore and cloning.
+
+Copying movierental.db with cp while clerks are renting can copy half a
+transaction, and it misses whatever still sits in the -wal file. A
+snapshot here goes through SQLite's backup API instead
+(sqlite3.Connection.backup): PAGES pages per step with PAUSE seconds
+between steps, each step a short read of the live file, so checkouts keep
+committing meanwhile. A write by another connection makes SQLite start the
+copy over; after MAX_RESTARTS of those the rest is copied in one step,
+which in WAL mode is one read snapshot and still holds no writer up.
+
+A snapshot is a directory under the backup directory (``backups/`` next
+to the database by default):
+
+    movierental-20260101-030000/
+        main.db         the store
+        archive.db      the rental archive (archive.py)
+        manifest.json   when, from where, size and SHA-256 of each file
+
+It is built as ``<name>.partial`` and renamed when complete, so a snapshot
+with a manifest is always a whole one. main is copied before the archive:
+a rental being archived meanwhile is then in both copies (which the
+archive handles, see archive.py), never in neither. snapshot() keeps the
+newest ``keep`` snapshots and deletes older ones. The ``backup``
+maintenance job takes one a day.
+
+restore() checks every file against its manifest checksum (and PRAGMA
+quick_check) before overwriting anything, then copies it back through the
+backup API as well, so connections that are open on the store see the
+restored data rather than a file swapped under them. The app then
+re-checks the schema (an older snapshot is migrated), bumps the data
+version and fences the change log, whose seq the restore has rewound
+(changelog.fence).
+
+clone() copies a template database (and its archive), e.g. one migrated
+and seeded once, to a new path; tests and benchmarks get a fresh store
+without running the schema and sample data scripts again.
+
+    flask --app app backup [--list]
+    flask --app app verify-backup backups/movierental-20260101-030000
+    flask --app app restore-backup backups/movierental-20260101-030000
+    flask --app app clone-db template.db /tmp/fixture.db
+"""
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+import archive
+
+# pages copied per backup step, and seconds between steps
+PAGES = 1024
+PAUSE = 0.005
+
+# restarts (another connection wrote) before the rest is copied in one step
+MAX_RESTARTS = 3
+
+# snapshots kept by snapshot()
+KEEP = 7
+
+MANIFEST = "manifest.json"
+# (schema of the app connection, file in the snapshot)
+FILES = (("main", "main.db"), (archive.SCHEMA, "archive.db"))
+
+# a .partial directory this old is left over from a crash
+STALE_PARTIAL = 3600
+
+
+class SnapshotError(Exception):
+    """A snapshot is incomplete, or a file does not match its manifest."""
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def default_dir(db_path):
+    """``backups/`` next to the database."""
+    return os.path.join(os.path.dirname(os.path.abspath(db_path)), "backups")
+
+
+def _paths(conn):
+    """{schema: file} of the connection's main database and archive."""
+    return {name: path for _, name, path in conn.execute("PRAGMA database_list") if path}
+
+
+def _copy(src, schema, target, pages, pause):
+    """Back up ``schema`` of ``src`` into the new file ``target``; returns (steps, restarts)."""
+    state = {"remaining": None, "steps": 0, "restarts": 0}
+
+    def progress(status, remaining, total):
+        state["steps"] += 1
+        if state["remaining"] is not None and remaining > state["remaining"]:
+            state["restarts"] += 1
+            if state["restarts"] > MAX_RESTARTS:
+                raise _TooManyRestarts()
+        state["remaining"] = remaining
+
+    dst = sqlite3.connect(target)
+    try:
+        try:
+            src.backup(dst, pages=pages, progress=progress, name=schema, sleep=pause)
+        except _TooManyRestarts:
+            src.backup(dst, pages=-1, name=schema)
+            state["steps"] += 1
+        # a plain file, whatever the source's journal mode
+        dst.execute("PRAGMA journal_mode = DELETE")
+    finally:
+        dst.close()
+    return state["steps"], state["restarts"]
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for block in iter(lambda: fh.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot(conn, directory=None, keep=KEEP, pages=PAGES, pause=PAUSE):
+    """Back up the store ``conn`` is open on (and its archive) into a new snapshot.
+
+    Returns the manifest, with the snapshot's path under "path".
+    """
+    sources = _paths(conn)
+    directory = directory or default_dir(sources["main"])
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(sources["main"]))[0]
+    name = f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+    final = os.path.join(directory, name)
+    suffix = 1
+    while os.path.exists(final):
+        suffix += 1
+        final = os.path.join(directory, f"{name}-{suffix}")
+    partial = final + ".partial"
+    os.makedirs(partial)
+
+    started = time.perf_counter()
+    manifest = {"created": datetime.now().isoformat(timespec="seconds"), "source": sources["main"],
+                "files": {}}
+    try:
+        for schema, filename in FILES:
+            if schema not in sources:
+                continue
+            target = os.path.join(partial, filename)
+            steps, restarts = _copy(conn, schema, target, pages, pause)
+            manifest["files"][filename] = {"schema": schema, "bytes": os.path.getsize(target),
+                                           "sha256": _sha256(target), "steps": steps,
+                                           "restarts": restarts}
+        manifest["seconds"] = round(time.perf_counter() - started, 3)
+        with open(os.path.join(partial, MANIFEST), "w") as fh:
+            json.dump(manifest, fh, indent=2)
+        os.rename(partial, final)
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    manifest["path"] = final
+    manifest["removed"] = rotate(directory, stem, keep)
+    return manifest
+
+
+def snapshots(directory, stem=None):
+    """Complete snapshots in ``directory``, oldest first, as (path, manifest)."""
+    found = []
+    if not os.path.isdir(directory):
+        return found
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        manifest_path = os.path.join(path, MANIFEST)
+        if (stem and not name.startswith(stem + "-")) or not os.path.isfile(manifest_path):
+            continue
+        with open(manifest_path) as fh:
+            found.append((path, json.load(fh)))
+    return found
+
+
+def rotate(directory, stem, keep=KEEP):
+    """Delete all but the newest ``keep`` snapshots, and stale partial ones; returns the deleted paths."""
+    removed = [path for path, _ in snapshots(directory, stem)[:-keep]] if keep > 0 else []
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if name.endswith(".partial") and time.time() - os.path.getmtime(path) > STALE_PARTIAL:
+            removed.append(path)
+    for path in removed:
+        shutil.rmtree(path, ignore_errors=True)
+    return removed
+
+
+def verify(path):
+    """Check a snapshot's files against its manifest; returns the manifest.
+
+    Raises SnapshotError on a missing file, a checksum mismatch or a file
+    SQLite finds damaged.
+    """
+    manifest_path = os.path.join(path, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        raise SnapshotError(f"{path} has no {MANIFEST} (not a snapshot, or an incomplete one)")
+    with open(manifest_path) as fh:
+        manifest = json.load(fh)
+    for filename, expected in manifest["files"].items():
+        file_path = os.path.join(path, filename)
+        if not os.path.isfile(file_path):
+            raise SnapshotError(f"{filename} is missing from {path}")
+        if _sha256(file_path) != expected["sha256"]:
+            raise SnapshotError(f"{filename} does not match its checksum")
+        check = sqlite3.connect(f"file:{file_path}?mode=ro&immutable=1", uri=True)
+        try:
+            (result,) = check.execute("PRAGMA quick_check").fetchone()
+        finally:
+            check.close()
+        if result != "ok":
+            raise SnapshotError(f"{filename}: {result}")
+    return manifest
+
+
+def _replace(source, target, pages, pause):
+    """Copy the file ``source`` over the live database ``target`` through the backup API."""
+    src = sqlite3.connect(f"file:{source}?mode=ro&immutable=1", uri=True)
+    dst = sqlite3.connect(target, timeout=30)
+    try:
+        src.backup(dst, pages=pages, sleep=pause)
+    finally:
+        src.close()
+        dst.close()
+
+
+def restore(path, db_path, archive_path=None, pages=-1, pause=PAUSE):
+    """Verify the snapshot at ``path``, then copy it over ``db_path`` (and the archive).
+
+    Writes committed to the store meanwhile are overwritten. The caller
+    re-checks the schema, bumps the data version and fences the change log
+    (app.restore_backup).
+    Returns the manifest.
+    """
+    manifest = verify(path)
+    targets = {"main": db_path, archive.SCHEMA: archive_path or archive.default_path(db_path)}
+    for filename, entry in manifest["files"].items():
+        _replace(os.path.join(path, filename), targets[entry["schema"]], pages, pause)
+    return manifest
+
+
+def clone(template, target):
+    """Copy the database ``template`` (and its archive, if any) to ``target``.
+
+    ``target`` must not be open anywhere; it is overwritten. Returns target.
+    """
+    for source, destination in ((template, target),
+                                (archive.default_path(template), archive.default_path(target))):
+        if not os.path.exists(source):
+            continue
+        for leftover in ("", "-wal", "-shm"):
+            if os.path.exists(destination + leftover):
+                os.remove(destination + leftover)
+        src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        dst = sqlite3.connect(destination)
+        try:
+            src.backup(dst)
+        finally:
+            src.close()
+            dst.close()
+    return target
@@ -0,0 +1,305 @@
+"""Latency benchmark for every route.
+
+Drives each page and API endpoint through app.test_client() against a
+copy of a database (see datagen.py for a large one) and records, per
+route, p50/p95/p99/mean/max latency plus the SQL statements a request
+runs and its time in SQLite (from instrument.py). The results go to a
+JSON file so two commits can be compared:
+
+    python datagen.py /tmp/big.db --scale medium
+    python benchmark.py --db /tmp/big.db --output before.json
+    git checkout my-branch
+    python benchmark.py --db /tmp/big.db --output after.json --compare before.json
+
+The database is copied first (rent/return/add-movie write to it) unless
+--in-place is given.
+"""
+import argparse
+import json
+import os
+import platform
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from flask import g
+
+import app as movie_app
+import instrument
+
+ADMIN = {"username": "admin", "password": "admin123"}
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+class RequestRecorder:
+    """Keeps the SQL stats (instrument.RequestStats) of the last request."""
+
+    def __init__(self):
+        self.last = None
+
+    def install(self, flask_app):
+        # teardown_appcontext hooks run last-registered first, so this one
+        # sees the finished stats before close_connection() releases them
+        @flask_app.teardown_appcontext
+        def _keep_sql_stats(exc):
+            conn = g.get("db_conn")
+            if isinstance(conn, instrument.TimedConnection):
+                self.last = conn.stats
+
+
+def sample_ids(conn):
+    """Ids the routes are called with, picked from the data itself."""
+    def one(sql):
+        row = conn.execute(sql).fetchone()
+        return row[0] if row else None
+
+    popular = [r[0] for r in conn.execute(
+        "SELECT movie_id FROM inventory_copy WHERE status = 'AVAILABLE' "
+        "GROUP BY movie_id HAVING COUNT(*) >= 3 ORDER BY COUNT(*) DESC LIMIT 200")]
+    title = one("SELECT title FROM movie ORDER BY movie_id LIMIT 1") or "the"
+    return {
+        "movies": popular,
+        "movie_id": one("SELECT MAX(movie_id) / 2 FROM movie") or 1,
+        "customer_id": one("SELECT customer_id FROM customer ORDER BY customer_id LIMIT 1"),
+        "busy_customer": one("SELECT customer_id FROM rental GROUP BY customer_id ORDER BY COUNT(*) DESC LIMIT 1"),
+        "category_id": one("SELECT category_id FROM category ORDER BY category_id LIMIT 1"),
+        "year": one("SELECT release_year FROM movie WHERE release_year IS NOT NULL "
+                    "GROUP BY release_year ORDER BY COUNT(*) DESC LIMIT 1"),
+        "rental_id": one("SELECT MAX(rental_id) FROM rental"),
+        "keyword": title.split()[0].lower(),
+    }
+
+
+def cases(ids):
+    """(label, method, url, request kwargs, after-hook) for every route.
+
+    ``ids`` is updated as requests run: renting pushes rental ids that the
+    return cases then give back, so stock does not run out.
+    """
+    movies = ids["movies"]
+    customer = ids["customer_id"]
+    turn = {"n": 0}
+
+    def next_movie():
+        turn["n"] += 1
+        return movies[turn["n"] % len(movies)]
+
+    def rent_form():
+        return {"data": {"customer_id": customer, "movie_id": next_movie()}}
+
+    def rent_batch():
+        return {"json": {"customer_id": customer, "movie_ids": [next_movie() for _ in range(3)]}}
+
+    def remember_batch(response):
+        ids["open"].extend(item["rental_id"] for item in response.get_json()["results"] if item["ok"])
+
+    def return_form():
+        return {"data": {"rental_id": ids["open"].pop() if ids["open"] else ids["rental_id"]}}
+
+    def return_batch():
+        taken, ids["open"][:] = ids["open"][:3], ids["open"][3:]
+        return {"json": {"rental_ids": taken or [ids["rental_id"]]}}
+
+    def add_movie():
+        turn["n"] += 1
+        return {"data": {"title": f"Benchmark Movie {turn['n']}", "release_year": "2024",
+                         "categories": [str(ids["category_id"])], "num_copies": "1"}}
+
+    def remember_rental(response):
+        row = ids["conn"].execute(
+            "SELECT MAX(rental_id) FROM rental WHERE customer_id = ? AND rental_status = 'OPEN'",
+            (customer,)).fetchone()
+        if row[0]:
+            ids["open"].append(row[0])
+
+    fixed = lambda **kw: (lambda: kw)  # noqa: E731
+    return [
+        ("GET /", "GET", "/", fixed(), None),
+        ("GET /login", "GET", "/login", fixed(), None),
+        ("POST /login", "POST", "/login", fixed(data=ADMIN), None),
+        ("GET /register", "GET", "/register", fixed(), None),
+        ("GET /movies", "GET", "/movies", fixed(), None),
+        ("GET /movies?keyword", "GET", "/movies", fixed(query_string={"keyword": ids["keyword"]}), None),
+        ("GET /movies?category", "GET", "/movies", fixed(query_string={"category_id": ids["category_id"]}), None),
+        ("GET /movies?year+rating", "GET", "/movies",
+         fixed(query_string={"year": ids["year"], "min_rating": 6, "sort_by": "rating", "sort_dir": "desc"}), None),
+        ("GET /movies/<id>", "GET", f"/movies/{ids['movie_id']}", fixed(), None),
+        ("GET /customers", "GET", "/customers", fixed(), None),
+        ("GET /rent", "GET", "/rent", fixed(), None),
+        ("GET /rent?keyword", "GET", "/rent", fixed(query_string={"keyword": ids["keyword"]}), None),
+        ("POST /rent", "POST", "/rent", rent_form, remember_rental),
+        ("POST /rent/batch", "POST", "/rent/batch", rent_batch, remember_batch),
+        ("GET /return", "GET", "/return", fixed(), None),
+        ("POST /return", "POST", "/return", return_form, None),
+        ("POST /return/batch", "POST", "/return/batch", return_batch, None),
+        ("GET /reports/popular", "GET", "/reports/popular", fixed(), None),
+        ("GET /admin/movies/add", "GET", "/admin/movies/add", fixed(), None),
+        ("POST /admin/movies/add", "POST", "/admin/movies/add", add_movie, None),
+        ("GET /admin/import", "GET", "/admin/import", fixed(), None),
+        ("GET /admin/metrics/pool", "GET", "/admin/metrics/pool", fixed(), None),
+        ("GET /admin/metrics/cache", "GET", "/admin/metrics/cache", fixed(), None),
+        ("GET /admin/metrics/prometheus", "GET", "/admin/metrics/prometheus", fixed(), None),
+        ("GET /api/v1/", "GET", "/api/v1/", fixed(), None),
+        ("GET /api/v1/movies", "GET", "/api/v1/movies", fixed(), None),
+        ("GET /api/v1/movies?q", "GET", "/api/v1/movies",
+         fixed(query_string={"q": ids["keyword"], "fields": "movie_id,title,available_copies"}), None),
+        ("GET /api/v1/customers", "GET", "/api/v1/customers", fixed(), None),
+        ("GET /api/v1/rentals?customer", "GET", "/api/v1/rentals",
+         fixed(query_string={"customer_id": ids["busy_customer"]}), None),
+        ("GET /api/v1/rentals?movie", "GET", "/api/v1/rentals",
+         fixed(query_string={"movie_id": movies[0] if movies else 1}), None),
+        ("GET /api/v1/payments?customer", "GET", "/api/v1/payments",
+         fixed(query_string={"customer_id": ids["busy_customer"]}), None),
+        ("GET /api/v1/movies/<id>", "GET", f"/api/v1/movies/{ids['movie_id']}",
+         fixed(query_string={"fields": "title,categories,actors,total_copies"}), None),
+        ("GET /logout", "GET", "/logout", fixed(), None),
+    ]
+
+
+def copy_database(source, target):
+    """Consistent copy of ``source`` (WAL included) with the backup API."""
+    src, dst = sqlite3.connect(source), sqlite3.connect(target)
+    with dst:
+        src.backup(dst)
+    src.close()
+    dst.close()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(db_path, iterations, warmup):
+    movie_app.app.config.update(DATABASE=db_path, SQL_INSTRUMENTATION=True, SLOW_QUERY_LOG=None)
+    recorder = RequestRecorder()
+    recorder.install(movie_app.app)
+    client = movie_app.app.test_client()
+
+    conn = sqlite3.connect(db_path)
+    ids = sample_ids(conn)
+    ids["conn"], ids["open"] = conn, []
+    sizes = {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+             for table in ("movie", "customer", "inventory_copy", "rental", "payment")}
+    plan = cases(ids)
+
+    timings, queries, db_times = defaultdict(list), defaultdict(list), defaultdict(list)
+    statuses = defaultdict(Counter)
+    for round_no in range(warmup + iterations):
+        client.post("/login", data=ADMIN)
+        for label, method, url, make_kwargs, after in plan:
+            kwargs = make_kwargs()
+            recorder.last = None
+            began = time.perf_counter()
+            response = client.open(url, method=method, **kwargs)
+            elapsed = time.perf_counter() - began
+            if after is not None and response.status_code < 400:
+                after(response)
+            if round_no < warmup:
+                continue
+            timings[label].append(elapsed * 1000)
+            queries[label].append(recorder.last.queries if recorder.last else 0)
+            db_times[label].append(recorder.last.db_time * 1000 if recorder.last else 0.0)
+            statuses[label][response.status_code] += 1
+    conn.close()
+
+    routes = {}
+    for label, *_ in plan:
+        values = sorted(timings[label])
+        routes[label] = {
+            "n": len(values),
+            "p50_ms": round(percentile(values, 50), 3),
+            "p95_ms": round(percentile(values, 95), 3),
+            "p99_ms": round(percentile(values, 99), 3),
+            "mean_ms": round(sum(values) / len(values), 3),
+            "max_ms": round(values[-1], 3),
+            "queries": round(sum(queries[label]) / len(queries[label]), 2),
+            "db_ms": round(sum(db_times[label]) / len(db_times[label]), 3),
+            "status": {str(code): n for code, n in sorted(statuses[label].items())},
+        }
+
+    covered = {movie_app.app.url_map.bind("localhost").match(url, method=method)[0] for _, method, url, *_ in plan}
+    missing = sorted(rule.endpoint for rule in movie_app.app.url_map.iter_rules()
+                     if rule.endpoint not in covered and rule.endpoint != "static")
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "iterations": iterations,
+            "warmup": warmup,
+            "database": os.path.basename(db_path),
+            "rows": sizes,
+            "uncovered_endpoints": missing,
+        },
+        "routes": routes,
+    }
+
+
+def print_report(result, baseline=None):
+    before = (baseline or {}).get("routes", {})
+    header = f"{'route':34} {'p50':>8} {'p95':>8} {'p99':>8} {'queries':>8} {'db ms':>8}"
+    if before:
+        header += f" {'p50 was':>8} {'change':>8} {'q was':>6}"
+    print(header)
+    for label, row in result["routes"].items():
+        line = (f"{label:34} {row['p50_ms']:8.2f} {row['p95_ms']:8.2f} {row['p99_ms']:8.2f} "
+                f"{row['queries']:8.1f} {row['db_ms']:8.2f}")
+        old = before.get(label)
+        if old:
+            change = (row["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+            line += f" {old['p50_ms']:8.2f} {change:+7.1f}% {old['queries']:6.1f}"
+        bad = {code: n for code, n in row["status"].items() if int(code) >= 400}
+        if bad:
+            line += f"  status {bad}"
+        print(line)
+    if result["meta"]["uncovered_endpoints"]:
+        print("not benchmarked:", ", ".join(result["meta"]["uncovered_endpoints"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "movierental.db"))
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="An earlier --output file to compare against.")
+    parser.add_argument("--in-place", action="store_true", help="Run against --db itself instead of a copy.")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} does not exist (python datagen.py {args.db})")
+    with tempfile.TemporaryDirectory() as workdir:
+        db_path = args.db
+        if not args.in_place:
+            db_path = os.path.join(workdir, os.path.basename(args.db))
+            copy_database(args.db, db_path)
+        result = run(db_path, args.iterations, args.warmup)
+        movie_app.get_pool().close()
+
+    with open(args.output, "w") as fh:
+        json.dump(result, fh, indent=2)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+    print_report(result, baseline)
+    print(f"wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
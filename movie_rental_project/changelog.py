@@ -0,0 +1,266 @@
+"""Change log: an append-only feed of the rows that changed, for sync jobs.
+
+Triggers append one change_log row for every insert, update and delete of
+the tables a back-office copy needs:
+
+    seq         monotonic sequence number (AUTOINCREMENT: never reused,
+                even after old entries are purged)
+    table_name  movie, inventory_copy, customer, rental or payment
+    row_key     the row's primary key
+    op          I (insert), U (update) or D (delete)
+    changed_at  local time of the change
+
+so checkout, returns and add_movie need no code of their own, and neither
+does anything else that writes those tables. movie is logged for its own
+columns and its categories / actors (as a U of the movie), not for the
+copy counters the availability triggers keep on it. Rows moved to the
+archive file (archive.py) are not deleted as far as the log is concerned.
+
+SQLite has one writer at a time, so entries become visible in seq order:
+a reader that has seen seq N never gets a smaller one later. A sync job
+keeps the last seq it applied and asks for what came after it
+(read_changes(), ``GET /api/v1/changes?since=N`` or ``flask --app app
+changes --since N``), BATCH_SIZE entries at a time. The log names rows,
+it does not copy them: I and U mean "upsert the row as it is now" (read
+it from /api/v1/<collection>/<id>), D "delete it". A new job first takes
+last_seq(), then exports the tables, then follows the log from that seq.
+
+Restoring a backup (backup.py) brings back an older log, and with it an
+older sqlite_sequence. fence() then moves seq past everything handed out
+before the restore and marks it all purged: every reader gets a 410 and
+exports again, since rows it applied may be gone, and no seq is reused.
+
+The ``changelog`` maintenance job keeps the log small:
+
+    compact()  drops every entry that a later entry for the same row
+               supersedes. Harmless to any reader: the row still comes
+               up, at its latest seq.
+    purge()    drops entries older than RETENTION_DAYS. A reader still
+               behind purged_through has lost changes and must export
+               again (the API answers 410).
+"""
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+# entries returned per read, by default and at most
+BATCH_SIZE = 500
+MAX_BATCH = 5000
+
+# entries older than this are purged
+RETENTION_DAYS = 30
+
+# entries compacted / purged per write transaction
+MAINTENANCE_BATCH = 5000
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS change_log (
+    seq        INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_key    INTEGER NOT NULL,
+    op         TEXT NOT NULL CHECK (op IN ('I', 'U', 'D')),
+    changed_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+);
+-- compact(): the earlier entries of a row
+CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_key, seq);
+
+-- one row: how far purge() and compact() have got
+CREATE TABLE IF NOT EXISTS change_log_state (
+    id                INTEGER PRIMARY KEY CHECK (id = 1),
+    purged_through    INTEGER NOT NULL DEFAULT 0,
+    compacted_through INTEGER NOT NULL DEFAULT 0
+);
+INSERT OR IGNORE INTO change_log_state (id) VALUES (1);
+"""
+
+# (table, primary key, columns whose update is a change; None: all of them)
+TRACKED = (
+    ("movie", "movie_id", ("title", "release_year", "mpaa_rating", "length_minutes",
+                           "movie_rating", "description", "rental_rate", "late_fee")),
+    ("inventory_copy", "copy_id", None),
+    ("customer", "customer_id", None),
+    ("rental", "rental_id", None),
+    ("payment", "payment_id", None),
+)
+
+# a row being moved to the archive (archive.py) is not a deleted one
+_NOT_ARCHIVING = "WHEN OLD.rental_id NOT IN (SELECT rental_id FROM archive_batch)"
+_ARCHIVED = {"rental", "payment"}
+
+
+def _log(table, key, op):
+    return f"INSERT INTO change_log (table_name, row_key, op) VALUES ('{table}', {key}, '{op}');"
+
+
+def _log_movie(movie_id):
+    """A U of the movie, unless the entry just before is already this movie
+    (add_movie writes the movie, then its categories and actors)."""
+    return (
+        f"INSERT INTO change_log (table_name, row_key, op) SELECT 'movie', {movie_id}, 'U' "
+        "WHERE NOT EXISTS (SELECT 1 FROM change_log WHERE seq = (SELECT MAX(seq) FROM change_log) "
+        f"AND table_name = 'movie' AND row_key = {movie_id});"
+    )
+
+
+def _triggers():
+    triggers = {}
+    for table, key, columns in TRACKED:
+        of = f" OF {', '.join(columns)}" if columns else ""
+        guard = f" {_NOT_ARCHIVING}" if table in _ARCHIVED else ""
+        triggers[f"change_{table}_ai"] = (f"AFTER INSERT ON {table}", [_log(table, f"NEW.{key}", "I")])
+        triggers[f"change_{table}_au"] = (f"AFTER UPDATE{of} ON {table}", [_log(table, f"NEW.{key}", "U")])
+        triggers[f"change_{table}_ad"] = (f"AFTER DELETE ON {table}{guard}", [_log(table, f"OLD.{key}", "D")])
+    for link in ("movie_category", "movie_actor"):
+        triggers[f"change_{link}_ai"] = (f"AFTER INSERT ON {link}", [_log_movie("NEW.movie_id")])
+        triggers[f"change_{link}_ad"] = (f"AFTER DELETE ON {link}", [_log_movie("OLD.movie_id")])
+    return triggers
+
+
+TRIGGERS = _triggers()
+
+READ = """
+    SELECT seq, table_name, row_key, op, changed_at FROM change_log
+    WHERE seq > ?{tables}
+    ORDER BY seq
+    LIMIT ?
+"""
+LAST_SEQ = "SELECT seq FROM sqlite_sequence WHERE name = 'change_log'"
+STATE = "SELECT purged_through, compacted_through FROM change_log_state WHERE id = 1"
+
+# the entries of a seq range that a later entry of the same row supersedes
+SUPERSEDED = """
+    DELETE FROM change_log WHERE seq IN (
+        SELECT old.seq
+        FROM change_log new
+        JOIN change_log old
+          ON old.table_name = new.table_name AND old.row_key = new.row_key AND old.seq < new.seq
+        WHERE new.seq > ? AND new.seq <= ?
+    )
+"""
+
+Changes = namedtuple("Changes", "changes next_since more last_seq purged_through")
+
+
+class Purged(Exception):
+    """The entries after ``since`` are partly gone; the reader must export again."""
+
+    def __init__(self, since, purged_through):
+        super().__init__(f"changes up to seq {purged_through} have been purged (asked for those after {since})")
+        self.since = since
+        self.purged_through = purged_through
+
+
+def create_tables(conn):
+    """change_log, its state row and the triggers; migration 13."""
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    create_triggers(conn)
+
+
+def create_triggers(conn, names=None):
+    """(Re)create the triggers, or only those in ``names``."""
+    for name, (event, body) in TRIGGERS.items():
+        if names is None or name in names:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n" + "\n".join(body) + "\nEND")
+
+
+def last_seq(conn):
+    """The newest seq handed out so far (0 before the first change)."""
+    row = conn.execute(LAST_SEQ).fetchone()
+    return row[0] if row else 0
+
+
+def fence(conn, through):
+    """Invalidate every reader at or behind seq ``through`` (after a restore).
+
+    The next seq handed out is ``through + 2``; purged_through becomes
+    ``through + 1``, which is also what last_seq() reports, so a new
+    reader starts from there. Call inside a write transaction.
+    """
+    through = max(through, last_seq(conn)) + 1
+    if not conn.execute("UPDATE sqlite_sequence SET seq = ? WHERE name = 'change_log'", (through,)).rowcount:
+        conn.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('change_log', ?)", (through,))
+    conn.execute("UPDATE change_log_state SET purged_through = MAX(purged_through, ?) WHERE id = 1",
+                 (through,))
+    return through
+
+
+def read_changes(conn, since=0, limit=BATCH_SIZE, tables=None):
+    """The entries after seq ``since``, oldest first, at most ``limit``.
+
+    ``tables`` limits them to some tables. Raises Purged when entries
+    after ``since`` have been purged. ``next_since`` is the seq to ask
+    from next time; ``more`` is True when this was not the last batch.
+    """
+    limit = max(1, min(limit, MAX_BATCH))
+    purged_through, _ = conn.execute(STATE).fetchone()
+    if since < purged_through:
+        raise Purged(since, purged_through)
+    params = [since]
+    condition = ""
+    if tables:
+        condition = f" AND table_name IN ({', '.join('?' * len(tables))})"
+        params += list(tables)
+    # before the read: everything up to it is committed by the time the
+    # read runs, so a filtered read that finds no more has seen up to it
+    top = last_seq(conn)
+    rows = conn.execute(READ.format(tables=condition), params + [limit + 1]).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    changes = [{"seq": seq, "table": table, "key": key, "op": op, "changed_at": changed_at}
+               for seq, table, key, op, changed_at in rows]
+    next_since = rows[-1][0] if more else max(rows[-1][0] if rows else since, top)
+    return Changes(changes, next_since, more, max(top, next_since), purged_through)
+
+
+def compact(conn, transaction, batch_size=MAINTENANCE_BATCH, pause=0.0):
+    """Drop superseded entries; returns how many.
+
+    Each run walks the entries added since the last one, MAINTENANCE_BATCH
+    at a time, and deletes the earlier entries of their rows.
+    """
+    removed = 0
+    _, done = conn.execute(STATE).fetchone()
+    top = last_seq(conn)
+    while done < top:
+        through = min(done + batch_size, top)
+        with transaction(conn, immediate=True):
+            removed += conn.execute(SUPERSEDED, (done, through)).rowcount
+            conn.execute("UPDATE change_log_state SET compacted_through = ? WHERE id = 1", (through,))
+            conn.commit()
+        done = through
+        if pause:
+            time.sleep(pause)
+    return removed
+
+
+def purge(conn, transaction, days=RETENTION_DAYS, batch_size=MAINTENANCE_BATCH, pause=0.0):
+    """Drop the entries older than ``days`` days; returns how many."""
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(sep=" ", timespec="seconds")
+    removed = 0
+    while True:
+        with transaction(conn, immediate=True):
+            # the oldest batch_size entries, of which the old enough ones
+            (through,) = conn.execute(
+                "SELECT MAX(seq) FROM (SELECT seq, changed_at FROM change_log ORDER BY seq LIMIT ?) "
+                "WHERE changed_at < ?", (batch_size, cutoff)).fetchone()
+            if through is None:
+                conn.commit()
+                break
+            removed += conn.execute("DELETE FROM change_log WHERE seq <= ?", (through,)).rowcount
+            conn.execute("UPDATE change_log_state SET purged_through = MAX(purged_through, ?) WHERE id = 1",
+                         (through,))
+            conn.commit()
+        if pause:
+            time.sleep(pause)
+    return removed
+
+
+def status(conn):
+    """Entry count and seq range, for /admin/maintenance and the CLI."""
+    entries, oldest = conn.execute("SELECT COUNT(*), MIN(seq) FROM change_log").fetchone()
+    purged_through, compacted_through = conn.execute(STATE).fetchone()
+    return {"entries": entries, "oldest_seq": oldest, "last_seq": last_seq(conn),
+            "purged_through": purged_through, "compacted_through": compacted_through}
@@ -0,0 +1,293 @@
+"""Seeded synthetic data at production scale.
+
+The sample data (seed_db) is 19 movies and 8 customers, which hides how the routes
+behave on a real store. This builds a database of any size on top of the
+normal schema, with the skew a real store has: a few titles get most of
+the rentals (Zipf), a few customers rent far more than the rest (Pareto),
+rentals grow over time, popular titles have more copies, most rentals are
+returned and paid for, some are late, and the newest ones are still out.
+
+    python datagen.py big.db --scale medium
+    python datagen.py prod.db --movies 100000 --customers 1000000 --rentals 20000000
+    python datagen.py small.db --scale small --seed 7 --end 2026-01-01
+
+The same arguments (seed, sizes and --end) always give the same data.
+Rows are generated with NumPy and written with executemany while triggers
+and secondary indexes are dropped; both are recreated afterwards and the
+trigger-maintained tables (search index, report stats) and the
+recommendations are rebuilt once.
+
+Needs NumPy (``pip install numpy``).
+"""
+import argparse
+import os
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+import app as movie_app
+import availability
+import recommend
+import search
+import stats
+
+SCALES = {
+    # movies, customers, rentals
+    "small": (2_000, 10_000, 100_000),
+    "medium": (20_000, 100_000, 2_000_000),
+    "large": (100_000, 1_000_000, 20_000_000),
+}
+
+DEFAULT_END = "2026-01-01"
+HISTORY_DAYS = 5 * 365
+CHUNK = 200_000
+
+MOVIE_SKEW = 1.1        # Zipf exponent of title popularity
+CUSTOMER_SKEW = 1.3     # Pareto shape of customer activity
+MAX_ACTIVITY = 200      # the busiest customer rents at most 200x as often as the quietest
+RENTAL_DAYS = 5
+MEAN_DAYS_OUT = 4.4     # mean time a copy is kept (gamma distributed, so some are late)
+
+CATEGORIES = ["Comedy", "Crime", "Action", "Drama", "Western", "Biography", "Horror", "Sci-Fi",
+              "Romance", "Documentary", "Animation", "Thriller", "Family", "Fantasy", "Mystery",
+              "War", "Musical", "History", "Sport", "Adventure"]
+FIRST_NAMES = ["James", "Mary", "Robert", "Patricia", "John", "Jennifer", "Michael", "Linda", "David",
+               "Elizabeth", "William", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas",
+               "Sarah", "Carlos", "Karen", "Wei", "Priya", "Ahmed", "Yuki", "Olga", "Kwame", "Sofia",
+               "Mateo", "Aisha", "Lars"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez",
+              "Martinez", "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor",
+              "Moore", "Jackson", "Martin", "Lee", "Chen", "Patel", "Kim", "Nguyen", "Kowalski",
+              "Novak", "Silva", "Okafor", "Larsen"]
+WORDS = ["Night", "City", "Dark", "Last", "Lost", "Love", "Star", "Road", "River", "Storm", "King",
+         "Queen", "Dream", "Fire", "Ice", "Shadow", "Light", "Secret", "Silent", "Wild", "Golden",
+         "Broken", "Hidden", "Iron", "Blue", "Red", "Winter", "Summer", "Ghost", "Empire", "Island",
+         "Heart", "Blood", "Glass", "Echo", "Paper", "Stone", "Moon", "Sun", "Ocean"]
+DESCRIPTION_WORDS = ["detective", "family", "war", "heist", "journey", "revenge", "friendship", "rivalry",
+                     "small", "town", "space", "ship", "robot", "hospital", "school", "band", "chef",
+                     "lawyer", "soldier", "spy", "farm", "mountain", "desert", "ocean", "island",
+                     "secret", "murder", "mystery", "love", "story", "comedy", "about", "unexpected",
+                     "events", "brothers", "sisters", "mother", "father", "kingdom", "ancient"]
+MPAA = ["G", "PG", "PG-13", "R", "NC-17", "TV-MA"]
+MPAA_P = [0.06, 0.2, 0.34, 0.34, 0.02, 0.04]
+LOCATIONS = ["Front Shelf", "Back Shelf", "New Releases", "Warehouse"]
+PAYMENT_METHODS = ["CARD", "CASH", "ONLINE"]
+PAYMENT_P = [0.6, 0.25, 0.15]
+
+
+def _timestamps(seconds):
+    """'YYYY-MM-DD HH:MM:SS' strings for an array of datetime64[s]."""
+    return np.char.replace(np.datetime_as_string(seconds, unit="s"), "T", " ")
+
+
+def _insert(conn, sql, columns, chunk=CHUNK):
+    """executemany over column arrays, ``chunk`` rows at a time."""
+    total = len(columns[0])
+    for start in range(0, total, chunk):
+        part = [col[start:start + chunk].tolist() if hasattr(col, "tolist") else col[start:start + chunk]
+                for col in columns]
+        conn.executemany(sql, zip(*part))
+    return total
+
+
+def _strip_schema(conn):
+    """Drop triggers and secondary indexes for the bulk load; return their SQL."""
+    saved = conn.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE type IN ('trigger', 'index') AND sql IS NOT NULL"
+    ).fetchall()
+    for kind, name, _ in saved:
+        conn.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+    return [sql for _, _, sql in saved]
+
+
+def generate(db_path, movies, customers, rentals, seed=42, end=DEFAULT_END, log=print):
+    """Create ``db_path`` (schema + sample data) and add the synthetic rows."""
+    if np is None:
+        raise SystemExit("datagen needs NumPy: pip install numpy")
+    for path in (db_path, movie_app.archive.default_path(db_path)):
+        if os.path.exists(path):
+            raise SystemExit(f"{path} already exists; remove it or pick another path")
+
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+
+    movie_app.app.config["DATABASE"] = db_path
+    with movie_app.app.app_context():
+        movie_app.init_db()
+        movie_app.seed_db()
+    movie_app.get_pool().close()  # release the file so the load can switch off WAL
+
+    conn = movie_app.db.open_connection(db_path, setup=movie_app.attach_archive)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -512000")
+    conn.execute("PRAGMA foreign_keys = OFF")
+    restore = _strip_schema(conn)
+
+    def base_id(table, key):
+        return conn.execute(f"SELECT COALESCE(MAX({key}), 0) FROM {table}").fetchone()[0] + 1
+
+    # ---- categories and actors
+    existing = {row[0] for row in conn.execute("SELECT category_name FROM category")}
+    conn.executemany("INSERT INTO category (category_name) VALUES (?)",
+                     [(name,) for name in CATEGORIES if name not in existing])
+    category_ids = np.array([row[0] for row in conn.execute("SELECT category_id FROM category")])
+
+    n_actors = max(50, movies // 2)
+    actor0 = base_id("actor", "actor_id")
+    first = rng.choice(FIRST_NAMES, n_actors)
+    last = rng.choice(LAST_NAMES, n_actors)
+    _insert(conn, "INSERT INTO actor (actor_id, actor_name) VALUES (?, ?)",
+            [np.arange(actor0, actor0 + n_actors), np.char.add(np.char.add(first, " "), last)])
+    log(f"  {n_actors} actors")
+
+    # ---- movies: popularity is Zipf over a random order of the titles
+    movie0 = base_id("movie", "movie_id")
+    movie_ids = np.arange(movie0, movie0 + movies)
+    popularity = 1.0 / np.arange(1, movies + 1) ** MOVIE_SKEW
+    popularity = rng.permutation(popularity / popularity.sum())
+    end_day = np.datetime64(end, "s")
+    years = np.clip(2025 - rng.gamma(2.0, 8.0, movies).astype(int), 1920, 2025)
+    titles = [f"{WORDS[a]} {WORDS[b]} {i}" for i, (a, b) in
+              enumerate(zip(rng.integers(0, len(WORDS), movies), rng.integers(0, len(WORDS), movies)), movie0)]
+    desc_words = rng.choice(DESCRIPTION_WORDS, (movies, 8))
+    descriptions = [" ".join(words) for words in desc_words.tolist()]
+    rates = rng.choice([2.99, 3.99, 4.99, 5.99], movies, p=[0.15, 0.3, 0.4, 0.15])
+    late_fees = np.round(rates / 4, 2)
+    _insert(conn, "INSERT INTO movie (movie_id, title, release_year, mpaa_rating, length_minutes, movie_rating, "
+                  "description, rental_rate, late_fee) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [movie_ids, titles, years, rng.choice(MPAA, movies, p=MPAA_P),
+             rng.normal(110, 20, movies).clip(70, 240).astype(int),
+             np.round(rng.normal(6.6, 1.1, movies).clip(1, 10), 1), descriptions, rates, late_fees])
+    log(f"  {movies} movies")
+
+    # 1-3 categories and 2-5 actors per movie (popular actors in more films)
+    per_movie = rng.integers(1, 4, movies)
+    mc_movie = np.repeat(movie_ids, per_movie)
+    mc_cat = rng.choice(category_ids, len(mc_movie))
+    pairs = np.unique(np.stack([mc_movie, mc_cat], axis=1), axis=0)
+    _insert(conn, "INSERT INTO movie_category (movie_id, category_id) VALUES (?, ?)", [pairs[:, 0], pairs[:, 1]])
+
+    per_movie = rng.integers(2, 6, movies)
+    ma_movie = np.repeat(movie_ids, per_movie)
+    actor_pop = 1.0 / np.arange(1, n_actors + 1) ** 0.8
+    ma_actor = actor0 + rng.choice(n_actors, len(ma_movie), p=actor_pop / actor_pop.sum())
+    pairs = np.unique(np.stack([ma_movie, ma_actor], axis=1), axis=0)
+    roles = np.char.add("Role ", rng.integers(1, 99, len(pairs)).astype(str))
+    _insert(conn, "INSERT INTO movie_actor (movie_id, actor_id, role_name) VALUES (?, ?, ?)",
+            [pairs[:, 0], pairs[:, 1], roles])
+
+    # ---- copies: enough for the title's usual number of rentals out at once
+    out_at_once = rentals * popularity * MEAN_DAYS_OUT / HISTORY_DAYS
+    copies = 1 + rng.poisson(0.5 + 1.5 * out_at_once)
+    copy0 = base_id("inventory_copy", "copy_id")
+    copy_start = copy0 + np.concatenate([[0], np.cumsum(copies)[:-1]])
+    n_copies = int(copies.sum())
+    copy_movie = np.repeat(movie_ids, copies)
+    _insert(conn, "INSERT INTO inventory_copy (copy_id, movie_id, status, store_location) VALUES (?, ?, 'AVAILABLE', ?)",
+            [np.arange(copy0, copy0 + n_copies), copy_movie, rng.choice(LOCATIONS, n_copies)])
+    log(f"  {n_copies} copies")
+
+    # ---- customers
+    customer0 = base_id("customer", "customer_id")
+    customer_ids = np.arange(customer0, customer0 + customers)
+    first = rng.choice(FIRST_NAMES, customers)
+    last = rng.choice(LAST_NAMES, customers)
+    emails = np.char.add(np.char.add(np.char.add(np.char.lower(first), "."), np.char.lower(last)),
+                         np.char.add(customer_ids.astype(str), "@example.com"))
+    signup = end_day - (rng.random(customers) * HISTORY_DAYS * 86400).astype("timedelta64[s]")
+    _insert(conn, "INSERT INTO customer (customer_id, first_name, last_name, email, phone, address, signup_date) "
+                  "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [customer_ids, first, last, emails,
+             np.char.add("412-555-", rng.integers(0, 10000, customers).astype(str)),
+             np.char.add(rng.integers(1, 9999, customers).astype(str), " Main St, Pittsburgh, PA"),
+             np.datetime_as_string(signup, unit="D")])
+    log(f"  {customers} customers")
+
+    # ---- rentals, in chronological order; business grows over time
+    activity = np.minimum(rng.pareto(CUSTOMER_SKEW, customers) + 1, MAX_ACTIVITY)
+    activity /= activity.sum()
+    age = np.sort((1 - rng.random(rentals) ** 0.7) * HISTORY_DAYS * 86400)[::-1]
+    rental_at = end_day - age.astype("timedelta64[s]")
+    movie_idx = rng.choice(movies, rentals, p=popularity)
+    copy_ids = copy_start[movie_idx] + (rng.random(rentals) * copies[movie_idx]).astype(int)
+    renter = customer_ids[rng.choice(customers, rentals, p=activity)]
+    held = (rng.gamma(2.0, MEAN_DAYS_OUT / 2.0, rentals) * 86400).astype("timedelta64[s]")
+    returned_at = rental_at + held
+    is_open = returned_at > end_day
+    # a copy can only be out once: keep the latest open rental per copy
+    open_idx = np.flatnonzero(is_open)
+    _, last_open = np.unique(copy_ids[open_idx][::-1], return_index=True)
+    keep = np.zeros(rentals, dtype=bool)
+    keep[open_idx[::-1][last_open]] = True
+    returned_at = np.where(is_open & ~keep, end_day - np.timedelta64(60, "s"), returned_at)
+    is_open = keep
+
+    rental0 = base_id("rental", "rental_id")
+    paid = ~is_open & (rng.random(rentals) < 0.95)
+    method = rng.choice(len(PAYMENT_METHODS), rentals, p=PAYMENT_P)
+    late_days = np.ceil((held / np.timedelta64(1, "D")) - RENTAL_DAYS).clip(0)
+    amount = np.round(rates[movie_idx] + late_days * late_fees[movie_idx], 2)
+    # timestamps are formatted a chunk at a time: as strings 20M rentals need gigabytes
+    for start in range(0, rentals, CHUNK):
+        part = slice(start, start + CHUNK)
+        ids = np.arange(rental0 + start, rental0 + min(start + CHUNK, rentals))
+        out, returned = is_open[part], _timestamps(returned_at[part])
+        conn.executemany(
+            "INSERT INTO rental (rental_id, customer_id, copy_id, rental_date, due_date, return_date, "
+            "rental_status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            zip(ids.tolist(), renter[part].tolist(), copy_ids[part].tolist(),
+                _timestamps(rental_at[part]).tolist(),
+                _timestamps(rental_at[part] + np.timedelta64(RENTAL_DAYS, "D")).tolist(),
+                [None if o else r for o, r in zip(out.tolist(), returned.tolist())],
+                np.where(out, "OPEN", "RETURNED").tolist()),
+        )
+        pay = paid[part]
+        conn.executemany(
+            "INSERT INTO payment (rental_id, amount, payment_date, payment_method) VALUES (?, ?, ?, ?)",
+            zip(ids[pay].tolist(), amount[part][pay].tolist(), returned[pay].tolist(),
+                np.array(PAYMENT_METHODS)[method[part][pay]].tolist()),
+        )
+    conn.executemany("UPDATE inventory_copy SET status = 'RENTED' WHERE copy_id = ?",
+                     [(int(c),) for c in copy_ids[is_open]])
+    n_paid = int(paid.sum())
+    log(f"  {rentals} rentals ({int(is_open.sum())} still out), {n_paid} payments")
+    conn.commit()
+
+    # ---- put the schema back and rebuild what the triggers would have kept
+    log("  rebuilding indexes, search index, report stats and recommendations")
+    for sql in restore:
+        conn.execute(sql)
+    search.rebuild_search_index(conn)
+    stats.rebuild(conn)
+    availability.rebuild(conn)
+    recommend.rebuild(conn)
+    conn.execute("ANALYZE")
+    conn.commit()
+    conn.execute("PRAGMA foreign_keys = ON")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.close()
+    log(f"Built {db_path} in {time.perf_counter() - started:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("db_path")
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--movies", type=int)
+    parser.add_argument("--customers", type=int)
+    parser.add_argument("--rentals", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--end", default=DEFAULT_END, help="Date the history runs up to (YYYY-MM-DD).")
+    args = parser.parse_args()
+
+    movies, customers, rentals = SCALES[args.scale]
+    generate(args.db_path, args.movies or movies, args.customers or customers, args.rentals or rentals,
+             seed=args.seed, end=args.end)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Catalog data version shared by all worker processes, and ETags built on it.
+
+The catalog pages (/movies, /movies/<id>, /reports/popular) only change
+when a rental, a return or a new movie is committed. Each of those write
+paths calls bump() after committing, which adds one to a counter kept in a
+small file next to the database (``movierental.db-version``). Every worker
+maps that file into memory, so reading the current version is a memory
+read: a page whose ETag (version + URL + who is logged in) matches what
+the browser already has is answered 304 without touching SQLite, and
+rendered fragments can be cached under the version they were built from.
+
+The version is read before a page runs its queries, so whatever is built
+under a version is at least as new as that version. Writes that bypass the
+app (the sqlite3 shell, another program) do not bump it; run
+``flask --app app bump-data-version`` after those.
+"""
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:   # Windows: bumps are only serialized within this process
+    fcntl = None
+
+# version counter, time of the last bump (Unix seconds, 0 = never)
+_LAYOUT = struct.Struct("<qd")
+
+
+class DataVersion:
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        if os.fstat(self._fd).st_size < _LAYOUT.size:
+            os.ftruncate(self._fd, _LAYOUT.size)
+        self._map = mmap.mmap(self._fd, _LAYOUT.size)
+        self._lock = threading.Lock()
+
+    def current(self):
+        """(version, time of the last bump or None)."""
+        version, changed = _LAYOUT.unpack_from(self._map)
+        return version, changed or None
+
+    def bump(self):
+        """Mark the catalog as changed; returns the new version."""
+        with self._lock:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                version, _ = _LAYOUT.unpack_from(self._map)
+                _LAYOUT.pack_into(self._map, 0, version + 1, time.time())
+                return version + 1
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+def etag(version, *parts):
+    """Strong ETag value for a page built from ``parts`` at ``version``."""
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()[:16]
+    return f"v{version}-{digest}"
@@ -0,0 +1,340 @@
+"""SQLite connection pool for the Flask app.
+
+Every request used to open its own sqlite3 connection, set the row factory and
+run the PRAGMAs, then throw it all away. The pool keeps those connections
+alive: a request checks one out (through flask.g, see app.get_connection) and
+the app teardown hook hands it back for the next request.
+
+It also holds the storage configuration (WAL and friends, see
+storage_pragmas) and the WriterQueue that funnels write transactions.
+"""
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+# prepared statements kept per connection (sqlite3's default is 128); the
+# app's fixed set of statement texts (queries.statements()) must fit
+CACHED_STATEMENTS = 512
+
+# PRAGMAs applied once, when a pooled connection is first opened
+CONNECTION_PRAGMAS = (
+    "PRAGMA busy_timeout = 5000;",
+    "PRAGMA foreign_keys = ON;",
+)
+
+
+def storage_pragmas(journal_mode="WAL", synchronous="NORMAL", mmap_size=256 * 1024 * 1024,
+                    cache_size=-64000, temp_store="MEMORY"):
+    """Build the storage PRAGMAs for a connection.
+
+    WAL lets readers keep reading while a writer commits, and with WAL
+    synchronous=NORMAL only fsyncs at checkpoints instead of on every commit.
+    cache_size is in pages, or KiB when negative (-64000 = ~64 MB).
+    """
+    return CONNECTION_PRAGMAS + (
+        f"PRAGMA journal_mode = {journal_mode};",
+        f"PRAGMA synchronous = {synchronous};",
+        f"PRAGMA mmap_size = {int(mmap_size)};",
+        f"PRAGMA cache_size = {int(cache_size)};",
+        f"PRAGMA temp_store = {temp_store};",
+    )
+
+
+class StatementCache:
+    """Replay of a connection's prepared-statement cache, for its hit rate.
+
+    sqlite3 keeps the last ``cached_statements`` statement texts of a
+    connection prepared (least recently used goes first) but does not say
+    how often a statement was found there. lookup() runs the same LRU over
+    the texts the app executes; instrument.TimedCursor calls it, so the
+    counts only cover requests with SQL_INSTRUMENTATION on.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self._texts = OrderedDict()
+
+    def lookup(self, sql):
+        """Record an execute of ``sql``; True if it was already prepared."""
+        if sql in self._texts:
+            self._texts.move_to_end(sql)
+            self.hits += 1
+            return True
+        self._texts[sql] = None
+        if len(self._texts) > self.capacity:
+            self._texts.popitem(last=False)
+        self.misses += 1
+        return False
+
+
+class Connection(sqlite3.Connection):
+    """sqlite3 connection carrying the StatementCache of its statements."""
+
+    def __init__(self, *args, cached_statements=CACHED_STATEMENTS, **kwargs):
+        super().__init__(*args, cached_statements=cached_statements, **kwargs)
+        self.statements = StatementCache(cached_statements)
+
+
+def open_connection(db_path, pragmas=CONNECTION_PRAGMAS, cached_statements=CACHED_STATEMENTS, setup=None):
+    """Open a configured connection (Row factory + PRAGMAs, then ``setup(conn)``)."""
+    # check_same_thread=False: a connection is only ever used by one thread
+    # at a time, but it may be a different thread on its next checkout.
+    conn = sqlite3.connect(db_path, timeout=10, check_same_thread=False,
+                           cached_statements=cached_statements, factory=Connection)
+    conn.row_factory = sqlite3.Row
+    for pragma in pragmas:
+        conn.execute(pragma)
+    if setup is not None:
+        setup(conn)
+    return conn
+
+
+class PooledConnection:
+    """Thin wrapper around a pooled sqlite3 connection.
+
+    Handlers written for one-connection-per-request call ``conn.close()``
+    when they are done. On a pooled connection that must not really close
+    it, so close() only rolls back whatever was left uncommitted (the same
+    thing a real close would have done) and the connection goes back to
+    the pool at app teardown.
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    @property
+    def raw(self):
+        return self._raw
+
+    def close(self):
+        if self._raw.in_transaction:
+            self._raw.rollback()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self._raw.__enter__()
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._raw.__exit__(exc_type, exc, tb)
+
+
+class ConnectionPool:
+    """Bounded pool of long-lived sqlite3 connections.
+
+    At most ``max_size`` connections are open at once. When all of them are
+    checked out, acquire() waits (up to ``timeout`` seconds) for one to be
+    released; how long callers waited is tracked in stats().
+    """
+
+    def __init__(self, db_path, max_size=8, timeout=30.0, pragmas=CONNECTION_PRAGMAS,
+                 cached_statements=CACHED_STATEMENTS, setup=None):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.timeout = timeout
+        self.pragmas = pragmas
+        self.cached_statements = cached_statements
+        self.setup = setup
+        self._connections = weakref.WeakSet()
+
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+
+        # metrics
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def acquire(self):
+        start = time.perf_counter()
+        waited = False
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise RuntimeError("connection pool is closed")
+                if self._idle:
+                    raw = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    # reserve the slot, open the connection outside the lock
+                    self._size += 1
+                    raw = None
+                    break
+                waited = True
+                remaining = self.timeout - (time.perf_counter() - start)
+                if remaining <= 0:
+                    raise TimeoutError(
+                        f"no pooled connection available after {self.timeout}s "
+                        f"(pool size {self.max_size})"
+                    )
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._checkouts += 1
+            if waited:
+                elapsed = time.perf_counter() - start
+                self._waits += 1
+                self._wait_total += elapsed
+                self._wait_max = max(self._wait_max, elapsed)
+
+        if raw is None:
+            try:
+                raw = open_connection(self.db_path, self.pragmas, self.cached_statements, self.setup)
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            # stats() walks the set under the same lock
+            with self._cond:
+                self._connections.add(raw)
+        return PooledConnection(raw)
+
+    def release(self, conn):
+        raw = conn.raw if isinstance(conn, PooledConnection) else conn
+        try:
+            if raw.in_transaction:
+                raw.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+
+        with self._cond:
+            self._in_use -= 1
+            if healthy and not self._closed:
+                self._idle.append(raw)
+            else:
+                self._size -= 1
+                raw.close()
+            self._cond.notify()
+
+    def close(self):
+        """Close idle connections and refuse new checkouts."""
+        with self._cond:
+            self._closed = True
+            while self._idle:
+                self._idle.pop().close()
+                self._size -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            # a copy: the WeakSet also shrinks when a closed connection is collected
+            caches = [conn.statements for conn in list(self._connections)]
+            hits = sum(cache.hits for cache in caches)
+            lookups = hits + sum(cache.misses for cache in caches)
+            return {
+                "db_path": self.db_path,
+                "max_size": self.max_size,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+                "wait_avg_ms": round(self._wait_total * 1000 / self._waits, 3) if self._waits else 0.0,
+                "statement_cache": {
+                    "capacity": self.cached_statements,
+                    "hits": hits,
+                    "misses": lookups - hits,
+                    "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                },
+            }
+
+
+class WriterQueue:
+    """Serializes write transactions inside this process.
+
+    Writers take a ticket and run one at a time in arrival order, each inside
+    BEGIN IMMEDIATE, so two clerks never race for the write lock and hit
+    "database is locked" halfway through a rental. Readers never go through
+    the queue; with WAL they keep reading the last committed snapshot.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._cond = threading.Condition()
+        self._next_ticket = 0
+        self._serving = 0
+
+        # metrics
+        self._writes = 0
+        self._waits = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @contextmanager
+    def transaction(self, conn, immediate=False):
+        """Run a block as one write transaction.
+
+        The block commits explicitly (``conn.commit()``); anything still
+        uncommitted when it exits, normally or by exception, is rolled back.
+        With the queue disabled the block runs in the legacy implicit
+        deferred transaction unless ``immediate`` asks for BEGIN IMMEDIATE.
+
+        A transaction must not already be open on ``conn``: committing it
+        here would commit half of the caller's unit of work, so that raises
+        RuntimeError instead (nest the work inside one block).
+        """
+        if conn.in_transaction:
+            raise RuntimeError("a transaction is already open on this connection; "
+                               "commit or roll it back before starting a write transaction")
+        if not self.enabled:
+            # legacy behaviour: implicit deferred transaction, no queueing
+            try:
+                if immediate:
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+            return
+
+        start = time.perf_counter()
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            waited = ticket != self._serving
+            while ticket != self._serving:
+                self._cond.wait()
+            self._writes += 1
+            if waited:
+                elapsed = time.perf_counter() - start
+                self._waits += 1
+                self._wait_total += elapsed
+                self._wait_max = max(self._wait_max, elapsed)
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+        finally:
+            with self._cond:
+                self._serving += 1
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "writes": self._writes,
+                "queued": self._next_ticket - self._serving,
+                "waits": self._waits,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_max_ms": round(self._wait_max * 1000, 3),
+            }
@@ -0,0 +1,20 @@
+"""gunicorn settings: ``gunicorn -c gunicorn.conf.py wsgi:app``.
+
+The app is imported (schema checked, migrations run) once in the master
+and the workers are forked from it. Each worker opens its own SQLite
+connections, caches and maintenance scheduler after the fork (see
+app.configure_app), and workers share the catalog data version through the
+``-version`` file next to the database. Writes from different workers are
+serialized by SQLite's own lock (busy_timeout); within a worker by its
+writer queue.
+"""
+import os
+
+bind = os.environ.get("MOVIE_RENTAL_BIND", "127.0.0.1:8000")
+# SQLite reads scale with processes; one writer at a time regardless
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 * (os.cpu_count() or 1) + 1))
+# a few threads per worker keep it busy while a request waits on the write lock
+threads = int(os.environ.get("MOVIE_RENTAL_THREADS", 4))
+preload_app = True
+timeout = 60
+accesslog = os.environ.get("MOVIE_RENTAL_ACCESS_LOG")
@@ -0,0 +1,380 @@
+"""Bulk catalog import (CSV or JSON Lines).
+
+The add-movie form inserts one title with a single-row INSERT per category,
+actor and copy. A distributor catalog of tens of thousands of titles goes
+through here instead:
+
+    flask --app app import-catalog catalog.csv
+    flask --app app import-catalog catalog.jsonl --chunk-size 2000
+
+Each record is one movie. CSV columns / JSON keys:
+
+    title (required), release_year, mpaa_rating, length_minutes,
+    movie_rating, description, rental_rate, late_fee,
+    categories   "Drama|Crime"                  or ["Drama", "Crime"]
+    actors       "Al Pacino:Michael|Diane Keaton" or ["Al Pacino", {"name": ..., "role": ...}]
+    copies       number of inventory copies (default 1)
+    store_location
+
+The file is read as a stream and written in chunks: every chunk is one
+write transaction that inserts its movies, links and copies with
+executemany. Categories and actors are matched by name (case-insensitive)
+through in-memory name -> id maps; names not seen before are created.
+
+Progress is stored in import_job together with each chunk, keyed by a hash
+of the file. If an import stops partway (crash, Ctrl-C, a database error),
+running it again on the same file skips the records already committed and
+carries on. Invalid records are skipped and reported with their line number.
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import time
+from datetime import datetime
+
+import search
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 20
+
+MOVIE_COLUMNS = ("title", "release_year", "mpaa_rating", "length_minutes", "movie_rating",
+                 "description", "rental_rate", "late_fee")
+DEFAULT_RENTAL_RATE = 4.99
+DEFAULT_LATE_FEE = 1.00
+DEFAULT_LOCATION = "Front Shelf"
+MAX_COPIES = 1000
+
+FORMATS = ("csv", "jsonl")
+
+
+class ImportFailed(Exception):
+    """An import that cannot start or stopped partway; it can be resumed."""
+
+
+def create_import_tables(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS import_job (
+            job_id       INTEGER PRIMARY KEY AUTOINCREMENT,
+            source       TEXT NOT NULL,
+            fingerprint  TEXT NOT NULL,
+            format       TEXT NOT NULL,
+            status       TEXT NOT NULL DEFAULT 'RUNNING',   -- RUNNING, FAILED, DONE
+            rows_done    INTEGER NOT NULL DEFAULT 0,        -- records consumed and committed
+            movies_added INTEGER NOT NULL DEFAULT 0,
+            copies_added INTEGER NOT NULL DEFAULT 0,
+            rows_skipped INTEGER NOT NULL DEFAULT 0,
+            error        TEXT,
+            started_at   TEXT NOT NULL,
+            updated_at   TEXT NOT NULL
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_import_job_fingerprint ON import_job (fingerprint, job_id)")
+
+
+# ============== Reading ==============
+
+def detect_format(filename):
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".csv":
+        return "csv"
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    raise ImportFailed(f"cannot tell the format of {filename!r}; use .csv or .jsonl")
+
+
+def fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_records(f, fmt):
+    """Yield (line_number, record) from a text file; record is a dict or an error string."""
+    if fmt == "csv":
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield reader.line_num, record
+    else:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as exc:
+                yield line_no, f"invalid JSON: {exc}"
+                continue
+            yield line_no, record if isinstance(record, dict) else "expected a JSON object"
+
+
+def _split(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [part for part in str(value).split("|") if part.strip()]
+
+
+def _number(record, name, kind, default=None):
+    value = record.get(name)
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return default
+    try:
+        return kind(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+
+
+def _text(record, name):
+    value = record.get(name)
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def parse_record(record):
+    """Normalize one input record; raises ValueError when it is unusable.
+
+    Returns (movie_row, categories, actors, copies, store_location) where
+    actors is a list of (name, role).
+    """
+    title = _text(record, "title")
+    if not title:
+        raise ValueError("title is required")
+    movie = (
+        title,
+        _number(record, "release_year", int),
+        _text(record, "mpaa_rating"),
+        _number(record, "length_minutes", int),
+        _number(record, "movie_rating", float),
+        _text(record, "description"),
+        _number(record, "rental_rate", float, DEFAULT_RENTAL_RATE),
+        _number(record, "late_fee", float, DEFAULT_LATE_FEE),
+    )
+    categories = [str(name).strip() for name in _split(record.get("categories")) if str(name).strip()]
+    actors = []
+    for actor in _split(record.get("actors")):
+        if isinstance(actor, dict):
+            name, role = _text(actor, "name"), _text(actor, "role")
+        else:
+            name, _, role = str(actor).partition(":")
+            name, role = name.strip(), role.strip() or None
+        if name:
+            actors.append((name, role))
+    copies = _number(record, "copies", int, 1)
+    if not 0 <= copies <= MAX_COPIES:
+        raise ValueError(f"copies must be between 0 and {MAX_COPIES}")
+    return movie, categories, actors, copies, _text(record, "store_location") or DEFAULT_LOCATION
+
+
+# ============== Writing ==============
+
+class NameMap:
+    """In-memory name -> id map for a lookup table (category, actor).
+
+    Loaded once per import; names are matched case-insensitively and the
+    ones not in the table yet are inserted in one executemany per chunk.
+    """
+
+    def __init__(self, conn, table, id_column, name_column):
+        self.table = table
+        self.id_column = id_column
+        self.name_column = name_column
+        self.ids = {}
+        for row_id, name in conn.execute(f"SELECT {id_column}, {name_column} FROM {table} ORDER BY {id_column}"):
+            self.ids.setdefault(name.casefold(), row_id)
+        self.created = 0
+
+    def resolve(self, conn, names):
+        """Make sure every name has an id (creating missing ones)."""
+        missing = {}
+        for name in names:
+            key = name.casefold()
+            if key not in self.ids:
+                missing.setdefault(key, name)
+        if not missing:
+            return
+        # we hold the write lock, so the new rows are exactly those above the old max id
+        (before,) = conn.execute(f"SELECT COALESCE(MAX({self.id_column}), 0) FROM {self.table}").fetchone()
+        conn.executemany(f"INSERT INTO {self.table} ({self.name_column}) VALUES (?)",
+                         [(name,) for name in missing.values()])
+        for row_id, name in conn.execute(
+                f"SELECT {self.id_column}, {self.name_column} FROM {self.table} WHERE {self.id_column} > ?",
+                (before,)):
+            self.ids.setdefault(name.casefold(), row_id)
+        self.created += len(missing)
+
+    def __getitem__(self, name):
+        return self.ids[name.casefold()]
+
+    def forget(self, conn):
+        """Drop names created by a rolled-back chunk (reload from the table)."""
+        created = self.created
+        self.__init__(conn, self.table, self.id_column, self.name_column)
+        self.created = created
+
+
+def write_chunk(conn, chunk, categories, actors):
+    """Insert one chunk of parsed records; returns (movies, copies) added."""
+    categories.resolve(conn, [name for _, cats, _, _, _ in chunk for name in cats])
+    actors.resolve(conn, [name for _, _, acts, _, _ in chunk for name, _ in acts])
+
+    # search documents are built once per movie at the end of the block
+    with search.bulk_load(conn, []) as movie_ids:
+        (before,) = conn.execute("SELECT COALESCE(MAX(movie_id), 0) FROM movie").fetchone()
+        conn.executemany(
+            f"INSERT INTO movie ({', '.join(MOVIE_COLUMNS)}) VALUES ({', '.join('?' for _ in MOVIE_COLUMNS)})",
+            [movie for movie, _, _, _, _ in chunk],
+        )
+        movie_ids.extend(row[0] for row in conn.execute(
+            "SELECT movie_id FROM movie WHERE movie_id > ? ORDER BY movie_id", (before,)))
+        if len(movie_ids) != len(chunk):
+            raise ImportFailed("movie ids could not be matched to the imported rows")
+
+        movie_categories, movie_actors, copies = [], [], []
+        for movie_id, (_, cats, acts, num_copies, location) in zip(movie_ids, chunk):
+            movie_categories.extend({(movie_id, categories[name]) for name in cats})
+            seen = set()
+            for name, role in acts:
+                actor_id = actors[name]
+                if actor_id not in seen:
+                    seen.add(actor_id)
+                    movie_actors.append((movie_id, actor_id, role))
+            copies.extend([(movie_id, location)] * num_copies)
+
+        conn.executemany("INSERT INTO movie_category (movie_id, category_id) VALUES (?, ?)", movie_categories)
+        conn.executemany("INSERT INTO movie_actor (movie_id, actor_id, role_name) VALUES (?, ?, ?)", movie_actors)
+        conn.executemany(
+            "INSERT INTO inventory_copy (movie_id, status, store_location) VALUES (?, 'AVAILABLE', ?)", copies)
+    return len(movie_ids), len(copies)
+
+
+# ============== Jobs ==============
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def recent_jobs(conn, limit=10):
+    return conn.execute("SELECT * FROM import_job ORDER BY job_id DESC LIMIT ?", (limit,)).fetchall()
+
+
+def _open_job(conn, transaction, source, fp, fmt, restart):
+    """Return the job to continue for this file, creating one if needed."""
+    with transaction(conn, immediate=True):
+        job = conn.execute(
+            "SELECT * FROM import_job WHERE fingerprint = ? ORDER BY job_id DESC LIMIT 1", (fp,)
+        ).fetchone()
+        if job is not None and not restart:
+            if job["status"] == "DONE":
+                raise ImportFailed(
+                    f"{source} was already imported (job {job['job_id']}); import it again with restart")
+            conn.execute("UPDATE import_job SET status = 'RUNNING', error = NULL, updated_at = ? WHERE job_id = ?",
+                         (_now(), job["job_id"]))
+            conn.commit()
+            return job["job_id"], job["rows_done"]
+        cur = conn.execute(
+            "INSERT INTO import_job (source, fingerprint, format, started_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (source, fp, fmt, _now(), _now()),
+        )
+        conn.commit()
+        return cur.lastrowid, 0
+
+
+def import_file(conn, transaction, path, fmt=None, source=None, chunk_size=CHUNK_SIZE,
+                restart=False, progress=None):
+    """Import a catalog file; returns a report dict.
+
+    ``transaction(conn, immediate=True)`` opens a write transaction
+    (app.write_transaction). ``progress(report)`` is called after every
+    committed chunk. Raises ImportFailed when a chunk cannot be written;
+    everything before it stays committed and the next run resumes there.
+    """
+    fmt = fmt or detect_format(source or path)
+    if fmt not in FORMATS:
+        raise ImportFailed(f"unknown format {fmt!r}; use one of {', '.join(FORMATS)}")
+    source = source or os.path.basename(path)
+    job_id, resume_from = _open_job(conn, transaction, source, fingerprint(path), fmt, restart)
+
+    categories = NameMap(conn, "category", "category_id", "category_name")
+    actors = NameMap(conn, "actor", "actor_id", "actor_name")
+    report = {
+        "job_id": job_id, "source": source, "format": fmt, "resumed_from": resume_from,
+        "rows_done": resume_from, "rows_read": 0, "movies_added": 0, "copies_added": 0,
+        "rows_skipped": 0, "categories_created": 0, "actors_created": 0,
+        "errors": [], "elapsed": 0.0, "rows_per_sec": 0.0,
+    }
+    started = time.perf_counter()
+
+    def flush(chunk, consumed, skipped):
+        with transaction(conn, immediate=True):
+            try:
+                movies, copies = write_chunk(conn, chunk, categories, actors) if chunk else (0, 0)
+            except Exception:
+                conn.rollback()
+                categories.forget(conn)
+                actors.forget(conn)
+                raise
+            conn.execute(
+                """
+                UPDATE import_job
+                SET rows_done = rows_done + ?, movies_added = movies_added + ?,
+                    copies_added = copies_added + ?, rows_skipped = rows_skipped + ?, updated_at = ?
+                WHERE job_id = ?
+                """,
+                (consumed, movies, copies, skipped, _now(), job_id),
+            )
+            conn.commit()
+        report["rows_done"] += consumed
+        report["rows_read"] += consumed
+        report["movies_added"] += movies
+        report["copies_added"] += copies
+        report["rows_skipped"] += skipped
+        report["categories_created"] = categories.created
+        report["actors_created"] = actors.created
+        report["elapsed"] = time.perf_counter() - started
+        report["rows_per_sec"] = report["rows_read"] / report["elapsed"] if report["elapsed"] else 0.0
+        if progress:
+            progress(report)
+
+    try:
+        with io.open(path, newline="", encoding="utf-8-sig") as f:
+            chunk, consumed, skipped = [], 0, 0
+            for position, (line_no, record) in enumerate(read_records(f, fmt)):
+                if position < resume_from:
+                    continue
+                consumed += 1
+                try:
+                    if isinstance(record, str):
+                        raise ValueError(record)
+                    chunk.append(parse_record(record))
+                except ValueError as exc:
+                    skipped += 1
+                    if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                        report["errors"].append(f"line {line_no}: {exc}")
+                if consumed >= chunk_size:
+                    flush(chunk, consumed, skipped)
+                    chunk, consumed, skipped = [], 0, 0
+            if consumed:
+                flush(chunk, consumed, skipped)
+    except Exception as exc:
+        message = str(exc) if isinstance(exc, ImportFailed) else f"{type(exc).__name__}: {exc}"
+        with transaction(conn, immediate=True):
+            conn.execute("UPDATE import_job SET status = 'FAILED', error = ?, updated_at = ? WHERE job_id = ?",
+                         (message, _now(), job_id))
+            conn.commit()
+        raise ImportFailed(f"import stopped after {report['rows_done']} records ({message}); "
+                           f"run it again on the same file to resume") from exc
+
+    with transaction(conn, immediate=True):
+        conn.execute("UPDATE import_job SET status = 'DONE', updated_at = ? WHERE job_id = ?", (_now(), job_id))
+        conn.commit()
+    report["elapsed"] = time.perf_counter() - started
+    report["rows_per_sec"] = report["rows_read"] / report["elapsed"] if report["elapsed"] else 0.0
+    return report
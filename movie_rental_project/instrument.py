@@ -0,0 +1,363 @@
+"""Per-request SQL instrumentation, slow-query log and route metrics.
+
+While a request runs, its connection (see app.get_connection) is wrapped
+in a TimedConnection. Two things watch it:
+
+  * sqlite3's trace callback counts every statement SQLite runs for the
+    request, including the BEGIN/COMMIT the sqlite3 module issues itself;
+  * TimedCursor times execute() and the fetches that follow it, and
+    charges that time to the statement the cursor is running.
+
+At the end of the request, RequestStats holds the query count, the total
+time spent in SQLite, the slowest statement and how many statements were
+found already prepared in the connection's statement cache
+(db.StatementCache). Statements slower than the
+threshold go to the ``movie_rental.slow_query`` logger together with their
+EXPLAIN QUERY PLAN. RouteMetrics keeps rolling histograms per route for
+/admin/metrics/prometheus.
+"""
+import bisect
+import logging
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+import query_plans
+
+# upper bounds of the histogram buckets (+Inf is implicit)
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+slow_query_log = logging.getLogger("movie_rental.slow_query")
+request_log = logging.getLogger("movie_rental.sql")
+
+
+class RequestStats:
+    """SQL activity of one request."""
+
+    def __init__(self, slow_threshold):
+        self.slow_threshold = slow_threshold
+        self.queries = 0
+        self.db_time = 0.0
+        self.slowest = None      # (seconds, sql)
+        self.slow = []           # (seconds, sql, params)
+        self.statement_hits = 0
+        self.statement_misses = 0
+        self.finished = False
+        self._cursors = []
+        self._last_traced = None
+
+    def trace(self, statement):
+        """sqlite3 trace callback.
+
+        A firing trigger is reported again with the text of the statement
+        that fired it, so a repeat of the last statement is not counted
+        unless a cursor executed it again (see TimedCursor._start).
+        """
+        if statement == self._last_traced or statement.startswith("--"):
+            return
+        self._last_traced = statement
+        self.queries += 1
+
+    def record(self, sql, params, seconds):
+        self.db_time += seconds
+        if self.slowest is None or seconds > self.slowest[0]:
+            self.slowest = (seconds, sql)
+        if seconds >= self.slow_threshold:
+            self.slow.append((seconds, sql, params))
+
+    def finish(self):
+        """Charge the statements still open on a cursor (fetched only partly).
+
+        Returns False if the stats were already finished.
+        """
+        if self.finished:
+            return False
+        for cursor in self._cursors:
+            cursor._finish()
+        self._cursors.clear()
+        self.finished = True
+        return True
+
+
+class TimedCursor:
+    """sqlite3.Cursor wrapper that times a statement from execute to last fetch."""
+
+    def __init__(self, cursor, stats, statements=None):
+        self._cursor = cursor
+        self._stats = stats
+        self._statements = statements
+        self._sql = None
+        self._params = None
+        self._elapsed = 0.0
+
+    def _finish(self):
+        if self._sql is not None:
+            self._stats.record(self._sql, self._params, self._elapsed)
+            self._sql = None
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            self._elapsed += time.perf_counter() - start
+
+    def _start(self, sql, params, method, *args):
+        self._finish()
+        self._stats._last_traced = None
+        self._sql, self._params, self._elapsed = sql, params, 0.0
+        self._timed(method, *args)
+        if self._cursor.description is None:   # nothing to fetch
+            self._finish()
+        return self
+
+    def _prepared(self, sql):
+        if self._statements is not None:
+            if self._statements.lookup(sql):
+                self._stats.statement_hits += 1
+            else:
+                self._stats.statement_misses += 1
+
+    def execute(self, sql, params=()):
+        self._prepared(sql)
+        return self._start(sql, params, self._cursor.execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        self._prepared(sql)
+        return self._start(sql, None, self._cursor.executemany, sql, seq_of_params)
+
+    def executescript(self, script):
+        return self._start(script, None, self._cursor.executescript, script)
+
+    def fetchone(self):
+        row = self._timed(self._cursor.fetchone)
+        if row is None:
+            self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self._cursor.arraysize if size is None else size
+        rows = self._timed(self._cursor.fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(self._cursor.fetchall)
+        self._finish()
+        return rows
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return self._timed(next, self._cursor)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        self._cursor.close()
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedConnection:
+    """Connection wrapper whose cursors are TimedCursors.
+
+    ``wrapped`` is the connection it was built from; that is what goes back
+    to the pool.
+    """
+
+    def __init__(self, conn, stats):
+        self.wrapped = conn
+        self.stats = stats
+        self.statements = getattr(conn, "statements", None)   # db.StatementCache
+        conn.set_trace_callback(stats.trace)
+
+    def cursor(self):
+        cursor = TimedCursor(self.wrapped.cursor(), self.stats, self.statements)
+        self.stats._cursors.append(cursor)
+        return cursor
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def commit(self):
+        start = time.perf_counter()
+        try:
+            self.wrapped.commit()
+        finally:
+            self.stats.record("COMMIT", None, time.perf_counter() - start)
+
+    def detach(self):
+        """Stop tracing; return the wrapped connection."""
+        self.stats.finish()
+        self.wrapped.set_trace_callback(None)
+        return self.wrapped
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def __enter__(self):
+        # ``with conn:`` blocks must keep executing through the wrapper,
+        # or their statements skip the timing and the slow-query log
+        self.wrapped.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        start = time.perf_counter()
+        try:
+            return self.wrapped.__exit__(exc_type, exc, tb)
+        finally:
+            if exc_type is None:   # sqlite3 commits on a clean exit
+                self.stats.record("COMMIT", None, time.perf_counter() - start)
+
+
+def explain(conn, sql, params):
+    """EXPLAIN QUERY PLAN lines for ``sql`` (unknown parameters bound to NULL)."""
+    if params is None:
+        params = [None] * sql.count("?")
+    try:
+        return query_plans.plan(conn, sql, params)
+    except (sqlite3.Error, ValueError) as exc:
+        return [f"(no plan: {exc})"]
+
+
+def log_slow_queries(conn, stats, route):
+    """Write the request's slow statements and their plans to the slow-query log."""
+    for seconds, sql, params in stats.slow:
+        if sql == "COMMIT":
+            plan = []
+        else:
+            plan = explain(conn, sql, params)
+        slow_query_log.warning(
+            "%.1f ms in %s\n%s\nparams: %r\nplan:\n%s",
+            seconds * 1000, route, " ".join(sql.split()), params,
+            "\n".join(f"  {line}" for line in plan) or "  (none)",
+        )
+
+
+def server_timing(stats):
+    """Server-Timing header value: the request's DB time and query count."""
+    return f'db;dur={stats.db_time * 1000:.2f};desc="{stats.queries} queries"'
+
+
+class RollingHistogram:
+    """Histogram over the last ``window`` seconds.
+
+    Observations land in one of ``slices`` time slices; a snapshot adds up
+    the slices that are still inside the window, so old requests age out
+    a slice at a time.
+    """
+
+    def __init__(self, buckets, window=300.0, slices=5, clock=time.monotonic):
+        self.buckets = buckets
+        self.slice_length = window / slices
+        self.slices = slices
+        self._clock = clock
+        self._data = {}   # slice number -> [counts per bucket + overflow, sum, count]
+
+    def _slice(self):
+        return int(self._clock() // self.slice_length)
+
+    def observe(self, value):
+        now = self._slice()
+        data = self._data.get(now)
+        if data is None:
+            data = self._data[now] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            for old in [n for n in self._data if n <= now - self.slices]:
+                del self._data[old]
+        data[0][bisect.bisect_left(self.buckets, value)] += 1
+        data[1] += value
+        data[2] += 1
+
+    def snapshot(self):
+        """(cumulative bucket counts incl. +Inf, sum, count) for the window."""
+        oldest = self._slice() - self.slices
+        counts, total, n = [0] * (len(self.buckets) + 1), 0.0, 0
+        for number, (slice_counts, slice_sum, slice_n) in self._data.items():
+            if number > oldest:
+                counts = [a + b for a, b in zip(counts, slice_counts)]
+                total += slice_sum
+                n += slice_n
+        running, cumulative = 0, []
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total, n
+
+
+class RouteMetrics:
+    """Rolling per-route histograms of request time, DB time and query count."""
+
+    HISTOGRAMS = (
+        ("request_duration_seconds", DURATION_BUCKETS, "Request latency"),
+        ("request_db_seconds", DURATION_BUCKETS, "Time spent in SQLite per request"),
+        ("request_queries", QUERY_BUCKETS, "SQL statements per request"),
+    )
+
+    def __init__(self, window=300.0, prefix="movie_rental"):
+        self.window = window
+        self.prefix = prefix
+        self._routes = {}            # route -> {histogram name: RollingHistogram}
+        self._requests = Counter()   # (route, status) -> count, since start
+        self._slow_queries = 0
+        self._statements = Counter()  # (route, "hit"/"miss") -> count, since start
+        self._lock = threading.Lock()
+
+    def observe(self, route, status, duration, stats=None):
+        with self._lock:
+            histograms = self._routes.get(route)
+            if histograms is None:
+                histograms = self._routes[route] = {
+                    name: RollingHistogram(buckets, self.window) for name, buckets, _ in self.HISTOGRAMS}
+            histograms["request_duration_seconds"].observe(duration)
+            histograms["request_db_seconds"].observe(stats.db_time if stats else 0.0)
+            histograms["request_queries"].observe(stats.queries if stats else 0)
+            self._requests[(route, status)] += 1
+            self._slow_queries += len(stats.slow) if stats else 0
+            if stats:
+                self._statements[(route, "hit")] += stats.statement_hits
+                self._statements[(route, "miss")] += stats.statement_misses
+
+    def prometheus(self):
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            for name, buckets, help_text in self.HISTOGRAMS:
+                metric = f"{self.prefix}_{name}"
+                lines.append(f"# HELP {metric} {help_text} (last {self.window:g}s)")
+                lines.append(f"# TYPE {metric} histogram")
+                for route, histograms in sorted(self._routes.items()):
+                    counts, total, n = histograms[name].snapshot()
+                    for bound, count in zip(list(buckets) + ["+Inf"], counts):
+                        lines.append(f'{metric}_bucket{{route="{route}",le="{bound}"}} {count}')
+                    lines.append(f'{metric}_sum{{route="{route}"}} {total:.6f}')
+                    lines.append(f'{metric}_count{{route="{route}"}} {n}')
+            metric = f"{self.prefix}_requests_total"
+            lines.append(f"# HELP {metric} Requests handled by this process")
+            lines.append(f"# TYPE {metric} counter")
+            for (route, status), count in sorted(self._requests.items()):
+                lines.append(f'{metric}{{route="{route}",status="{status}"}} {count}')
+            metric = f"{self.prefix}_slow_queries_total"
+            lines.append(f"# HELP {metric} Statements over the slow-query threshold")
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {self._slow_queries}")
+            metric = f"{self.prefix}_statement_cache_lookups_total"
+            lines.append(f"# HELP {metric} Statements executed, by whether they were already prepared")
+            lines.append(f"# TYPE {metric} counter")
+            for (route, result), count in sorted(self._statements.items()):
+                lines.append(f'{metric}{{route="{route}",result="{result}"}} {count}')
+        return "\n".join(lines) + "\n"
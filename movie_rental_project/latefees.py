@@ -0,0 +1,320 @@
+"""Late fees: overdue rentals, their fees and a per-customer balance.
+
+A rental is overdue once its due_date has passed while it is still OPEN,
+and its fee is the movie's late_fee for every calendar day late (the
+reference report, movierentalqueryies.sql #11). Working that out for every
+page view means joining all of rental to inventory_copy and movie. Here
+it is kept in three tables instead:
+
+    overdue_rental    OPEN rentals past due: days late and the fee so far
+    late_fee_charge   final fee of a rental returned late (one row each)
+    customer_balance  per customer: overdue rentals, fees still accruing,
+                      fees charged
+
+assess() is the engine, run by the ``overdue`` maintenance job (and
+``flask --app app assess-late-fees``). It walks the OPEN rentals past due
+in (due_date, rental_id) order on idx_rental_open_due_at, a partial index
+that only holds OPEN rentals however long the history grows, and upserts
+BATCH_SIZE of them per short write transaction: new ones are flagged,
+flagged ones get the day count and fee of today. due_date is stored as
+'YYYY-MM-DD HH:MM:SS' by older rows and with a 'T' by checkout, so it is
+compared as datetime(due_date), which that index is built on.
+
+Returns settle the rental as they happen: a trigger on rental turns its
+fee into a late_fee_charge at the return date and drops the overdue flag,
+and triggers on both tables keep customer_balance current, so a return
+costs a few primary-key writes and the overdue dashboard reads
+customer_balance and overdue_rental only. Rentals returned before these
+tables existed have no charges (their payments already include the fee).
+
+rebuild() recounts customer_balance from the two other tables. The
+``aggregates`` maintenance job runs refresh() instead, with
+stats.refresh(): the recount and the stored balances are compared in one
+read statement, and only the customers that differ are corrected, by the
+difference, in short write transactions.
+"""
+import json
+import time
+from datetime import datetime
+
+# rentals assessed per write transaction
+BATCH_SIZE = 1000
+
+
+def _days_late(at, due):
+    """SQL for the whole calendar days from ``due`` to ``at`` (DATEDIFF in
+    the reference queries): a rental due today is not charged yet."""
+    return f"CAST(julianday(date({at})) - julianday(date({due})) AS INTEGER)"
+
+
+TABLES = """
+ALTER TABLE overdue_rental ADD COLUMN daily_fee REAL NOT NULL DEFAULT 0;
+ALTER TABLE overdue_rental ADD COLUMN days_late INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE overdue_rental ADD COLUMN fee REAL NOT NULL DEFAULT 0;
+-- overdue dashboard: most overdue first
+CREATE INDEX IF NOT EXISTS idx_overdue_rental_due ON overdue_rental (due_date, rental_id);
+
+-- assess(): OPEN rentals by due date (partial, only OPEN rows)
+CREATE INDEX IF NOT EXISTS idx_rental_open_due ON rental (due_date) WHERE rental_status = 'OPEN';
+
+CREATE TABLE IF NOT EXISTS late_fee_charge (
+    rental_id   INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    days_late   INTEGER NOT NULL,
+    amount      REAL NOT NULL,
+    charged_at  TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS customer_balance (
+    customer_id     INTEGER PRIMARY KEY,
+    overdue_rentals INTEGER NOT NULL DEFAULT 0,
+    accruing        REAL NOT NULL DEFAULT 0,
+    charged         REAL NOT NULL DEFAULT 0
+);
+-- overdue dashboard: largest balances first
+CREATE INDEX IF NOT EXISTS idx_customer_balance_total ON customer_balance (accruing + charged);
+"""
+
+
+def _balance(customer_id, overdue, accruing, charged):
+    return (
+        "INSERT INTO customer_balance (customer_id, overdue_rentals, accruing, charged) "
+        f"VALUES ({customer_id}, {overdue}, {accruing}, {charged}) "
+        "ON CONFLICT (customer_id) DO UPDATE SET "
+        "overdue_rentals = overdue_rentals + excluded.overdue_rentals, "
+        "accruing = ROUND(accruing + excluded.accruing, 2), "
+        "charged = ROUND(charged + excluded.charged, 2);"
+    )
+
+
+_RETURNED = "COALESCE(NEW.return_date, datetime('now', 'localtime'))"
+
+TRIGGERS = {
+    "late_overdue_ai": ("AFTER INSERT ON overdue_rental", [
+        _balance("NEW.customer_id", "1", "NEW.fee", "0"),
+    ]),
+    "late_overdue_au": ("AFTER UPDATE OF fee ON overdue_rental", [
+        _balance("NEW.customer_id", "0", "NEW.fee - OLD.fee", "0"),
+    ]),
+    "late_overdue_ad": ("AFTER DELETE ON overdue_rental", [
+        _balance("OLD.customer_id", "-1", "-OLD.fee", "0"),
+    ]),
+    "late_charge_ai": ("AFTER INSERT ON late_fee_charge", [
+        _balance("NEW.customer_id", "0", "0", "NEW.amount"),
+    ]),
+    "late_charge_ad": ("AFTER DELETE ON late_fee_charge", [
+        _balance("OLD.customer_id", "0", "0", "-OLD.amount"),
+    ]),
+    # a return settles the rental: charge its fee as of the return date
+    "late_rental_returned": (
+        "AFTER UPDATE OF rental_status ON rental "
+        "WHEN OLD.rental_status = 'OPEN' AND NEW.rental_status <> 'OPEN'", [
+            "INSERT OR IGNORE INTO late_fee_charge (rental_id, customer_id, days_late, amount, charged_at) "
+            f"SELECT NEW.rental_id, NEW.customer_id, {_days_late(_RETURNED, 'NEW.due_date')}, "
+            f"ROUND({_days_late(_RETURNED, 'NEW.due_date')} * m.late_fee, 2), {_RETURNED} "
+            "FROM inventory_copy ic JOIN movie m ON m.movie_id = ic.movie_id "
+            f"WHERE ic.copy_id = NEW.copy_id AND {_days_late(_RETURNED, 'NEW.due_date')} > 0;",
+            "DELETE FROM overdue_rental WHERE rental_id = NEW.rental_id;",
+        ]),
+}
+
+# assess(): OPEN rentals by due date, whichever way it is written (partial,
+# only OPEN rows); replaces idx_rental_open_due, migration 14
+DUE_INDEX = """
+CREATE INDEX IF NOT EXISTS idx_rental_open_due_at ON rental (datetime(due_date)) WHERE rental_status = 'OPEN';
+DROP INDEX IF EXISTS idx_rental_open_due;
+"""
+
+# the next BATCH_SIZE overdue OPEN rentals after a (due, rental_id) key;
+# due is datetime(due_date): a plain string comparison would put
+# '2026-01-01 10:00:00' before '2026-01-01T08:00:00'
+NEXT_OVERDUE = """
+    SELECT datetime(due_date) AS due, rental_id FROM rental
+    WHERE rental_status = 'OPEN' AND datetime(due_date) < datetime(:now)
+      AND (datetime(due_date) > :due OR (datetime(due_date) = :due AND rental_id > :rental_id))
+    ORDER BY datetime(due_date), rental_id
+    LIMIT :limit
+"""
+
+_ASSESS_BATCH = f"""
+    INSERT INTO overdue_rental (rental_id, customer_id, due_date, flagged_at, daily_fee, days_late, fee)
+    SELECT r.rental_id, r.customer_id, r.due_date, :now, m.late_fee,
+           {_days_late(':now', 'r.due_date')}, ROUND({_days_late(':now', 'r.due_date')} * m.late_fee, 2)
+    FROM rental r
+    JOIN inventory_copy ic ON ic.copy_id = r.copy_id
+    JOIN movie m ON m.movie_id = ic.movie_id
+    WHERE r.rental_id IN (SELECT value FROM json_each(:ids)) AND r.rental_status = 'OPEN'
+    ON CONFLICT (rental_id) DO UPDATE SET
+        due_date = excluded.due_date, daily_fee = excluded.daily_fee,
+        days_late = excluded.days_late, fee = excluded.fee
+    WHERE days_late <> excluded.days_late OR fee <> excluded.fee OR due_date <> excluded.due_date
+"""
+
+# dashboard totals: one pass over customer_balance, which only has the
+# customers that ever owed a late fee
+TOTALS = """
+    SELECT COALESCE(SUM(overdue_rentals), 0) AS overdue_rentals,
+           ROUND(COALESCE(SUM(accruing), 0), 2) AS accruing,
+           ROUND(COALESCE(SUM(charged), 0), 2) AS charged,
+           COUNT(*) FILTER (WHERE accruing + charged > 0) AS customers
+    FROM customer_balance
+"""
+
+# customer_balance recounted from overdue_rental and late_fee_charge
+BALANCES = """
+    SELECT customer_id, SUM(overdue) AS overdue_rentals,
+           ROUND(SUM(accruing), 2) AS accruing, ROUND(SUM(charged), 2) AS charged
+    FROM (SELECT customer_id, 1 AS overdue, fee AS accruing, 0 AS charged FROM overdue_rental
+          UNION ALL
+          SELECT customer_id, 0, 0, amount FROM late_fee_charge)
+    GROUP BY customer_id
+"""
+# the stored balances that count (all-zero rows are the same as none)
+_STORED = ("SELECT customer_id, overdue_rentals, accruing, charged FROM customer_balance "
+           "WHERE overdue_rentals <> 0 OR accruing <> 0 OR charged <> 0")
+
+# customers whose balance differs from the recount, with both sides
+_DRIFT = f"""
+    WITH recount AS MATERIALIZED ({BALANCES}),
+         stored AS MATERIALIZED ({_STORED}),
+         changed (customer_id) AS (SELECT customer_id FROM (SELECT * FROM recount EXCEPT SELECT * FROM stored)
+                                   UNION
+                                   SELECT customer_id FROM (SELECT * FROM stored EXCEPT SELECT * FROM recount))
+    SELECT c.customer_id,
+           COALESCE(r.overdue_rentals, 0), COALESCE(r.accruing, 0), COALESCE(r.charged, 0),
+           COALESCE(s.overdue_rentals, 0), COALESCE(s.accruing, 0), COALESCE(s.charged, 0)
+    FROM changed c
+    LEFT JOIN recount r ON r.customer_id = c.customer_id
+    LEFT JOIN stored s ON s.customer_id = c.customer_id
+"""
+
+# flags whose rental is gone, or no longer overdue (returns clear their own)
+_CLEAR_STALE = """
+    DELETE FROM overdue_rental
+    WHERE rental_id NOT IN (SELECT rental_id FROM rental
+                            WHERE rental_status = 'OPEN' AND datetime(due_date) < datetime(:now))
+"""
+
+
+def create_tables(conn):
+    """Late fee tables, indexes and triggers; migration 11."""
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    create_triggers(conn)
+
+
+def create_due_index(conn):
+    """Index OPEN rentals on datetime(due_date) and re-assess; migration 14.
+
+    Rentals due later today that the string comparison had flagged are
+    cleared, and the balances recounted.
+    """
+    for statement in DUE_INDEX.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    backfill(conn)
+
+
+def create_triggers(conn, names=None):
+    """(Re)create the triggers, or only those in ``names``."""
+    for name, (event, body) in TRIGGERS.items():
+        if names is None or name in names:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n" + "\n".join(body) + "\nEND")
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def _assess_batch(conn, now, key, batch_size):
+    """Flag / re-price the next batch after ``key``; returns (rows changed, last key or None)."""
+    rows = conn.execute(NEXT_OVERDUE, {"now": now, "due": key[0], "rental_id": key[1],
+                                      "limit": batch_size}).fetchall()
+    if not rows:
+        return 0, None
+    ids = json.dumps([rental_id for _, rental_id in rows])
+    changed = conn.execute(_ASSESS_BATCH, {"now": now, "ids": ids}).rowcount
+    return changed, tuple(rows[-1])
+
+
+def assess(conn, transaction, now=None, batch_size=BATCH_SIZE, pause=0.0):
+    """Flag overdue OPEN rentals and bring their fees up to ``now``.
+
+    ``transaction(conn, immediate=True)`` takes the write lock
+    (app.write_transaction) for each batch; ``pause`` seconds between
+    batches let checkouts through. Returns a report dict; "changed" is
+    True if any fee or flag changed.
+    """
+    now = now or _now()
+    report = {"assessed": 0, "changed": 0, "cleared": 0, "batches": 0}
+    started = time.perf_counter()
+    key = ("", 0)
+    while key is not None:
+        with transaction(conn, immediate=True):
+            changed, last = _assess_batch(conn, now, key, batch_size)
+            conn.commit()
+        if last is None:
+            break
+        report["batches"] += 1
+        report["changed"] += changed
+        key = last
+        if pause:
+            time.sleep(pause)
+    with transaction(conn, immediate=True):
+        report["cleared"] = conn.execute(_CLEAR_STALE, {"now": now}).rowcount
+        report["assessed"], report["accruing"] = conn.execute(
+            "SELECT COUNT(*), ROUND(COALESCE(SUM(fee), 0), 2) FROM overdue_rental").fetchone()
+        conn.commit()
+    report["elapsed"] = time.perf_counter() - started
+    report["changed"] = bool(report["changed"] or report["cleared"])
+    return report
+
+
+def backfill(conn, now=None):
+    """assess() inside the caller's transaction, then rebuild(); for the migration."""
+    now = now or _now()
+    key = ("", 0)
+    while key is not None:
+        key = _assess_batch(conn, now, key, BATCH_SIZE)[1]
+    conn.execute(_CLEAR_STALE, {"now": now})
+    rebuild(conn)
+
+
+def rebuild(conn):
+    """Recompute customer_balance from overdue_rental and late_fee_charge.
+
+    Returns the number of customers whose balance had drifted.
+    """
+    drift = len(conn.execute(_DRIFT).fetchall())
+    conn.execute("DELETE FROM customer_balance")
+    conn.execute(f"INSERT INTO customer_balance (customer_id, overdue_rentals, accruing, charged) {BALANCES}")
+    return drift
+
+
+def refresh(conn, transaction, batch_size=BATCH_SIZE, pause=0.0):
+    """rebuild() for a live store: recount without the write lock, correct the drift.
+
+    Each customer that differs gets the difference added (_balance), so
+    fees the triggers recorded since the recount are kept; ``batch_size``
+    customers per write transaction, ``pause`` seconds apart. Returns
+    the number of customers corrected.
+    """
+    rows = conn.execute(_DRIFT).fetchall()
+    for start in range(0, len(rows), batch_size):
+        with transaction(conn, immediate=True):
+            for customer_id, overdue, accruing, charged, old_overdue, old_accruing, old_charged in \
+                    rows[start:start + batch_size]:
+                conn.execute(_balance("?", "?", "?", "?"),
+                             (customer_id, overdue - old_overdue, round(accruing - old_accruing, 2),
+                              round(charged - old_charged, 2)))
+            conn.commit()
+        if pause:
+            time.sleep(pause)
+    return len(rows)
+
+
+def totals(conn):
+    """Dashboard totals over customer_balance."""
+    return conn.execute(TOTALS).fetchone()
@@ -0,0 +1,137 @@
+"""Concurrent rent/return load test.
+
+Runs the same mixed workload twice against a fresh copy of the sample
+database: once with the old storage settings (rollback journal,
+synchronous=FULL, no writer queue) and once with the current ones (WAL,
+synchronous=NORMAL, mmap/cache/temp_store, serialized writers).
+
+    python loadtest.py --threads 8 --seconds 10
+
+Each clerk thread loops: rent a random movie, browse the open-rentals list,
+return a random open rental. Reported numbers are completed rent+return
+operations per second and how many requests failed (e.g. "database is
+locked").
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+import app as movie_app
+
+LEGACY = {
+    "DB_JOURNAL_MODE": "DELETE",
+    "DB_SYNCHRONOUS": "FULL",
+    "DB_MMAP_SIZE": 0,
+    "DB_CACHE_SIZE": -2000,
+    "DB_SERIALIZE_WRITES": False,
+}
+
+TUNED = {
+    "DB_JOURNAL_MODE": "WAL",
+    "DB_SYNCHRONOUS": "NORMAL",
+    "DB_MMAP_SIZE": 256 * 1024 * 1024,
+    "DB_CACHE_SIZE": -64000,
+    "DB_SERIALIZE_WRITES": True,
+}
+
+
+def clerk(client, db_path, movie_ids, customer_ids, deadline, counts, lock):
+    rng = random.Random(threading.get_ident())
+    ok = failed = reads = 0
+    side = sqlite3.connect(db_path, timeout=10)
+    while time.perf_counter() < deadline:
+        resp = client.post("/rent", data={
+            "customer_id": str(rng.choice(customer_ids)),
+            "movie_id": str(rng.choice(movie_ids)),
+        })
+        if resp.status_code == 302:
+            ok += 1
+        else:
+            failed += 1
+
+        resp = client.get("/return")
+        if resp.status_code == 200:
+            reads += 1
+        else:
+            failed += 1
+
+        try:
+            row = side.execute(
+                "SELECT rental_id FROM rental WHERE rental_status = 'OPEN' ORDER BY RANDOM() LIMIT 1"
+            ).fetchone()
+        except sqlite3.OperationalError:
+            row = None
+        if row:
+            resp = client.post("/return", data={"rental_id": str(row[0])})
+            if resp.status_code == 302:
+                ok += 1
+            else:
+                failed += 1
+    side.close()
+    with lock:
+        counts["writes"] += ok
+        counts["reads"] += reads
+        counts["failed"] += failed
+
+
+def run(label, settings, threads, seconds, workdir):
+    db_path = os.path.join(workdir, f"{label}.db")
+    flask_app = movie_app.app
+    flask_app.config.update(settings)
+    flask_app.config.update(DATABASE=db_path, DB_POOL_SIZE=threads, PROPAGATE_EXCEPTIONS=False)
+    with flask_app.app_context():
+        movie_app.init_db()
+        movie_app.seed_db()
+        conn = movie_app.get_connection()
+        # plenty of copies so the test measures the database, not stock-outs
+        conn.execute(
+            "INSERT INTO inventory_copy (movie_id, status, store_location) "
+            "SELECT movie_id, 'AVAILABLE', 'Load Test' FROM movie, (SELECT 1 UNION ALL SELECT 2 UNION ALL SELECT 3 "
+            "UNION ALL SELECT 4 UNION ALL SELECT 5 UNION ALL SELECT 6 UNION ALL SELECT 7 UNION ALL SELECT 8)"
+        )
+        conn.commit()
+        movie_ids = [r[0] for r in conn.execute("SELECT movie_id FROM movie")]
+        customer_ids = [r[0] for r in conn.execute("SELECT customer_id FROM customer")]
+
+    counts = {"writes": 0, "reads": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    workers = [
+        threading.Thread(
+            target=clerk,
+            args=(flask_app.test_client(), db_path, movie_ids, customer_ids, deadline, counts, lock),
+        )
+        for _ in range(threads)
+    ]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{label:>7}: {counts['writes'] / elapsed:8.1f} rent+return/s  "
+        f"{counts['reads'] / elapsed:8.1f} list reads/s  "
+        f"{counts['failed']} failed requests  ({threads} clerks, {elapsed:.1f}s)"
+    )
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run("before", LEGACY, args.threads, args.seconds, workdir)
+        run("after", TUNED, args.threads, args.seconds, workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,427 @@
+"""Background maintenance: periodic jobs kept off the request path.
+
+Request handlers only do the work of their request. What keeps the store
+healthy runs here instead, on a small thread pool inside each app process:
+
+    optimize         planner statistics: ANALYZE the first time, then PRAGMA optimize
+    checkpoint       PRAGMA wal_checkpoint(PASSIVE) on the main and archive files
+    aggregates       stats.refresh() and latefees.refresh(): recount the summaries, fix drift
+    overdue          flag overdue OPEN rentals, accrue late fees (latefees.assess)
+    recommendations  recommend.refresh() once deferred_pairs has grown
+    changes          purge and compact the change_log feed (changelog.py)
+    backup           online snapshot of the store and its archive, with rotation (backup.py)
+
+Each job has an interval (``MAINTENANCE_INTERVALS``), and its next run is
+due that long, +/- the jitter, after the last one, so workers started
+together do not all hit the database at the same moment. Every worker
+process runs a Scheduler, but the schedule lives in the database:
+maintenance_job holds each job's next due time and a lease, and a worker
+runs a job only after claiming the lease with a conditional UPDATE (the
+way rentals.checkout claims a copy). A job therefore runs once per
+interval across all processes and never twice at once, and a worker that
+dies mid-job holds it only until the lease runs out.
+
+Every run (duration, outcome, detail) is appended to maintenance_run,
+which keeps the last HISTORY runs of each job. /admin/maintenance shows
+both tables, and ``POST /admin/maintenance/<job>`` or
+``flask --app app run-maintenance <job>`` runs a job now.
+"""
+import json
+import logging
+import os
+import random
+import socket
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import archive
+import backup
+import changelog
+import latefees
+import recommend
+import stats
+
+log = logging.getLogger("movie_rental.maintenance")
+
+# seconds between runs; None runs a job only when triggered
+INTERVALS = {
+    "optimize": 6 * 3600,
+    "checkpoint": 300,
+    "aggregates": 24 * 3600,
+    "overdue": 900,
+    "recommendations": 3600,
+    "changes": 24 * 3600,
+    "backup": 24 * 3600,
+}
+JITTER = 0.1          # +/- this fraction of the interval
+WORKERS = 2           # thread pool size, per process
+TICK = 5.0            # seconds between looks at the schedule
+RECHECK = 60.0        # seconds before asking again about a job leased elsewhere
+LEASE = 3600          # seconds a claimed job stays claimed if its worker dies
+HISTORY = 50          # maintenance_run rows kept per job
+
+# optimize: rows per index ANALYZE samples (PRAGMA analysis_limit)
+ANALYSIS_LIMIT = 1000
+
+# recommendations: rebuild once this many pairs wait (see recommend.fold)
+DEFERRED_PAIRS_REBUILD = 1000
+
+# changes: seconds between purge / compact batches, so checkouts get in
+CHANGES_PAUSE = 0.05
+
+# aggregates: seconds between its batches of corrections
+AGGREGATES_PAUSE = 0.05
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS maintenance_job (
+    job          TEXT PRIMARY KEY,
+    next_due     TEXT,
+    lease_owner  TEXT,             -- host:pid running it, until lease_until
+    lease_until  TEXT,
+    last_started TEXT,
+    last_outcome TEXT              -- ok, skipped, error
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS maintenance_run (
+    run_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+    job         TEXT NOT NULL,
+    started_at  TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    outcome     TEXT NOT NULL,
+    detail      TEXT,              -- JSON
+    owner       TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_maintenance_run_job ON maintenance_run (job, run_id);
+
+-- OPEN rentals past their due_date, as of the last overdue run
+-- (fee columns added by latefees.py)
+CREATE TABLE IF NOT EXISTS overdue_rental (
+    rental_id   INTEGER PRIMARY KEY,
+    customer_id INTEGER NOT NULL,
+    due_date    TEXT NOT NULL,
+    flagged_at  TEXT NOT NULL
+);
+"""
+
+
+def create_tables(conn):
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+
+
+def _now():
+    return datetime.now().isoformat(timespec="seconds")
+
+
+# ============== Jobs ==============
+# Each takes (conn, transaction) and returns a detail dict for
+# maintenance_run. "skipped" in it means there was nothing to do, and
+# "changed" that pages may show something new (the data version is bumped).
+
+def optimize(conn, transaction):
+    """Planner statistics: a full ANALYZE the first time, then PRAGMA optimize."""
+    analyzed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+    with transaction(conn, immediate=True):
+        conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+        # 0x10002: ANALYZE every table whose row count moved a lot since
+        # its last ANALYZE, not only tables this connection has queried
+        conn.execute("PRAGMA optimize = 0x10002" if analyzed else "ANALYZE")
+        conn.commit()
+    return {"ran": "optimize" if analyzed else "analyze"}
+
+
+def checkpoint(conn, transaction):
+    """Copy committed WAL frames into the database files; PASSIVE never waits on readers."""
+    detail = {}
+    for schema in ("main", archive.SCHEMA):
+        busy, frames, done = conn.execute(f"PRAGMA {schema}.wal_checkpoint(PASSIVE)").fetchone()
+        detail[schema] = {"wal_frames": frames, "checkpointed": done, "busy": bool(busy)}
+    return detail
+
+
+def aggregates(conn, transaction):
+    """Recount the report summary tables and the late fee balances; correct only what drifted."""
+    drift, rows = stats.refresh(conn, transaction, pause=AGGREGATES_PAUSE)
+    balances = latefees.refresh(conn, transaction, pause=AGGREGATES_PAUSE)
+    return {"corrected": sorted(drift), "rows_corrected": rows, "balances_corrected": balances,
+            "changed": bool(drift or rows or balances)}
+
+
+def overdue(conn, transaction):
+    """Flag overdue OPEN rentals and bring their late fees up to date (latefees.assess)."""
+    report = latefees.assess(conn, transaction)
+    report["elapsed"] = round(report["elapsed"], 3)
+    return report
+
+
+def recommendations(conn, transaction):
+    """recommend.refresh() once DEFERRED_PAIRS_REBUILD pairs wait for a rebuild."""
+    if recommend.np is None:
+        return {"skipped": "needs NumPy"}
+    deferred = recommend.deferred_pairs(conn)
+    if deferred < DEFERRED_PAIRS_REBUILD:
+        return {"skipped": f"{deferred} deferred pairs"}
+    timings = recommend.refresh(conn, transaction)
+    return {"deferred_pairs": deferred, "rows": timings["rows"], "folded": timings["folded"],
+            "load": round(timings["load"], 3), "count": round(timings["count"], 3),
+            "store": round(timings["store"], 3), "changed": True}
+
+
+def changes(conn, transaction):
+    """Purge change_log entries past retention, then drop superseded ones."""
+    purged = changelog.purge(conn, transaction, pause=CHANGES_PAUSE)
+    compacted = changelog.compact(conn, transaction, pause=CHANGES_PAUSE)
+    return {"purged": purged, "compacted": compacted, **changelog.status(conn)}
+
+
+def snapshot(conn, transaction):
+    """Online backup of the store and its archive into backup.default_dir(); keeps backup.KEEP."""
+    manifest = backup.snapshot(conn)
+    return {"path": manifest["path"], "seconds": manifest["seconds"],
+            "bytes": sum(entry["bytes"] for entry in manifest["files"].values()),
+            "restarts": sum(entry["restarts"] for entry in manifest["files"].values()),
+            "removed": len(manifest["removed"])}
+
+
+JOBS = {
+    "optimize": optimize,
+    "checkpoint": checkpoint,
+    "aggregates": aggregates,
+    "overdue": overdue,
+    "recommendations": recommendations,
+    "changes": changes,
+    "backup": snapshot,
+}
+
+
+# ============== Schedule ==============
+
+_CLAIM = """
+    UPDATE maintenance_job
+    SET lease_owner = ?, lease_until = ?, last_started = ?
+    WHERE job = ?
+      AND (lease_until IS NULL OR lease_until < ?)
+      AND (? OR next_due <= ?)
+"""
+
+_RELEASE = """
+    UPDATE maintenance_job
+    SET lease_owner = NULL, lease_until = NULL, last_outcome = ?, next_due = ?
+    WHERE job = ?
+"""
+
+_RECORD_RUN = """
+    INSERT INTO maintenance_run (job, started_at, duration_ms, outcome, detail, owner)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+# keep the newest HISTORY runs of the job
+_TRIM_RUNS = """
+    DELETE FROM maintenance_run
+    WHERE job = ? AND run_id <= (SELECT run_id FROM maintenance_run WHERE job = ?
+                                 ORDER BY run_id DESC LIMIT 1 OFFSET ?)
+"""
+
+
+class Scheduler:
+    """Runs JOBS at their intervals on a thread pool (see the module docstring).
+
+    ``acquire()`` / ``release(conn)`` check a connection out of the app's
+    pool and back, ``transaction`` is app.write_transaction, and
+    ``on_change()`` runs after a job changed what pages show
+    (app.bump_data_version).
+    """
+
+    def __init__(self, acquire, release, transaction, intervals=None, jitter=JITTER, workers=WORKERS,
+                 tick=TICK, lease=LEASE, on_change=None):
+        self.acquire = acquire
+        self.release = release
+        self.transaction = transaction
+        self.intervals = dict(INTERVALS if intervals is None else intervals)
+        self.jitter = jitter
+        self.workers = workers
+        self.tick = tick
+        self.lease = lease
+        self.on_change = on_change
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._executor = None
+        self._running = set()       # jobs running in this process
+        self._next_check = {}       # job -> time.monotonic() of the next claim attempt
+
+        # metrics, this process
+        self._runs = Counter()      # (job, outcome) -> count
+        self._last = {}             # job -> (seconds, outcome)
+
+    def start(self):
+        """Start the schedule loop (once); returns False if it was running."""
+        if self._thread is not None:
+            return False
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._loop, name="maintenance-scheduler", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        self._stop.set()
+        with self._lock:
+            thread, self._thread = self._thread, None
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+        if thread is not None:
+            thread.join(timeout=self.tick + 1)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            for job, interval in self.intervals.items():
+                if interval is not None and now >= self._next_check.get(job, 0.0):
+                    self.submit(job)
+            self._stop.wait(self.tick)
+
+    def submit(self, job, force=False):
+        """Queue a run of ``job`` on the pool; False if it is already running here.
+
+        ``force`` runs it even if it is not due yet (the admin trigger); a
+        lease held by another process still wins.
+        """
+        if job not in JOBS:
+            raise ValueError(f"unknown maintenance job {job!r}")
+        with self._lock:
+            if job in self._running:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                    thread_name_prefix="maintenance")
+            self._running.add(job)
+            self._executor.submit(self._run, job, force)
+        return True
+
+    def _run(self, job, force):
+        try:
+            conn = self.acquire()
+            try:
+                self.run(conn, job, force)
+            finally:
+                self.release(conn)
+        except Exception:
+            # could not claim or record (e.g. the database stayed locked):
+            # the job is still due, try again after a while
+            log.exception("maintenance job %s could not run", job)
+            self._next_check[job] = time.monotonic() + RECHECK
+        finally:
+            with self._lock:
+                self._running.discard(job)
+
+    def run(self, conn, job, force=False):
+        """Claim ``job`` and run it on ``conn`` in this thread.
+
+        Returns (outcome, seconds, detail), or None if the job is not due
+        or another process holds it.
+        """
+        if not self._claim(conn, job, force):
+            self._next_check[job] = time.monotonic() + self._wait(conn, job)
+            return None
+        started_at = _now()
+        started = time.perf_counter()
+        try:
+            detail = JOBS[job](conn, self.transaction) or {}
+            outcome = "skipped" if "skipped" in detail else "ok"
+        except Exception as exc:
+            if conn.in_transaction:
+                conn.rollback()
+            log.exception("maintenance job %s failed", job)
+            detail, outcome = {"error": f"{type(exc).__name__}: {exc}"}, "error"
+        seconds = time.perf_counter() - started
+        changed = detail.pop("changed", False)
+        self._finish(conn, job, started_at, seconds, outcome, detail)
+        if changed and self.on_change is not None:
+            self.on_change()
+        return outcome, seconds, detail
+
+    def _claim(self, conn, job, force):
+        now = datetime.now()
+        interval = self.intervals.get(job)
+        # a new job's first run comes within the jitter fraction of its interval
+        first_due = now + timedelta(seconds=(interval or 0) * random.uniform(0, self.jitter))
+        with self.transaction(conn, immediate=True):
+            conn.execute("INSERT OR IGNORE INTO maintenance_job (job, next_due) VALUES (?, ?)",
+                         (job, first_due.isoformat(timespec="seconds")))
+            stamp = now.isoformat(timespec="seconds")
+            lease_until = (now + timedelta(seconds=self.lease)).isoformat(timespec="seconds")
+            claimed = conn.execute(_CLAIM, (self.owner, lease_until, stamp, job, stamp, force, stamp)).rowcount
+            conn.commit()
+        return claimed == 1
+
+    def _wait(self, conn, job):
+        """Seconds until ``job`` is worth claiming again."""
+        row = conn.execute("SELECT next_due, lease_until FROM maintenance_job WHERE job = ?", (job,)).fetchone()
+        now = datetime.now()
+        if row is None or row[0] is None or (row[1] is not None and datetime.fromisoformat(row[1]) > now):
+            return RECHECK
+        return max((datetime.fromisoformat(row[0]) - now).total_seconds(), self.tick)
+
+    def _finish(self, conn, job, started_at, seconds, outcome, detail):
+        interval = self.intervals.get(job)
+        delay = None if interval is None else interval * (1 + random.uniform(-self.jitter, self.jitter))
+        next_due = None if delay is None else (datetime.now() + timedelta(seconds=delay)).isoformat(timespec="seconds")
+        with self.transaction(conn, immediate=True):
+            conn.execute(_RELEASE, (outcome, next_due, job))
+            conn.execute(_RECORD_RUN, (job, started_at, round(seconds * 1000, 3), outcome,
+                                       json.dumps(detail, default=str), self.owner))
+            conn.execute(_TRIM_RUNS, (job, job, HISTORY))
+            conn.commit()
+        self._next_check[job] = time.monotonic() + (delay if delay is not None else RECHECK)
+        with self._lock:
+            self._runs[(job, outcome)] += 1
+            self._last[job] = (seconds, outcome)
+        log.info("maintenance job %s: %s in %.1f ms %s", job, outcome, seconds * 1000, detail)
+
+    def stats(self):
+        """This process's view: running jobs, intervals, run counts."""
+        with self._lock:
+            return {
+                "owner": self.owner,
+                "started": self._thread is not None,
+                "running": sorted(self._running),
+                "intervals": self.intervals,
+                "runs": {f"{job}:{outcome}": count for (job, outcome), count in sorted(self._runs.items())},
+            }
+
+    def prometheus(self, prefix="movie_rental"):
+        """Run counts and last durations in the Prometheus text format."""
+        lines = []
+        with self._lock:
+            metric = f"{prefix}_maintenance_runs_total"
+            lines.append(f"# HELP {metric} Maintenance job runs in this process")
+            lines.append(f"# TYPE {metric} counter")
+            for (job, outcome), count in sorted(self._runs.items()):
+                lines.append(f'{metric}{{job="{job}",outcome="{outcome}"}} {count}')
+            metric = f"{prefix}_maintenance_last_duration_seconds"
+            lines.append(f"# HELP {metric} Duration of the last run of each maintenance job")
+            lines.append(f"# TYPE {metric} gauge")
+            for job, (seconds, _) in sorted(self._last.items()):
+                lines.append(f'{metric}{{job="{job}"}} {seconds:.6f}')
+        return "\n".join(lines) + "\n"
+
+
+def status(conn, runs=20):
+    """The shared schedule (maintenance_job) and the latest ``runs`` runs."""
+    return {
+        "jobs": [dict(row) for row in conn.execute("SELECT * FROM maintenance_job ORDER BY job")],
+        "recent_runs": [
+            {**dict(row), "detail": json.loads(row["detail"]) if row["detail"] else None}
+            for row in conn.execute("SELECT * FROM maintenance_run ORDER BY run_id DESC LIMIT ?", (runs,))
+        ],
+    }
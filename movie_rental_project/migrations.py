@@ -0,0 +1,225 @@
+"""Versioned schema migrations.
+
+init_db() creates the original tables with CREATE TABLE IF NOT EXISTS, which
+cannot change a table or add an index to a movierental.db that already
+exists. Everything after the original schema goes here instead: each
+migration has a version number, and the schema_version table records which
+ones a database file already has, so migrate() only runs the missing ones.
+
+A migration is either a SQL script or a function taking the connection.
+Each one runs in its own transaction together with its schema_version row,
+so a failed migration leaves the database at the previous version.
+
+Never edit a migration that has shipped; add a new one.
+"""
+import sqlite3
+from datetime import datetime
+
+import archive
+import availability
+import changelog
+import importer
+import latefees
+import maintenance
+import recommend
+import rollups
+import search
+import stats
+
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function (used as a decorator)."""
+    def register(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return register
+
+
+def sql_migration(version, description, script):
+    """Register a migration that is a plain SQL script."""
+    def run(conn):
+        for statement in split_statements(script):
+            conn.execute(statement)
+    MIGRATIONS.append((version, description, run))
+
+
+def split_statements(script):
+    """Split a SQL script into single statements (for conn.execute)."""
+    statements = []
+    buf = ""
+    for line in script.splitlines(keepends=True):
+        buf += line
+        if sqlite3.complete_statement(buf):
+            if buf.strip():
+                statements.append(buf.strip())
+            buf = ""
+    if buf.strip():
+        statements.append(buf.strip())
+    return statements
+
+
+def ensure_version_table(conn):
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at  TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+
+
+def current_version(conn):
+    ensure_version_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def pending(conn):
+    applied = {row[0] for row in conn.execute("SELECT version FROM schema_version")}
+    return [m for m in sorted(MIGRATIONS, key=lambda m: m[0]) if m[0] not in applied]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations (up to ``target``) and return their versions."""
+    ensure_version_table(conn)
+    done = []
+    for version, description, fn in pending(conn):
+        if target is not None and version > target:
+            break
+        if conn.in_transaction:
+            conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            fn(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, datetime.now().isoformat(timespec="seconds")),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        done.append(version)
+    return done
+
+
+# ============== Migrations ==============
+
+sql_migration(1, "indexes for rent/return/popular predicates", """
+    -- rent_movie: first AVAILABLE copy of a movie (partial, only shelf stock)
+    CREATE INDEX IF NOT EXISTS idx_inventory_copy_available
+        ON inventory_copy (movie_id) WHERE status = 'AVAILABLE';
+
+    -- movie_detail / availability counts per movie: covering (movie_id, status)
+    CREATE INDEX IF NOT EXISTS idx_inventory_copy_movie_status
+        ON inventory_copy (movie_id, status);
+
+    -- return_movie: open rentals, newest first (partial, only OPEN rows)
+    CREATE INDEX IF NOT EXISTS idx_rental_open_date
+        ON rental (rental_date) WHERE rental_status = 'OPEN';
+
+    -- popular_movies join rental -> inventory_copy, per-customer counts
+    CREATE INDEX IF NOT EXISTS idx_rental_copy ON rental (copy_id);
+    CREATE INDEX IF NOT EXISTS idx_rental_customer ON rental (customer_id);
+
+    -- category filter on /movies and /rent
+    CREATE INDEX IF NOT EXISTS idx_movie_category_category
+        ON movie_category (category_id, movie_id);
+    CREATE INDEX IF NOT EXISTS idx_movie_actor_actor
+        ON movie_actor (actor_id, movie_id);
+
+    CREATE INDEX IF NOT EXISTS idx_payment_rental ON payment (rental_id);
+""")
+
+sql_migration(2, "indexes for listing sort orders", """
+    CREATE INDEX IF NOT EXISTS idx_customer_name
+        ON customer (last_name, first_name, customer_id);
+    CREATE INDEX IF NOT EXISTS idx_movie_title ON movie (title, movie_id);
+    CREATE INDEX IF NOT EXISTS idx_movie_release_year ON movie (release_year);
+    CREATE INDEX IF NOT EXISTS idx_movie_rating ON movie (movie_rating);
+    CREATE INDEX IF NOT EXISTS idx_actor_name ON actor (actor_name);
+    CREATE INDEX IF NOT EXISTS idx_rental_returned
+        ON rental (return_date, rental_date) WHERE return_date IS NOT NULL;
+    ANALYZE;
+""")
+
+
+@migration(3, "FTS5 movie search index with sync triggers")
+def _movie_search(conn):
+    search.create_search_index(conn)
+
+sql_migration(4, "keyset pagination sort keys", """
+    -- /movies sorts NULL years/ratings as 0 so row-value cursors work
+    CREATE INDEX IF NOT EXISTS idx_movie_year_key
+        ON movie (COALESCE(release_year, 0), movie_id);
+    CREATE INDEX IF NOT EXISTS idx_movie_rating_key
+        ON movie (COALESCE(movie_rating, 0), movie_id);
+    -- /return open rentals page: (rental_date, rental_id) cursor
+    DROP INDEX IF EXISTS idx_rental_open_date;
+    CREATE INDEX idx_rental_open_date
+        ON rental (rental_date, rental_id) WHERE rental_status = 'OPEN';
+    ANALYZE;
+""")
+
+
+@migration(5, "materialized report statistics with triggers")
+def _report_stats(conn):
+    stats.create_stats_tables(conn)
+    conn.execute("ANALYZE movie_stats")
+    conn.execute("ANALYZE customer_stats")
+
+
+@migration(6, "import_job table for resumable bulk catalog imports")
+def _import_jobs(conn):
+    importer.create_import_tables(conn)
+
+
+@migration(7, "movie.total_copies / available_copies kept by triggers")
+def _copy_counters(conn):
+    availability.create_counters(conn)
+
+
+@migration(8, "movie_similar co-occurrence recommendations")
+def _recommendations(conn):
+    recommend.create_tables(conn)
+    if recommend.np is not None:
+        recommend.rebuild(conn)
+    # without NumPy the rent routes fold the existing history in, FOLD_BATCH at a time
+
+
+@migration(9, "archive_batch guard on the stats delete triggers for rental archiving")
+def _archive(conn):
+    archive.create_tables(conn)
+    stats.create_triggers(conn, ("stats_rental_ad", "stats_payment_ad"))
+
+
+@migration(10, "maintenance scheduler state and overdue rental flags")
+def _maintenance(conn):
+    maintenance.create_tables(conn)
+
+
+@migration(11, "late fee engine: overdue fees, late_fee_charge, customer_balance")
+def _late_fees(conn):
+    latefees.create_tables(conn)
+    latefees.backfill(conn)
+
+
+@migration(12, "hourly and daily rental/revenue rollups with triggers")
+def _rollups(conn):
+    rollups.create_tables(conn)
+
+
+@migration(13, "change_log feed of inserted, updated and deleted rows")
+def _change_log(conn):
+    changelog.create_tables(conn)
+
+
+@migration(14, "late fees compare due_date as datetime(); index on it")
+def _due_index(conn):
+    latefees.create_due_index(conn)
@@ -0,0 +1,125 @@
+"""Keyset (cursor) pagination helpers.
+
+OFFSET pagination makes SQLite walk past every skipped row, so page 2000 is
+2000 times slower than page 1. Keyset pagination instead remembers the sort
+key of the last row shown and asks for rows after it:
+
+    WHERE m.title >= ? AND (m.title > ? OR m.movie_id > ?)
+    ORDER BY m.title, m.movie_id LIMIT 51
+
+With an index on the sort columns that is one index seek, however deep the
+page is. The last sort column must be unique (a primary key) so that rows
+with equal sort values still have a stable order and none are skipped.
+
+Cursors are the opaque ``after`` / ``before`` query-string values.
+"""
+import base64
+import json
+from collections import namedtuple
+
+PAGE_SIZE = 50
+
+Page = namedtuple("Page", "rows next_cursor prev_cursor")
+
+
+def encode_cursor(values):
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+# what a sort key can hold; anything else in a cursor was not made by encode_cursor
+_KEY_TYPES = (str, int, float, type(None))
+
+
+def decode_cursor(token, length=None):
+    """Return the key values stored in a cursor, or None if it is invalid.
+
+    Cursors come back from the query string, so they are checked before
+    their values are bound: a list of ``length`` (if given) plain scalars.
+    """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(values, list) or (length is not None and len(values) != length):
+        return None
+    if not all(isinstance(value, _KEY_TYPES) for value in values):
+        return None
+    return values
+
+
+class Keyset:
+    """A sort order that can be paged through by key.
+
+    ``columns`` is a list of (sql_expression, row_key) pairs; row_key is the
+    name the expression is selected as, so the cursor can be read back off
+    the last row of a page. All columns sort in the same direction.
+    """
+
+    def __init__(self, columns, descending=False):
+        self.columns = columns
+        self.descending = descending
+
+    def condition(self, values, backwards=False):
+        """WHERE fragment + params selecting rows after (or before) a key.
+
+        Written as ``a >= ? AND (a > ? OR (b, c) > (?, ?))`` rather than one
+        row-value comparison: SQLite only turns a row value into an index
+        seek for plain columns, while the separate bound on the leading
+        column also seeks on expression indexes (COALESCE(...) sort keys).
+        """
+        if len(self.columns) == 1:
+            return self.clause(backwards), [values[0]]
+        return self.clause(backwards), [values[0], values[0], *values[1:]]
+
+    def clause(self, backwards=False):
+        """The WHERE fragment of condition(), without its parameters.
+
+        It only depends on the columns and on ``descending != backwards``,
+        so a query built from it has one text per sort direction.
+        """
+        op = "<" if self.descending != backwards else ">"
+        first = self.columns[0][0]
+        if len(self.columns) == 1:
+            return f"{first} {op} ?"
+        rest = ", ".join(expr for expr, _ in self.columns[1:])
+        marks = ", ".join("?" for _ in self.columns[1:])
+        return f"({first} {op}= ? AND ({first} {op} ? OR ({rest}) {op} ({marks})))"
+
+    def order_by(self, backwards=False):
+        direction = "DESC" if self.descending != backwards else "ASC"
+        return ", ".join(f"{expr} {direction}" for expr, _ in self.columns)
+
+    def key(self, row):
+        return [row[name] for _, name in self.columns]
+
+    def cursor_from(self, args, prefix=""):
+        """Read the ``after``/``before`` cursor from request args.
+
+        Returns (values, backwards); values is None on the first page or when
+        the cursor does not fit this keyset (e.g. the sort changed).
+        """
+        for name, backwards in (("after", False), ("before", True)):
+            values = decode_cursor(args.get(prefix + name), len(self.columns))
+            if values is not None:
+                return values, backwards
+        return None, False
+
+    def page(self, rows, limit, values, backwards):
+        """Build a Page from rows fetched with LIMIT limit + 1."""
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+        if backwards:
+            rows.reverse()
+        if not rows:
+            return Page(rows, None, None)
+        if backwards:
+            next_cursor = encode_cursor(self.key(rows[-1]))
+            prev_cursor = encode_cursor(self.key(rows[0])) if has_more else None
+        else:
+            next_cursor = encode_cursor(self.key(rows[-1])) if has_more else None
+            prev_cursor = encode_cursor(self.key(rows[0])) if values is not None else None
+        return Page(rows, next_cursor, prev_cursor)
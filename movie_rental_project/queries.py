@@ -0,0 +1,244 @@
+"""Every SQL statement app.py runs, defined once.
+
+sqlite3 keeps the most recently used statements of each connection
+prepared, keyed on the exact statement text (``cached_statements``, see
+db.open_connection). /movies, /rent and the paged lists used to assemble
+their query by string concatenation on every request, so the same page
+could come out as a different text and each text had to be prepared again.
+
+Here the fixed statements are constants, and the pages with optional
+filters get theirs from a builder that depends only on the *shape* of the
+request: which filters are present, the sort, its direction and whether
+there is a keyset cursor. Values are always bound parameters. The builders
+are memoized, and statements() enumerates every text they can produce, so
+the set is fixed and known: query_plans checks all of it, and
+``DB_CACHED_STATEMENTS`` is sized to hold it.
+
+Not here: init_db's schema script and ``PRAGMA user_version`` fingerprint
+(DDL run once per process, the PRAGMA can't bind its value) and the
+archive command's ``VACUUM`` -- none of them is prepared more than once
+and none has a query plan to check.
+"""
+import itertools
+from functools import lru_cache
+
+import pagination
+import rentals
+import rollups
+import search
+
+# ============== Reference lookups ==============
+CATEGORIES = "SELECT category_id, category_name FROM category ORDER BY category_name"
+RELEASE_YEARS = """
+    SELECT DISTINCT release_year
+    FROM movie
+    WHERE release_year IS NOT NULL
+    ORDER BY release_year DESC
+"""
+ACTORS = "SELECT actor_id, actor_name FROM actor ORDER BY actor_name"
+
+# ============== Users ==============
+USER_BY_NAME = "SELECT user_id, username, password, role FROM user WHERE username = ?"
+USER_ID_BY_NAME = "SELECT user_id FROM user WHERE username = ?"
+INSERT_USER = "INSERT INTO user (username, password, role, created_at) VALUES (?, ?, ?, datetime('now'))"
+MOVIE_COUNT = "SELECT COUNT(*) FROM movie"
+
+# ============== Movies ==============
+MOVIE_BY_ID = "SELECT * FROM movie WHERE movie_id = ?"
+MOVIE_TITLES = "SELECT movie_id, title FROM movie ORDER BY title"
+INSERT_MOVIE = """
+    INSERT INTO movie (title, release_year, mpaa_rating, length_minutes, movie_rating, description, rental_rate, late_fee)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+"""
+INSERT_MOVIE_CATEGORY = "INSERT INTO movie_category (movie_id, category_id) VALUES (?, ?)"
+INSERT_MOVIE_ACTOR = "INSERT INTO movie_actor (movie_id, actor_id) VALUES (?, ?)"
+INSERT_COPY = "INSERT INTO inventory_copy (movie_id, status, store_location) VALUES (?, 'AVAILABLE', ?)"
+
+# ============== Customers / rentals ==============
+CUSTOMER_COUNT = "SELECT COUNT(*) AS total FROM customer"
+OPEN_RENTAL_COUNT = "SELECT COUNT(*) AS total FROM rental WHERE rental_status = 'OPEN'"
+
+# /movies sort keys. NULL years/ratings sort as 0 (row values can't
+# compare NULL); movie_id breaks ties so the order is total.
+MOVIE_SORTS = {
+    "title": "m.title",
+    "year": "COALESCE(m.release_year, 0)",
+    "rating": "COALESCE(m.movie_rating, 0)",
+    "relevance": "s.rank",   # bm25: smaller is a better match
+}
+# keyword handling on /movies and /rent: FTS5 MATCH, title LIKE, or none
+TEXT_SEARCHES = (None, "match", "like")
+
+CUSTOMER_COLUMNS = [("last_name", "last_name"), ("first_name", "first_name"), ("customer_id", "customer_id")]
+OPEN_RENTAL_COLUMNS = [("r.rental_date", "rental_date"), ("r.rental_id", "rental_id")]
+OVERDUE_COLUMNS = [("o.due_date", "due_date"), ("o.rental_id", "rental_id")]
+
+# ============== Late fees ==============
+TOP_BALANCES = """
+    SELECT b.customer_id, c.first_name, c.last_name, b.overdue_rentals, b.accruing, b.charged,
+           b.accruing + b.charged AS balance
+    FROM customer_balance b
+    JOIN customer c ON c.customer_id = b.customer_id
+    WHERE b.accruing + b.charged > 0
+    ORDER BY b.accruing + b.charged DESC
+    LIMIT ?
+"""
+
+# ============== Maintenance ==============
+# after a restore: the snapshot may have caught jobs mid-run
+RELEASE_MAINTENANCE_LEASES = "UPDATE maintenance_job SET lease_owner = NULL, lease_until = NULL"
+
+
+def movie_keyset(sort, descending=False):
+    return pagination.Keyset([(MOVIE_SORTS[sort], "sort_key"), ("m.movie_id", "movie_id")],
+                             descending=descending)
+
+
+@lru_cache(maxsize=None)
+def movie_page(text_search, category, year, min_rating, sort, descending, cursor):
+    """One page of /movies.
+
+    Parameters, in order: the MATCH query or LIKE pattern, category_id,
+    release year and minimum rating (each only if present), the cursor
+    values (Keyset.condition) and the LIMIT. ``descending`` is the
+    direction of the scan, i.e. the sort direction flipped when paging
+    backwards.
+    """
+    keyset = movie_keyset(sort, descending)
+    sql = f"""
+        SELECT
+            m.movie_id,
+            m.title,
+            m.release_year,
+            m.mpaa_rating,
+            m.movie_rating,
+            m.total_copies,
+            m.available_copies,
+            (SELECT GROUP_CONCAT(c.category_name)
+             FROM movie_category mc JOIN category c ON mc.category_id = c.category_id
+             WHERE mc.movie_id = m.movie_id) AS categories,
+            {keyset.columns[0][0]} AS sort_key
+        FROM movie m
+    """
+    # Keyword search goes through the FTS5 index (title, description,
+    # actors, roles, categories); LIKE only when nothing in it is indexable
+    if text_search == "match":
+        sql += f" JOIN ({search.RANKED_MATCHES}) s ON s.movie_id = m.movie_id"
+    conditions = []
+    if text_search == "like":
+        conditions.append("m.title LIKE ?")
+    if category:
+        conditions.append(
+            "EXISTS (SELECT 1 FROM movie_category mc WHERE mc.movie_id = m.movie_id AND mc.category_id = ?)")
+    if year:
+        conditions.append("m.release_year = ?")
+    if min_rating:
+        conditions.append("m.movie_rating >= ?")
+    if cursor:
+        conditions.append(keyset.clause())
+    if conditions:
+        sql += " WHERE " + " AND ".join(conditions)
+    return sql + f" ORDER BY {keyset.order_by()} LIMIT ?"
+
+
+@lru_cache(maxsize=None)
+def rent_movies(text_search, category):
+    """/rent movie list. Parameters: MATCH query or LIKE pattern, category_id."""
+    sql = """
+        SELECT DISTINCT m.movie_id, m.title, m.available_copies AS available
+        FROM movie m
+        LEFT JOIN movie_category mc ON m.movie_id = mc.movie_id
+    """
+    if text_search == "match":
+        sql += f" JOIN ({search.RANKED_MATCHES}) s ON s.movie_id = m.movie_id"
+    sql += " WHERE 1=1"
+    if text_search == "like":
+        sql += " AND m.title LIKE ?"
+    if category:
+        sql += " AND mc.category_id = ?"
+    return sql + (" ORDER BY s.rank, m.title" if text_search == "match" else " ORDER BY m.title")
+
+
+def _paged(sql, columns, descending, cursor, joiner=" WHERE "):
+    keyset = pagination.Keyset(columns, descending=descending)
+    if cursor:
+        sql += joiner + keyset.clause()
+    return sql + f" ORDER BY {keyset.order_by()} LIMIT ?"
+
+
+@lru_cache(maxsize=None)
+def customer_page(descending, cursor):
+    """/customers. Parameters: cursor values (if any), LIMIT."""
+    return _paged("SELECT * FROM customer", CUSTOMER_COLUMNS, descending, cursor)
+
+
+@lru_cache(maxsize=None)
+def customer_choices(descending, cursor):
+    """/rent customer dropdown. Parameters: cursor values (if any), LIMIT."""
+    return _paged("""
+        SELECT customer_id,
+               first_name || ' ' || last_name AS name,
+               last_name,
+               first_name
+        FROM customer
+    """, CUSTOMER_COLUMNS, descending, cursor)
+
+
+@lru_cache(maxsize=None)
+def open_rentals_page(descending, cursor):
+    """/return, newest first. Parameters: cursor values (if any), LIMIT."""
+    return _paged("""
+        SELECT r.rental_id,
+               r.rental_date,
+               c.first_name,
+               c.last_name,
+               m.title
+        FROM rental r
+        JOIN customer c ON r.customer_id = c.customer_id
+        JOIN inventory_copy ic ON r.copy_id = ic.copy_id
+        JOIN movie m ON ic.movie_id = m.movie_id
+        WHERE r.rental_status = 'OPEN'
+    """, OPEN_RENTAL_COLUMNS, descending, cursor, joiner=" AND ")
+
+
+@lru_cache(maxsize=None)
+def overdue_page(descending, cursor):
+    """/reports/overdue, most overdue first. Parameters: cursor values (if any), LIMIT."""
+    return _paged("""
+        SELECT o.rental_id,
+               o.due_date,
+               o.days_late,
+               o.daily_fee,
+               o.fee,
+               c.first_name,
+               c.last_name,
+               m.title
+        FROM overdue_rental o
+        JOIN customer c ON c.customer_id = o.customer_id
+        JOIN rental r ON r.rental_id = o.rental_id
+        JOIN inventory_copy ic ON ic.copy_id = r.copy_id
+        JOIN movie m ON m.movie_id = ic.movie_id
+    """, OVERDUE_COLUMNS, descending, cursor)
+
+
+_FLAGS = (False, True)
+
+
+def statements():
+    """Every statement text app.py can run, as a list of (name, sql)."""
+    found = [(name, value) for name, value in globals().items() if name.isupper() and isinstance(value, str)]
+    for text_search, category, year, min_rating, sort, descending, cursor in itertools.product(
+            TEXT_SEARCHES, _FLAGS, _FLAGS, _FLAGS, MOVIE_SORTS, _FLAGS, _FLAGS):
+        if sort == "relevance" and text_search != "match":
+            continue
+        found.append((f"movie_page({text_search}, category={category}, year={year}, "
+                      f"min_rating={min_rating}, {sort}, desc={descending}, cursor={cursor})",
+                      movie_page(text_search, category, year, min_rating, sort, descending, cursor)))
+    for text_search, category in itertools.product(TEXT_SEARCHES, _FLAGS):
+        found.append((f"rent_movies({text_search}, category={category})", rent_movies(text_search, category)))
+    for builder in (customer_page, customer_choices, open_rentals_page, overdue_page):
+        for descending, cursor in itertools.product(_FLAGS, _FLAGS):
+            found.append((f"{builder.__name__}(desc={descending}, cursor={cursor})", builder(descending, cursor)))
+    found.extend((f"rentals.{name}", sql) for name, sql in rentals.STATEMENTS.items())
+    found.append(("rollups.STORES", rollups.STORES))
+    return found
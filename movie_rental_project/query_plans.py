@@ -0,0 +1,173 @@
+"""EXPLAIN QUERY PLAN regression check for the route queries.
+
+Each entry below is a query one of the routes in app.py runs, with sample
+parameters. check() asks SQLite for the plan of every one of them and
+reports any step that reads a whole table without an index ("SCAN movie"
+as opposed to "SEARCH movie USING INDEX ..." or "SCAN ... USING COVERING
+INDEX ..."). A query that legitimately reads every row of a table (a
+whole-table aggregate, for example) has to say so in ``allow_scan``.
+
+Run it with ``flask --app app check-query-plans``; it exits non-zero when a
+route query regresses to a full table scan.
+"""
+import re
+
+import changelog
+import latefees
+import queries
+import recommend
+import rentals
+import rollups
+
+# (route, name, sql, params, allow_scan): the queries each route runs, with
+# sample parameters. app.py's statements come from the query registry
+# (queries.py); check_registry() covers the rest of its canonical set.
+ROUTE_QUERIES = [
+    ("/login", "user by name", queries.USER_BY_NAME, ("admin",), ()),
+    ("/movies", "categories", queries.CATEGORIES, (), ()),
+    ("/movies", "release years", queries.RELEASE_YEARS, (), ()),
+    ("/movies", "page by title",
+     queries.movie_page(None, False, False, False, "title", False, True),
+     ('Fargo', 'Fargo', 8, 51), ()),
+    ("/movies", "page by rating",
+     queries.movie_page(None, False, False, False, "rating", True, True),
+     (9.0, 9.0, 8, 51), ()),
+    ("/movies", "page by year",
+     queries.movie_page(None, False, False, False, "year", True, True),
+     (2000, 2000, 8, 51), ()),
+    ("/movies", "movies in category",
+     queries.movie_page(None, True, False, False, "title", False, False),
+     (2, 51), ()),
+    ("/movies", "movies in year",
+     queries.movie_page(None, False, True, False, "title", False, False),
+     (1994, 51), ()),
+    ("/movies", "keyword search",
+     queries.movie_page("match", False, False, False, "relevance", False, True),
+     ('"god"*', -10.0, -10.0, 3, 51), ()),
+    ("/admin/movies/add", "actors", queries.ACTORS, (), ()),
+    ("/movies/<id>", "movie by id", queries.MOVIE_BY_ID, (1,), ()),
+    ("/movies/<id>", "also rented", recommend.SIMILAR_MOVIES, (1, recommend.TOP_K), ()),
+    ("/customers", "customer page",
+     queries.customer_page(False, True),
+     ("Jones", "Jones", "Bob", 2, 51), ()),
+    ("/rent", "claim copy", rentals.CLAIM_COPY, (1,), ()),
+    ("/rent/batch", "free copies for basket", rentals.FREE_COPIES, ("[1, 2, 3]",), ()),
+    ("/rent/batch", "rentals for claimed copies", rentals.RENTALS_FOR_COPIES, ("[1, 2]",), ()),
+    ("/return/batch", "open rentals in basket", rentals.OPEN_RENTALS, ("[1, 2]",), ()),
+    ("/rent", "movies in category with availability", queries.rent_movies(None, True), (3,), ()),
+    ("/rent", "customer dropdown page",
+     queries.customer_choices(True, True),
+     ("Jones", "Jones", "Bob", 2, 51), ()),
+    ("/return", "open rentals page",
+     queries.open_rentals_page(True, True),
+     ("2025-12-02 14:00:00", "2025-12-02 14:00:00", 2, 51), ()),
+    ("/return", "open rental count", queries.OPEN_RENTAL_COUNT, (), ()),
+    ("/customers", "customer count", queries.CUSTOMER_COUNT, (), ()),
+    ("/api/v1/rentals", "rentals of a customer",
+     """
+     SELECT r.rental_id AS rental_id, r.rental_status AS status, r.rental_id AS _key
+     FROM rental r
+     WHERE r.customer_id = ? AND r.rental_id > ?
+     ORDER BY r.rental_id LIMIT 51
+     """,
+     (1, 0), ()),
+    ("/api/v1/rentals", "rentals of a movie",
+     """
+     SELECT r.rental_id AS rental_id, r.rental_id AS _key
+     FROM rental r
+     WHERE r.copy_id IN (SELECT copy_id FROM inventory_copy WHERE movie_id = ?) AND +r.rental_id > ?
+     ORDER BY +r.rental_id LIMIT 51
+     """,
+     (1, 0), ()),
+    ("/api/v1/payments", "payments of a customer",
+     """
+     SELECT p.payment_id AS payment_id, p.payment_id AS _key
+     FROM payment p
+     WHERE p.rental_id IN (SELECT rental_id FROM rental WHERE customer_id = ?)
+     ORDER BY +p.payment_id LIMIT 51
+     """,
+     (1,), ()),
+    ("/reports/popular", "top rented movies",
+     """
+     SELECT m.movie_id, m.title, ms.rental_count
+     FROM movie_stats ms
+     JOIN movie m ON ms.movie_id = m.movie_id
+     WHERE ms.rental_count > 0
+     ORDER BY ms.rental_count DESC, ms.movie_id DESC
+     LIMIT ?
+     """,
+     (10,), ()),
+    # a few dozen named counters; reading all of them is the point
+    ("/reports/popular", "report counters",
+     "SELECT name, value FROM stats_counter",
+     (), ("stats_counter",)),
+    ("/reports/trends", "daily series", rollups.TREND["day"], ("category", "3", "2025-01-01", "2026-12-31~"), ()),
+    ("/reports/trends", "hourly series", rollups.TREND["hour"], ("all", "", "2026-01-01", "2026-01-02~"), ()),
+    ("/reports/trends", "active before range", rollups.ACTIVE_BEFORE, ("store", "Warehouse", "2026-01-01"), ()),
+    ("/reports/trends", "stores", rollups.STORES, (), ()),
+    ("/reports/overdue", "overdue rentals page",
+     queries.overdue_page(False, True),
+     ("2025-12-06 10:00:00", "2025-12-06 10:00:00", 1, 51), ()),
+    ("/reports/overdue", "largest balances", queries.TOP_BALANCES, (10,), ()),
+    # customers that ever owed a late fee, summed
+    ("/reports/overdue", "late fee totals", latefees.TOTALS, (), ("customer_balance",)),
+    ("/api/v1/changes", "changes since", changelog.READ.format(tables=""), (100, 501), ()),
+    ("/api/v1/changes", "changes of some tables since",
+     changelog.READ.format(tables=" AND table_name IN (?, ?)"), (100, "rental", "payment", 501), ()),
+    ("changes job", "superseded entries", changelog.SUPERSEDED, (0, 5000), ()),
+    ("overdue job", "next overdue batch", latefees.NEXT_OVERDUE,
+     {"now": "2026-01-01T00:00:00", "due": "", "rental_id": 0, "limit": latefees.BATCH_SIZE}, ()),
+]
+
+# "SCAN movie" / "SCAN m" but not "SCAN m USING [COVERING] INDEX ..."
+_FULL_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)(?: AS (\w+))?$")
+
+
+def plan(conn, sql, params=()):
+    return [row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, params)]
+
+
+# subquery results; scanning those is reading a temp result, not a table
+_SUBQUERY = re.compile(r"^(?:MATERIALIZE|CO-ROUTINE) (\w+)")
+
+
+def full_scans(conn, sql, params=()):
+    """Return the tables/aliases a query reads with a full table scan."""
+    steps = [detail.strip() for detail in plan(conn, sql, params)]
+    subqueries = {m.group(1) for m in map(_SUBQUERY.match, steps) if m}
+    scans = []
+    for detail in steps:
+        match = _FULL_SCAN.match(detail)
+        if match:
+            name = match.group(2) or match.group(1)
+            if name not in subqueries:
+                scans.append(name)
+    return scans
+
+
+def check(conn, route_queries=None):
+    """Return a list of (route, name, scanned_tables, plan) failures."""
+    failures = []
+    for route, name, sql, params, allow_scan in route_queries or ROUTE_QUERIES:
+        scans = [t for t in full_scans(conn, sql, params) if t not in allow_scan]
+        if scans:
+            failures.append((route, name, scans, plan(conn, sql, params)))
+    return failures
+
+
+def null_params(sql):
+    """Parameters for planning ``sql`` without values: NULL for each one."""
+    names = re.findall(r"(?<!:):(\w+)", sql)
+    return dict.fromkeys(names) if names else [None] * sql.count("?")
+
+
+# registry statements that read a whole table on purpose
+REGISTRY_SCANS = {
+    "RELEASE_MAINTENANCE_LEASES": ("maintenance_job",),   # one row per job
+}
+
+
+def check_registry(conn):
+    """check() every canonical statement of the query registry (NULL parameters)."""
+    return check(conn, [("(registry)", name, sql, null_params(sql), REGISTRY_SCANS.get(name, ()))
+                        for name, sql in queries.statements()])
@@ -0,0 +1,392 @@
+"""Co-occurrence recommendations: "customers who rented this also rented".
+
+Two movies are related by the number of distinct customers who rented
+both. For every movie, movie_similar keeps only its TOP_K partners:
+
+    movie_similar        (movie_id, similar_id, customers), K rows per movie
+    movie_similar_state  folded_rental_id: the last rental counted in it,
+                         deferred_pairs: see fold()
+
+ordered by customers (most first), then similar_id, so the top K is always
+one well-defined set and the movie page reads it with a primary-key range.
+
+rebuild() recomputes the table from the whole rental history with NumPy:
+the distinct (customer, movie) pairs form a sparse customer x movie
+matrix, and the co-occurrence counts (X^T X) are built a block of movies at
+a time with bincount, so memory stays bounded however big the store is.
+
+fold() brings the table up to date with the rentals made since, without a
+rebuild. A customer renting movie m for the first time adds one to the
+pair (m, j) for every movie j they rented before, so only the lists of m
+and of those j can change: a pair already in a list is incremented in
+place, and one that is not may have to be counted from the history to see
+whether it overtakes the last entry. When that count would be expensive
+(RECOUNT_LIMIT) the pair is deferred and counted in deferred_pairs: every
+count in the table stays exact, but such a pair only shows up in a list
+after the next rebuild. The rent routes fold after every checkout.
+Deleted rentals are not folded out; run ``flask --app app
+rebuild-recommendations`` after bulk deletes, or when deferred_pairs grows.
+
+Rentals moved to the archive database (archive.py) are still history:
+the history is read through the rental_history view, or from both files.
+"""
+import itertools
+import time
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+TOP_K = 10
+
+# rentals folded per fold() call; the rest wait for the next one
+FOLD_BATCH = 20
+
+# fold() recounts a pair from the rental history only if that takes at
+# most this many index probes (rentals of one movie x copies of the other);
+# dearer pairs are deferred to the next rebuild (None: always recount)
+RECOUNT_LIMIT = 2000
+
+# rebuild(): co-occurrence pairs and dense count cells per block of movies
+PAIR_BUDGET = 20_000_000
+CELL_BUDGET = 16_000_000
+
+TABLES = """
+-- "did this customer rent that movie": a lookup per copy instead of a walk
+-- through the customer's rentals (_CUSTOMERS_OF_BOTH). It starts with
+-- customer_id, so it replaces the customer_id index
+CREATE INDEX IF NOT EXISTS idx_rental_customer_copy ON rental (customer_id, copy_id);
+DROP INDEX IF EXISTS idx_rental_customer;
+
+CREATE TABLE IF NOT EXISTS movie_similar (
+    movie_id   INTEGER NOT NULL,
+    similar_id INTEGER NOT NULL,
+    customers  INTEGER NOT NULL,
+    PRIMARY KEY (movie_id, similar_id)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS movie_similar_state (
+    name  TEXT PRIMARY KEY,
+    value INTEGER
+) WITHOUT ROWID;
+"""
+
+SIMILAR_MOVIES = """
+    SELECT m.movie_id, m.title, m.release_year, m.movie_rating, m.available_copies, s.customers
+    FROM movie_similar s
+    JOIN movie m ON m.movie_id = s.similar_id
+    WHERE s.movie_id = ?
+    ORDER BY s.customers DESC, s.similar_id
+    LIMIT ?
+"""
+
+# rental ids only grow, but either file may hold the newest or be empty
+_LAST_RENTAL = """
+    SELECT MAX(COALESCE((SELECT MAX(rental_id) FROM main.rental), 0),
+               COALESCE((SELECT MAX(rental_id) FROM archive.rental), 0))
+"""
+
+# every rental up to a rental_id as customer_id << 32 | copy_id: one integer
+# column, and no join, reads several times faster than (customer, movie) rows
+_RENTED = "SELECT customer_id << 32 | copy_id FROM rental_history WHERE rental_id <= ?"
+
+# rentals not folded yet are new, so never archived
+_NEW_RENTALS = """
+    SELECT r.rental_id, r.customer_id, ic.movie_id
+    FROM rental r
+    JOIN inventory_copy ic ON ic.copy_id = r.copy_id
+    WHERE r.rental_id > ?
+    ORDER BY r.rental_id
+    LIMIT ?
+"""
+
+# rental_history is a UNION ALL view: SQLite searches it with the indexes
+# of both files for constant terms, but never for a join or a correlated
+# term, which would read it whole. So no joins against it below
+_HISTORY = """
+    SELECT DISTINCT ic.movie_id
+    FROM inventory_copy ic
+    WHERE ic.copy_id IN (SELECT copy_id FROM rental_history WHERE customer_id = ? AND rental_id < ?)
+"""
+
+# customers who had rented both movies by rental ?: the rentals of the
+# first movie are scanned, the copies of the second probed for each, in
+# both files. Parameters: (first movie, rental, rental, second movie,
+# rental, second movie) twice
+_PROBE = """
+    EXISTS (SELECT 1 FROM {schema}.rental r2
+            WHERE r2.customer_id = r.customer_id AND r2.rental_id <= ?
+              AND r2.copy_id IN (SELECT copy_id FROM inventory_copy WHERE movie_id = ?))
+"""
+_SCAN = f"""
+    SELECT r.customer_id
+    FROM {{schema}}.rental r
+    WHERE r.copy_id IN (SELECT copy_id FROM inventory_copy WHERE movie_id = ?) AND r.rental_id <= ?
+      AND ({_PROBE.format(schema="main")} OR {_PROBE.format(schema="archive")})
+"""
+_CUSTOMERS_OF_BOTH = f"""
+    SELECT COUNT(DISTINCT customer_id)
+    FROM ({_SCAN.format(schema="main")} UNION ALL {_SCAN.format(schema="archive")})
+"""
+
+# rentals (stats.py) and copies of a movie: what a recount scans and probes
+_RECOUNT_COST = """
+    SELECT COALESCE(ms.rental_count, 0), m.total_copies
+    FROM movie m
+    LEFT JOIN movie_stats ms ON ms.movie_id = m.movie_id
+    WHERE m.movie_id = ?
+"""
+
+
+def create_tables(conn):
+    """Create the tables; nothing is folded until rebuild() or fold() runs."""
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    conn.execute("INSERT OR IGNORE INTO movie_similar_state (name, value) VALUES ('folded_rental_id', 0)")
+    conn.execute("INSERT OR IGNORE INTO movie_similar_state (name, value) VALUES ('deferred_pairs', 0)")
+
+
+def _state(conn, name):
+    row = conn.execute("SELECT value FROM movie_similar_state WHERE name = ?", (name,)).fetchone()
+    return row[0] if row and row[0] is not None else 0
+
+
+def _set_state(conn, name, value):
+    conn.execute("INSERT INTO movie_similar_state (name, value) VALUES (?, ?) "
+                 "ON CONFLICT (name) DO UPDATE SET value = excluded.value", (name, value))
+
+
+def folded_rental_id(conn):
+    return _state(conn, "folded_rental_id")
+
+
+def deferred_pairs(conn):
+    """Pairs fold() did not recount since the last rebuild (see RECOUNT_LIMIT)."""
+    return _state(conn, "deferred_pairs")
+
+
+def similar(conn, movie_id, limit=TOP_K):
+    return conn.execute(SIMILAR_MOVIES, (movie_id, limit)).fetchall()
+
+
+# ============== Full rebuild (NumPy) ==============
+
+def _pairs(conn, upto):
+    """Distinct (customer, movie) pairs as a CSR customer x movie matrix.
+
+    Returns (indptr, movies, width): the movies of customer row i are
+    movies[indptr[i]:indptr[i + 1]], sorted; width is max movie_id + 1.
+    """
+    copies = np.array(conn.execute("SELECT copy_id, movie_id FROM inventory_copy").fetchall(),
+                      dtype=np.int64).reshape(-1, 2)
+    rented = np.fromiter(itertools.chain.from_iterable(conn.execute(_RENTED, (upto,))), dtype=np.int64)
+    if not len(copies) or not len(rented):
+        return np.zeros(1, dtype=np.int64), np.zeros(0, dtype=np.int64), 1
+    movie_of = np.full(copies[:, 0].max() + 1, -1, dtype=np.int64)
+    movie_of[copies[:, 0]] = copies[:, 1]
+    customer, copy_id = rented >> 32, rented & 0xFFFFFFFF
+    movie = movie_of[np.minimum(copy_id, len(movie_of) - 1)]
+    known = (copy_id < len(movie_of)) & (movie >= 0)   # rentals of deleted copies drop out
+    width = int(copies[:, 1].max()) + 1
+    codes = np.sort(customer[known] * width + movie[known])
+    codes = codes[np.r_[True, codes[1:] != codes[:-1]]]   # distinct (faster than np.unique)
+    customers, movies = np.divmod(codes, width)
+    starts = np.flatnonzero(np.r_[True, customers[1:] != customers[:-1]])
+    return np.r_[starts, len(codes)], movies, width
+
+
+def _blocks(load, width):
+    """Split movie ids 0..width-1 into ranges of bounded pair count and cells."""
+    rows = max(1, CELL_BUDGET // width)
+    start = 0
+    cumulative = np.cumsum(load)
+    while start < width:
+        done = cumulative[start - 1] if start else 0
+        end = int(np.searchsorted(cumulative, done + PAIR_BUDGET, side="right"))
+        end = min(max(end, start + 1), start + rows, width)
+        yield start, end
+        start = end
+
+
+def _top_k(indptr, movies, width, k):
+    """(movie_id, similar_id, customers) arrays of every movie's top k."""
+    sizes = np.diff(indptr)
+    owner = np.repeat(np.arange(len(sizes)), sizes)   # customer row of each entry
+    # work per movie: the movies of each of its customers
+    load = np.bincount(movies, weights=sizes[owner], minlength=width)
+    by_movie = np.argsort(movies, kind="stable")
+    first = np.searchsorted(movies[by_movie], np.arange(width + 1))
+    tie = np.arange(width - 1, -1, -1)
+
+    found = []
+    for lo, hi in _blocks(load, width):
+        entries = by_movie[first[lo]:first[hi]]
+        if not len(entries):
+            continue
+        rows = movies[entries] - lo
+        customer = owner[entries]
+        counts = sizes[customer]
+        # every (movie in block, movie of the same customer) pair
+        pair_row = np.repeat(rows, counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        partner = movies[np.repeat(indptr[customer], counts) + offsets]
+        block = np.bincount(pair_row * width + partner, minlength=(hi - lo) * width).reshape(hi - lo, width)
+        block[np.arange(hi - lo), np.arange(lo, hi)] = 0      # a movie is not its own partner
+
+        # rank by customers, then lower similar_id, as one integer key (int32
+        # when it fits: argpartition over the block is most of the work)
+        take = min(k, width)
+        dtype = np.int32 if (int(block.max()) + 1) * width < 2 ** 31 else np.int64
+        key = block.astype(dtype)
+        key *= width
+        key += tie.astype(dtype)
+        best = np.argpartition(key, width - take, axis=1)[:, width - take:]
+        customers = np.take_along_axis(block, best, axis=1)
+        keep = customers > 0
+        movie_ids = np.broadcast_to(np.arange(lo, hi)[:, None], best.shape)
+        found.append((movie_ids[keep], best[keep], customers[keep]))
+    if not found:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    return tuple(np.concatenate(parts) for parts in zip(*found))
+
+
+def compute(conn, k=TOP_K):
+    """Read the rental history and work out every movie's top k.
+
+    Only reads, so it can run outside the write lock; store() writes the
+    result. Returns (upto, rows, timings): rows are (movie_id, similar_id,
+    customers) for rentals up to rental_id ``upto``.
+    """
+    if np is None:
+        raise RuntimeError("rebuilding recommendations needs NumPy: pip install numpy")
+    timings = {}
+    started = time.perf_counter()
+    upto = conn.execute(_LAST_RENTAL).fetchone()[0]
+    indptr, movies, width = _pairs(conn, upto)
+    timings["load"] = time.perf_counter() - started
+    started = time.perf_counter()
+    movie_ids, similar_ids, customers = _top_k(indptr, movies, width, k)
+    timings["count"] = time.perf_counter() - started
+    timings["pairs"] = len(movies)
+    rows = list(zip(movie_ids.tolist(), similar_ids.tolist(), customers.tolist()))
+    return upto, rows, timings
+
+
+def store(conn, upto, rows):
+    """Replace movie_similar with ``rows`` (from compute()) as of rental ``upto``."""
+    conn.execute("DELETE FROM movie_similar")
+    conn.executemany("INSERT INTO movie_similar (movie_id, similar_id, customers) VALUES (?, ?, ?)", rows)
+    _set_state(conn, "folded_rental_id", upto)
+    _set_state(conn, "deferred_pairs", 0)
+
+
+def rebuild(conn, k=TOP_K):
+    """compute() and store() in one go; returns the timings."""
+    started = time.perf_counter()
+    upto, rows, timings = compute(conn, k)
+    store(conn, upto, rows)
+    timings["total"] = time.perf_counter() - started
+    timings["rows"] = len(rows)
+    return timings
+
+
+# ============== Incremental fold ==============
+
+def _listed(conn, movie_id):
+    return dict(conn.execute("SELECT similar_id, customers FROM movie_similar WHERE movie_id = ?",
+                             (movie_id,)).fetchall())
+
+
+def _last(listed):
+    """The entry a newcomer has to overtake: fewest customers, highest id."""
+    similar_id = min(listed, key=lambda key: (listed[key], -key))
+    return listed[similar_id], -similar_id
+
+
+def _fold_pair(conn, a, b, rental_id, k, recount_limit):
+    """One more customer has rented both ``a`` and ``b``: update both lists.
+
+    The count is symmetric, so the other movie's list tells what the pair
+    had before: its exact count if either list has the pair, 0 if either
+    list is not full (a list that is not full holds every partner), and
+    otherwise at most the last entry of both. Only when that bound leaves
+    room to enter a list is the pair counted from the rental history, and
+    only if that is cheap (``recount_limit``). Returns False if the pair
+    was deferred.
+    """
+    lists = {a: _listed(conn, a), b: _listed(conn, b)}
+    if b in lists[a]:
+        before = lists[a][b]
+    elif a in lists[b]:
+        before = lists[b][a]
+    elif len(lists[a]) < k or len(lists[b]) < k:
+        before = 0
+    else:
+        bound = min(_last(lists[a])[0], _last(lists[b])[0])
+        if (bound + 1, -b) < _last(lists[a]) and (bound + 1, -a) < _last(lists[b]):
+            return True   # cannot enter either list
+        (rentals_a, copies_a), (rentals_b, copies_b) = (
+            conn.execute(_RECOUNT_COST, (movie,)).fetchone() or (0, 0) for movie in (a, b))
+        scan, probe = (a, b) if rentals_a * copies_b <= rentals_b * copies_a else (b, a)
+        if recount_limit is not None and min(rentals_a * copies_b, rentals_b * copies_a) > recount_limit:
+            return False
+        params = ((scan, rental_id - 1) + (rental_id - 1, probe) * 2) * 2
+        before = conn.execute(_CUSTOMERS_OF_BOTH, params).fetchone()[0]
+    after = before + 1
+    for movie_id, partner_id in ((a, b), (b, a)):
+        listed = lists[movie_id]
+        if partner_id in listed:
+            conn.execute("UPDATE movie_similar SET customers = ? WHERE movie_id = ? AND similar_id = ?",
+                         (after, movie_id, partner_id))
+            continue
+        if len(listed) >= k:
+            if (after, -partner_id) < _last(listed):
+                continue
+            conn.execute("DELETE FROM movie_similar WHERE movie_id = ? AND similar_id = ?",
+                         (movie_id, -_last(listed)[1]))
+        conn.execute("INSERT INTO movie_similar (movie_id, similar_id, customers) VALUES (?, ?, ?) "
+                     "ON CONFLICT (movie_id, similar_id) DO UPDATE SET customers = excluded.customers",
+                     (movie_id, partner_id, after))
+    return True
+
+
+def fold(conn, limit=FOLD_BATCH, k=TOP_K, recount_limit=RECOUNT_LIMIT):
+    """Fold up to ``limit`` rentals (None: all) made since the last fold.
+
+    Call inside a write transaction. Returns the number of rentals folded.
+    """
+    upto = folded_rental_id(conn)
+    new = conn.execute(_NEW_RENTALS, (upto, -1 if limit is None else limit)).fetchall()
+    deferred = 0
+    for rental_id, customer_id, movie_id in new:
+        history = {row[0] for row in conn.execute(_HISTORY, (customer_id, rental_id))}
+        if movie_id in history:
+            continue   # a re-rental: this customer already counted for every pair
+        for other_id in sorted(history):
+            deferred += not _fold_pair(conn, movie_id, other_id, rental_id, k, recount_limit)
+    if new:
+        _set_state(conn, "folded_rental_id", new[-1][0])
+    if deferred:
+        _set_state(conn, "deferred_pairs", deferred_pairs(conn) + deferred)
+    return len(new)
+
+
+def refresh(conn, transaction, k=TOP_K):
+    """rebuild() for a live store: compute() outside the write lock.
+
+    ``transaction(conn)`` opens a write transaction (app.write_transaction);
+    only store() and folding the rentals made while computing run inside
+    it. Returns the timings, with ``rows``, ``store`` and ``folded``.
+    """
+    upto, rows, timings = compute(conn, k)
+    started = time.perf_counter()
+    with transaction(conn):
+        store(conn, upto, rows)
+        timings["folded"] = fold(conn, limit=None, k=k)
+        conn.commit()
+    timings["store"] = time.perf_counter() - started
+    timings["rows"] = len(rows)
+    return timings
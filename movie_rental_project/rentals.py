@@ -0,0 +1,302 @@
+"""Rental checkout.
+
+The old checkout picked a copy with ``SELECT ... WHERE status = 'AVAILABLE'``
+and only then wrote the rental and flipped the copy to RENTED. Python's
+sqlite3 runs that SELECT outside any transaction, so two clerks renting the
+same popular title could both be handed the same copy.
+
+checkout() instead claims a copy and books the rental in one short
+BEGIN IMMEDIATE transaction, and the claim is a single conditional UPDATE:
+
+    UPDATE inventory_copy SET status = 'RENTED'
+    WHERE copy_id = (SELECT ... AND status = 'AVAILABLE' LIMIT 1)
+      AND status = 'AVAILABLE'
+    RETURNING copy_id
+
+A copy can only go from AVAILABLE to RENTED once, whatever else is running.
+If the write lock is still busy after busy_timeout (another process holding
+it), the whole transaction is retried with bounded, jittered backoff.
+
+checkout_batch() and return_rentals() handle a whole basket the same way:
+one transaction and one commit, executemany for the writes, and a
+BatchItem per requested movie / rental saying whether it went through.
+"""
+import json
+import random
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+RENTAL_DAYS = 5
+
+# retry policy when BEGIN IMMEDIATE / COMMIT reports a busy database
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 0.02   # seconds, doubled on every retry
+BACKOFF_MAX = 0.5
+
+# largest basket the batch endpoints accept
+MAX_BATCH = 50
+
+Checkout = namedtuple("Checkout", "rental_id copy_id customer_id due_date attempts")
+
+# one line of a batch result; key is the movie_id or rental_id asked for
+BatchItem = namedtuple("BatchItem", "key ok rental_id copy_id error")
+
+CLAIM_COPY = """
+    UPDATE inventory_copy
+    SET status = 'RENTED'
+    WHERE copy_id = (SELECT copy_id
+                     FROM inventory_copy
+                     WHERE movie_id = ? AND status = 'AVAILABLE'
+                     LIMIT 1)
+      AND status = 'AVAILABLE'
+    RETURNING copy_id
+"""
+
+INSERT_CUSTOMER = """
+    INSERT INTO customer (first_name, last_name, email, phone, address, signup_date)
+    VALUES (:first_name, :last_name, :email, :phone, :address, DATE('now'))
+"""
+INSERT_RENTAL = """
+    INSERT INTO rental (customer_id, copy_id, rental_date, due_date, rental_status)
+    VALUES (?, ?, ?, ?, 'OPEN')
+"""
+# Baskets are passed as one JSON array parameter (json_each) instead of an
+# IN (?, ?, ...) list, so every basket size runs the same statement text.
+# The basket drives the join (CROSS JOIN fixes the order): with planner
+# statistics, an IN (SELECT ...) probe made SQLite scan inventory_copy.
+FREE_COPIES = """
+    SELECT ic.movie_id, ic.copy_id
+    FROM json_each(?) j
+    CROSS JOIN inventory_copy ic ON ic.movie_id = j.value AND ic.status = 'AVAILABLE'
+    ORDER BY ic.copy_id
+"""
+RENT_COPY = "UPDATE inventory_copy SET status = 'RENTED' WHERE copy_id = ? AND status = 'AVAILABLE'"
+RENTALS_FOR_COPIES = """
+    SELECT copy_id, rental_id FROM rental
+    WHERE rental_status = 'OPEN' AND copy_id IN (SELECT value FROM json_each(?))
+"""
+OPEN_RENTALS = """
+    SELECT rental_id, copy_id FROM rental
+    WHERE rental_status = 'OPEN' AND rental_id IN (SELECT value FROM json_each(?))
+"""
+CLOSE_RENTAL = "UPDATE rental SET return_date = ?, rental_status = 'RETURNED' WHERE rental_id = ?"
+SHELVE_COPY = "UPDATE inventory_copy SET status = 'AVAILABLE' WHERE copy_id = ?"
+
+# for queries.statements()
+STATEMENTS = {name: sql for name, sql in globals().items() if name.isupper() and isinstance(sql, str)}
+
+
+def is_busy(exc):
+    """True for the "database is locked" family of errors worth retrying."""
+    message = str(exc).lower()
+    return isinstance(exc, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+def is_unknown_customer(exc):
+    """True when a checkout's IntegrityError is the customer foreign key failing.
+
+    The other constraint a checkout can hit is the new customer's unique email.
+    """
+    return isinstance(exc, sqlite3.IntegrityError) and "foreign key" in str(exc).lower()
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Full-jitter exponential backoff for retry number ``attempt`` (1-based)."""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def claim_copy(conn, movie_id):
+    """Mark one AVAILABLE copy of a movie RENTED; return its copy_id or None.
+
+    Must run inside a write transaction.
+    """
+    rows = conn.execute(CLAIM_COPY, (movie_id,)).fetchall()
+    return rows[0][0] if rows else None
+
+
+def retrying(conn, transaction, work, max_attempts=MAX_ATTEMPTS):
+    """Run ``work()`` in a BEGIN IMMEDIATE transaction, retrying while busy.
+
+    ``transaction(conn, immediate=True)`` must return the context manager
+    that opens the write transaction (app.write_transaction); ``work`` does
+    its own commit. Returns (result, attempts). Raises the last
+    sqlite3.OperationalError when the database stayed busy for every attempt.
+    """
+    for attempt in range(1, max_attempts + 1):
+        try:
+            with transaction(conn, immediate=True):
+                return work(), attempt
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc) or attempt == max_attempts:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+
+def _create_customer(conn, new_customer):
+    return conn.execute(INSERT_CUSTOMER, new_customer).lastrowid
+
+
+def _rental_dates(rental_days):
+    rental_date = datetime.now()
+    due_date = rental_date + timedelta(days=rental_days)
+    return rental_date, due_date
+
+
+def checkout(conn, transaction, customer_id, movie_id, new_customer=None,
+             rental_days=RENTAL_DAYS, max_attempts=MAX_ATTEMPTS):
+    """Rent one copy of ``movie_id`` to a customer.
+
+    When ``new_customer`` is a dict of customer columns that customer is
+    created in the same transaction and ``customer_id`` is ignored.
+    Returns a Checkout, or None when no copy is available (nothing is
+    written then, not even the new customer).
+    """
+    def work():
+        nonlocal customer_id
+        if new_customer is not None:
+            customer_id = _create_customer(conn, new_customer)
+
+        copy_id = claim_copy(conn, movie_id)
+        if copy_id is None:
+            return None
+
+        rental_date, due_date = _rental_dates(rental_days)
+        cur = conn.execute(
+            INSERT_RENTAL,
+            (
+                customer_id,
+                copy_id,
+                rental_date.isoformat(timespec="seconds"),
+                due_date.isoformat(timespec="seconds"),
+            ),
+        )
+        rental_id = cur.lastrowid
+        conn.commit()
+        return rental_id, copy_id, customer_id, due_date
+
+    done, attempts = retrying(conn, transaction, work, max_attempts)
+    return Checkout(*done, attempts) if done else None
+
+
+def parse_id(value):
+    """``value`` as a row id, or None: only an int or a string of digits is one.
+
+    int() alone would also take 1.5, True or "1_0" and quietly pick row 1 or 10.
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, str):
+        value = value.strip()
+        if value.isascii() and value.isdigit():
+            return int(value)
+    return None
+
+
+def _ids(values):
+    """Parse requested ids, keeping the order; None for anything not an id."""
+    return [parse_id(value) for value in values]
+
+
+def _json(values):
+    return json.dumps(list(values))
+
+
+def checkout_batch(conn, transaction, customer_id, movie_ids, new_customer=None,
+                   rental_days=RENTAL_DAYS, max_attempts=MAX_ATTEMPTS):
+    """Rent one copy of each movie in ``movie_ids`` to a customer.
+
+    Everything happens in one BEGIN IMMEDIATE transaction: since no other
+    writer can run until it commits, the free copies are read once and all
+    claimed with executemany. Titles without a free copy fail on their own
+    without stopping the rest. A movie listed twice rents two copies.
+
+    Returns (customer_id, [BatchItem per movie_id, in order]). Nothing is
+    committed, not even ``new_customer``, when no title could be rented.
+    """
+    requested = _ids(movie_ids)
+
+    def work():
+        cust_id = _create_customer(conn, new_customer) if new_customer is not None else customer_id
+        wanted = sorted({m for m in requested if m is not None})
+        free = {}
+        if wanted:
+            rows = conn.execute(FREE_COPIES, (_json(wanted),)).fetchall()
+            for movie_id, copy_id in rows:
+                free.setdefault(movie_id, []).append(copy_id)
+
+        claims = []
+        for movie_id in requested:
+            if movie_id is None:
+                claims.append(None)
+            else:
+                copies = free.get(movie_id)
+                claims.append(copies.pop(0) if copies else None)
+        claimed = [copy_id for copy_id in claims if copy_id is not None]
+        if not claimed:
+            return cust_id, claims, {}
+
+        rental_date, due_date = _rental_dates(rental_days)
+        # rowcount, not total_changes: that also counts rows the triggers write
+        updated = conn.executemany(RENT_COPY, [(copy_id,) for copy_id in claimed]).rowcount
+        if updated != len(claimed):
+            # cannot happen while we hold the write lock; refuse rather than double-book
+            raise sqlite3.IntegrityError("inventory changed during checkout")
+        conn.executemany(
+            INSERT_RENTAL,
+            [
+                (cust_id, copy_id, rental_date.isoformat(timespec="seconds"),
+                 due_date.isoformat(timespec="seconds"))
+                for copy_id in claimed
+            ],
+        )
+        rental_ids = dict(conn.execute(RENTALS_FOR_COPIES, (_json(claimed),)).fetchall())
+        conn.commit()
+        return cust_id, claims, rental_ids
+
+    (cust_id, claims, rental_ids), _ = retrying(conn, transaction, work, max_attempts)
+    items = []
+    for raw, movie_id, copy_id in zip(movie_ids, requested, claims):
+        if movie_id is None:
+            items.append(BatchItem(raw, False, None, None, "invalid movie id"))
+        elif copy_id is None:
+            items.append(BatchItem(movie_id, False, None, None, "no available copies"))
+        else:
+            items.append(BatchItem(movie_id, True, rental_ids[copy_id], copy_id, None))
+    return cust_id, items
+
+
+def return_rentals(conn, transaction, rental_ids, max_attempts=MAX_ATTEMPTS):
+    """Close the given open rentals and put their copies back on the shelf.
+
+    One transaction, executemany for both updates. Returns a BatchItem per
+    requested rental_id, in order; unknown or already closed rentals fail.
+    """
+    requested = _ids(rental_ids)
+
+    def work():
+        wanted = sorted({r for r in requested if r is not None})
+        if not wanted:
+            return {}
+        open_copies = dict(conn.execute(OPEN_RENTALS, (_json(wanted),)).fetchall())
+        if open_copies:
+            now = datetime.now().isoformat(timespec="seconds")
+            conn.executemany(CLOSE_RENTAL, [(now, rental_id) for rental_id in open_copies])
+            conn.executemany(SHELVE_COPY, [(copy_id,) for copy_id in open_copies.values()])
+            conn.commit()
+        return open_copies
+
+    open_copies, _ = retrying(conn, transaction, work, max_attempts)
+    items, seen = [], set()
+    for raw, rental_id in zip(rental_ids, requested):
+        if rental_id is None:
+            items.append(BatchItem(raw, False, None, None, "invalid rental id"))
+        elif rental_id in open_copies and rental_id not in seen:
+            seen.add(rental_id)
+            items.append(BatchItem(rental_id, True, rental_id, open_copies[rental_id], None))
+        else:
+            items.append(BatchItem(rental_id, False, rental_id, None, "rental not found or already closed"))
+    return items
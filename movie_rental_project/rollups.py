@@ -0,0 +1,362 @@
+"""Hourly and daily rollups of rental activity for the trends report.
+
+A trend chart over raw rows means grouping all of rental_history and
+payment_history by time for every view. Instead, two rollup tables hold
+one row per time bucket and dimension value:
+
+    rollup_hour  bucket 'YYYY-MM-DD HH:00'
+    rollup_day   bucket 'YYYY-MM-DD'
+
+        dim       'all', 'category' or 'store'
+        key       '' for all, the category_id, or the copy's store_location
+        rentals   rentals started in the bucket
+        returns   rentals returned in the bucket
+        revenue   payments taken in the bucket
+
+so a two-year daily chart reads about 730 rows, found by primary key
+(dim, key, bucket). Active rentals are not stored: the number open at the
+end of a bucket is every rental started minus every rental returned up to
+then, a running sum trend() takes over the rollup rows themselves.
+
+A rental counts once under 'all', under each category of its movie and
+under its copy's store_location, as they are when the row is written.
+Triggers on rental and payment add every new row, return and payment to
+both tables as it happens (through the rollup_dim view: a copy's
+dimension values). Rentals moved to the archive (archive.py) stay counted:
+the delete triggers skip the rows listed in archive_batch.
+
+rebuild() recomputes both tables from rental_history / payment_history,
+with NumPy when it is installed and one GROUP BY per table otherwise; run
+it with ``flask --app app rebuild-rollups``.
+"""
+import time
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # rebuild() falls back to SQL
+    np = None
+
+DIMENSIONS = ("all", "category", "store")
+
+# bucket expression per grain, over a timestamp expression
+GRAINS = {
+    "hour": "strftime('%Y-%m-%d %H:00', {ts})",
+    "day": "date({ts})",
+}
+
+# longest range trend() serves per grain, in days
+MAX_DAYS = {"hour": 31, "day": 3660}
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS rollup_hour (
+    dim     TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    bucket  TEXT NOT NULL,
+    rentals INTEGER NOT NULL DEFAULT 0,
+    returns INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (dim, key, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS rollup_day (
+    dim     TEXT NOT NULL,
+    key     TEXT NOT NULL,
+    bucket  TEXT NOT NULL,
+    rentals INTEGER NOT NULL DEFAULT 0,
+    returns INTEGER NOT NULL DEFAULT 0,
+    revenue REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (dim, key, bucket)
+) WITHOUT ROWID;
+
+-- the dimension values a rental of a copy counts under
+CREATE VIEW IF NOT EXISTS rollup_dim AS
+    SELECT copy_id, 'all' AS dim, '' AS key FROM inventory_copy
+    UNION ALL
+    SELECT ic.copy_id, 'category', CAST(mc.category_id AS TEXT)
+    FROM inventory_copy ic JOIN movie_category mc ON mc.movie_id = ic.movie_id
+    UNION ALL
+    SELECT copy_id, 'store', COALESCE(store_location, '') FROM inventory_copy;
+"""
+
+
+def _add(grain, ts, copy_id, when, rentals="0", returns="0", revenue="0"):
+    """Upsert adding the given amounts to the bucket of ``ts`` for every dimension of ``copy_id``."""
+    bucket = GRAINS[grain].format(ts=ts)
+    return (
+        f"INSERT INTO rollup_{grain} (dim, key, bucket, rentals, returns, revenue) "
+        f"SELECT dim, key, {bucket}, {rentals}, {returns}, {revenue} FROM rollup_dim "
+        f"WHERE copy_id = {copy_id} AND {when} "
+        "ON CONFLICT (dim, key, bucket) DO UPDATE SET "
+        "rentals = rentals + excluded.rentals, returns = returns + excluded.returns, "
+        "revenue = ROUND(revenue + excluded.revenue, 2);"
+    )
+
+
+def _both(ts, copy_id, when, **amounts):
+    return [_add(grain, ts, copy_id, when, **amounts) for grain in GRAINS]
+
+
+def _copy_of(rental_id):
+    return f"(SELECT copy_id FROM rental WHERE rental_id = {rental_id})"
+
+
+# a row being moved to the archive (archive.py) is not a deleted one
+_NOT_ARCHIVING = "WHEN OLD.rental_id NOT IN (SELECT rental_id FROM archive_batch)"
+
+_RENTAL_MOVED = "(OLD.rental_date IS NOT NEW.rental_date OR OLD.copy_id IS NOT NEW.copy_id)"
+_RETURN_MOVED = "(OLD.return_date IS NOT NEW.return_date OR OLD.copy_id IS NOT NEW.copy_id)"
+_PAYMENT_MOVED = ("(OLD.amount IS NOT NEW.amount OR OLD.payment_date IS NOT NEW.payment_date "
+                  "OR OLD.rental_id IS NOT NEW.rental_id)")
+
+TRIGGERS = {
+    "rollup_rental_ai": ("AFTER INSERT ON rental", [
+        *_both("NEW.rental_date", "NEW.copy_id", "1", rentals="1"),
+        *_both("NEW.return_date", "NEW.copy_id", "NEW.return_date IS NOT NULL", returns="1"),
+    ]),
+    # a return only sets return_date: the rental statements find no rows
+    "rollup_rental_au": ("AFTER UPDATE OF rental_date, return_date, copy_id ON rental", [
+        *_both("OLD.rental_date", "OLD.copy_id", _RENTAL_MOVED, rentals="-1"),
+        *_both("NEW.rental_date", "NEW.copy_id", _RENTAL_MOVED, rentals="1"),
+        *_both("OLD.return_date", "OLD.copy_id", f"OLD.return_date IS NOT NULL AND {_RETURN_MOVED}", returns="-1"),
+        *_both("NEW.return_date", "NEW.copy_id", f"NEW.return_date IS NOT NULL AND {_RETURN_MOVED}", returns="1"),
+    ]),
+    "rollup_rental_ad": (f"AFTER DELETE ON rental {_NOT_ARCHIVING}", [
+        *_both("OLD.rental_date", "OLD.copy_id", "1", rentals="-1"),
+        *_both("OLD.return_date", "OLD.copy_id", "OLD.return_date IS NOT NULL", returns="-1"),
+    ]),
+    "rollup_payment_ai": ("AFTER INSERT ON payment", [
+        *_both("NEW.payment_date", _copy_of("NEW.rental_id"), "1", revenue="NEW.amount"),
+    ]),
+    "rollup_payment_au": ("AFTER UPDATE OF amount, payment_date, rental_id ON payment", [
+        *_both("OLD.payment_date", _copy_of("OLD.rental_id"), _PAYMENT_MOVED, revenue="-OLD.amount"),
+        *_both("NEW.payment_date", _copy_of("NEW.rental_id"), _PAYMENT_MOVED, revenue="NEW.amount"),
+    ]),
+    "rollup_payment_ad": (f"AFTER DELETE ON payment {_NOT_ARCHIVING}", [
+        *_both("OLD.payment_date", _copy_of("OLD.rental_id"), "1", revenue="-OLD.amount"),
+    ]),
+}
+
+# trend(): the buckets of one series, and what was still open before them
+TREND = {
+    grain: f"""
+    SELECT bucket, rentals, returns, revenue FROM rollup_{grain}
+    WHERE dim = ? AND key = ? AND bucket >= ? AND bucket <= ?
+    ORDER BY bucket
+"""
+    for grain in GRAINS
+}
+ACTIVE_BEFORE = """
+    SELECT COALESCE(SUM(rentals) - SUM(returns), 0) FROM rollup_day
+    WHERE dim = ? AND key = ? AND bucket < ?
+"""
+STORES = "SELECT DISTINCT key FROM rollup_day WHERE dim = 'store' ORDER BY key"
+
+
+def create_tables(conn):
+    """Rollup tables, view and triggers, then rebuild(); migration 12."""
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    create_triggers(conn)
+    rebuild(conn)
+
+
+def create_triggers(conn, names=None):
+    """(Re)create the triggers, or only those in ``names``."""
+    for name, (event, body) in TRIGGERS.items():
+        if names is None or name in names:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n" + "\n".join(body) + "\nEND")
+
+
+# ============== Rebuild ==============
+
+# every event of the history: (copy_id, hour since 1970, rentals, returns, revenue).
+# Payments are archived with their rental, so each file joins its own
+# (CROSS JOIN: scan the payments, look their rental up by key)
+_EVENTS = """
+    SELECT * FROM (
+        SELECT copy_id, CAST(strftime('%s', rental_date) AS INTEGER) / 3600 AS hour,
+               1 AS rentals, 0 AS returns, 0 AS revenue
+        FROM rental_history
+        UNION ALL
+        SELECT copy_id, CAST(strftime('%s', return_date) AS INTEGER) / 3600, 0, 1, 0
+        FROM rental_history WHERE return_date IS NOT NULL
+        UNION ALL
+        SELECT r.copy_id, CAST(strftime('%s', p.payment_date) AS INTEGER) / 3600, 0, 0, p.amount
+        FROM main.payment p CROSS JOIN main.rental r ON r.rental_id = p.rental_id
+        UNION ALL
+        SELECT r.copy_id, CAST(strftime('%s', p.payment_date) AS INTEGER) / 3600, 0, 0, p.amount
+        FROM archive.payment p CROSS JOIN archive.rental r ON r.rental_id = p.rental_id
+    )
+    WHERE hour IS NOT NULL
+"""
+
+_INSERT = """
+    INSERT INTO rollup_{grain} (dim, key, bucket, rentals, returns, revenue)
+    VALUES (?, ?, ?, ?, ?, ?)
+"""
+
+
+def _events_by(group, copies, hours, rentals, returns, revenue):
+    """Sum the events per (key index, hour); ``group`` maps a copy_id to key indexes.
+
+    ``group`` is (offsets, members): the key indexes of copy c are
+    members[offsets[c]:offsets[c + 1]].
+    """
+    offsets, members = group
+    per_event = offsets[copies + 1] - offsets[copies]
+    event = np.repeat(np.arange(len(copies)), per_event)
+    first = np.repeat(offsets[copies], per_event)
+    within = np.arange(len(event)) - np.repeat(np.cumsum(per_event) - per_event, per_event)
+    return members[first + within], hours[event], rentals[event], returns[event], revenue[event]
+
+
+def _sum_by(codes, *columns, ordered=False):
+    """Group ``columns`` by ``codes``: (distinct codes, per-column sums).
+
+    ``ordered`` codes are already sorted and are not sorted again.
+    """
+    if not ordered:
+        order = np.argsort(codes)
+        codes, columns = codes[order], [column[order] for column in columns]
+    if not len(codes):
+        return codes, list(columns)
+    starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]])
+    return codes[starts], [np.add.reduceat(column, starts) for column in columns]
+
+
+def _rebuild_numpy(conn):
+    copy_rows = conn.execute(
+        "SELECT copy_id, movie_id, COALESCE(store_location, '') FROM inventory_copy").fetchall()
+    category_rows = conn.execute("SELECT movie_id, category_id FROM movie_category").fetchall()
+    stores = sorted({store for _, _, store in copy_rows})
+    # in primary key order (keys are text), so the rows are appended in order
+    categories = sorted({category for _, category in category_rows}, key=str)
+    keys = ([("all", "")] + [("category", str(c)) for c in categories] + [("store", s) for s in stores])
+    store_index = {s: 1 + len(categories) + i for i, s in enumerate(stores)}
+    category_index = {c: 1 + i for i, c in enumerate(categories)}
+
+    # key indexes per copy: all, its movie's categories, its store
+    by_movie = {}
+    for movie_id, category_id in category_rows:
+        by_movie.setdefault(movie_id, []).append(category_index[category_id])
+    size = max((c for c, _, _ in copy_rows), default=0) + 2
+    lists = [[] for _ in range(size)]
+    for copy_id, movie_id, store in copy_rows:
+        lists[copy_id] = [0, *by_movie.get(movie_id, ()), store_index[store]]
+    counts = np.array([len(members) for members in lists], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    members = np.fromiter((k for members in lists for k in members), dtype=np.int64, count=int(offsets[-1]))
+
+    events = conn.execute(_EVENTS).fetchall()
+    if not events:
+        return 0
+    copies, hours, rentals, returns, revenue = (np.array(column) for column in zip(*events))
+    known = (copies >= 0) & (copies < size - 1)
+    copies, hours, rentals, returns, revenue = (
+        column[known] for column in (copies.astype(np.int64), hours.astype(np.int64), rentals, returns,
+                                     revenue.astype(np.float64)))
+    key, hour, rentals, returns, revenue = _events_by((offsets, members), copies, hours,
+                                                      rentals, returns, revenue)
+
+    # hours first; the day rollup then sums the hour rows, which come out
+    # sorted by (key, hour) and so already in (key, day) order
+    base = hour.min()
+    span = int(hour.max() - base + 1)
+    codes, sums = _sum_by(key * span + (hour - base), rentals, returns, revenue)
+    key, hour = codes // span, codes % span + base
+    written = _insert(conn, "hour", keys, key, hour.astype("datetime64[h]"), sums)
+    day = hour // 24
+    base = day.min()
+    span = int(day.max() - base + 1)
+    codes, sums = _sum_by(key * span + (day - base), *sums, ordered=True)
+    written += _insert(conn, "day", keys, codes // span, (codes % span + base).astype("datetime64[D]"), sums)
+    return written
+
+
+def _insert(conn, grain, keys, key, stamps, sums):
+    """Append the summed rows of one grain; returns how many."""
+    labels = np.datetime_as_string(stamps)
+    if grain == "hour":
+        labels = [f"{label[:10]} {label[11:13]}:00" for label in labels]
+    n_rentals, n_returns, amount = sums
+    rows = [(*keys[k], label, a, b, c) for k, label, a, b, c in zip(
+        key.tolist(), labels, n_rentals.tolist(), n_returns.tolist(), np.round(amount, 2).tolist())]
+    conn.executemany(_INSERT.format(grain=grain), rows)
+    return len(rows)
+
+
+def _rebuild_sql(conn):
+    written = 0
+    for grain, bucket in GRAINS.items():
+        written += conn.execute(f"""
+            INSERT INTO rollup_{grain} (dim, key, bucket, rentals, returns, revenue)
+            SELECT d.dim, d.key, {bucket.format(ts="datetime(e.hour * 3600, 'unixepoch')")},
+                   SUM(e.rentals), SUM(e.returns), ROUND(SUM(e.revenue), 2)
+            FROM (SELECT copy_id, hour, SUM(rentals) AS rentals, SUM(returns) AS returns,
+                         SUM(revenue) AS revenue
+                  FROM ({_EVENTS})
+                  GROUP BY copy_id, hour) e
+            JOIN rollup_dim d ON d.copy_id = e.copy_id
+            GROUP BY d.dim, d.key, 3
+        """).rowcount
+    return written
+
+
+def rebuild(conn):
+    """Recompute both rollup tables from the whole history (inside the caller's transaction).
+
+    Returns (rows written, seconds, "numpy" or "sql").
+    """
+    started = time.perf_counter()
+    conn.execute("DELETE FROM rollup_hour")
+    conn.execute("DELETE FROM rollup_day")
+    if np is not None:
+        written, how = _rebuild_numpy(conn), "numpy"
+    else:
+        written, how = _rebuild_sql(conn), "sql"
+    return written, time.perf_counter() - started, how
+
+
+# ============== Trends ==============
+
+def _buckets(grain, start, end):
+    step = timedelta(hours=1) if grain == "hour" else timedelta(days=1)
+    fmt = "%Y-%m-%d %H:00" if grain == "hour" else "%Y-%m-%d"
+    at = datetime.combine(start, datetime.min.time())
+    last = datetime.combine(end, datetime.max.time())
+    while at <= last:
+        yield at.strftime(fmt)
+        at += step
+
+
+def trend(conn, grain="day", days=30, dim="all", key="", today=None):
+    """One series over the last ``days`` days (today included), oldest first.
+
+    Every bucket is there, with zeros where nothing happened. ``active`` is
+    the number of rentals open at the end of the bucket.
+    """
+    days = max(1, min(days, MAX_DAYS[grain]))
+    end = today or date.today()
+    start = end - timedelta(days=days - 1)
+    first, last = start.isoformat(), end.isoformat() + "~"   # '~' sorts after any hour of the day
+    (active,) = conn.execute(ACTIVE_BEFORE, (dim, key, start.isoformat())).fetchone()
+    found = {row[0]: row for row in conn.execute(TREND[grain], (dim, key, first, last))}
+    series = []
+    for bucket in _buckets(grain, start, end):
+        _, rentals, returns, revenue = found.get(bucket, (bucket, 0, 0, 0.0))
+        active += rentals - returns
+        series.append({"bucket": bucket, "rentals": rentals, "returns": returns,
+                       "revenue": round(revenue, 2), "active": active})
+    return series
+
+
+def polyline(values, width, height, top=None):
+    """SVG polyline points for ``values`` scaled into width x height."""
+    if not values:
+        return ""
+    top = top or max(max(values), 1)
+    step = width / max(len(values) - 1, 1)
+    return " ".join(f"{i * step:.1f},{height - value / top * height:.1f}" for i, value in enumerate(values))
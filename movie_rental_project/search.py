@@ -0,0 +1,150 @@
+"""Full-text movie search (SQLite FTS5).
+
+movie_search holds one document per movie (rowid = movie_id) with the title,
+description, actor names, role names and category names. Triggers on movie,
+movie_actor, movie_category, actor and category keep it in sync, so any keyword with
+something indexable in it is answered from the index. Only a keyword that
+match_query() reduces to nothing (punctuation only) falls back to
+``title LIKE '%keyword%'`` (app.keyword_filter).
+
+Typical use in a route:
+
+    match = search.match_query(keyword)
+    if match:
+        query += " JOIN (" + search.RANKED_MATCHES + ") s ON s.movie_id = m.movie_id"
+        params.append(match)
+"""
+import json
+import re
+from contextlib import contextmanager
+
+# bm25 column weights: title, description, actors, roles, categories
+BM25_WEIGHTS = (10.0, 1.0, 4.0, 2.0, 3.0)
+
+# movie_ids matching an FTS query, with their bm25 rank (lower = better).
+# The LIMIT keeps SQLite from flattening this subquery into the outer join,
+# where bm25() is not allowed.
+RANKED_MATCHES = (
+    "SELECT rowid AS movie_id, bm25(movie_search, {}) AS rank "
+    "FROM movie_search WHERE movie_search MATCH ? LIMIT -1"
+).format(", ".join(str(w) for w in BM25_WEIGHTS))
+
+# The search document for the movie(s) selected by {where}
+_DOCUMENT = """
+    SELECT m.movie_id,
+           m.title,
+           COALESCE(m.description, ''),
+           COALESCE((SELECT GROUP_CONCAT(a.actor_name, ' ')
+                     FROM movie_actor ma JOIN actor a ON a.actor_id = ma.actor_id
+                     WHERE ma.movie_id = m.movie_id), ''),
+           COALESCE((SELECT GROUP_CONCAT(ma.role_name, ' ')
+                     FROM movie_actor ma
+                     WHERE ma.movie_id = m.movie_id AND ma.role_name IS NOT NULL), ''),
+           COALESCE((SELECT GROUP_CONCAT(c.category_name, ' ')
+                     FROM movie_category mc JOIN category c ON c.category_id = mc.category_id
+                     WHERE mc.movie_id = m.movie_id), '')
+    FROM movie m
+    WHERE {where}
+"""
+
+
+def _refresh(where):
+    """SQL that rewrites the search documents of the movies matched by ``where``."""
+    return (
+        f"DELETE FROM movie_search WHERE rowid IN (SELECT m.movie_id FROM movie m WHERE {where});\n"
+        f"INSERT INTO movie_search (rowid, title, description, actors, roles, categories)"
+        + _DOCUMENT.format(where=where) + ";"
+    )
+
+
+_TRIGGERS = {
+    "movie_search_movie_ai": ("AFTER INSERT ON movie", _refresh("m.movie_id = NEW.movie_id")),
+    "movie_search_movie_au": ("AFTER UPDATE OF title, description ON movie",
+                              _refresh("m.movie_id = NEW.movie_id")),
+    "movie_search_movie_ad": ("AFTER DELETE ON movie",
+                              "DELETE FROM movie_search WHERE rowid = OLD.movie_id;"),
+    "movie_search_movie_actor_ai": ("AFTER INSERT ON movie_actor", _refresh("m.movie_id = NEW.movie_id")),
+    "movie_search_movie_actor_au": ("AFTER UPDATE ON movie_actor",
+                                    _refresh("m.movie_id IN (OLD.movie_id, NEW.movie_id)")),
+    "movie_search_movie_actor_ad": ("AFTER DELETE ON movie_actor", _refresh("m.movie_id = OLD.movie_id")),
+    "movie_search_movie_category_ai": ("AFTER INSERT ON movie_category", _refresh("m.movie_id = NEW.movie_id")),
+    "movie_search_movie_category_au": ("AFTER UPDATE ON movie_category",
+                                       _refresh("m.movie_id IN (OLD.movie_id, NEW.movie_id)")),
+    "movie_search_movie_category_ad": ("AFTER DELETE ON movie_category", _refresh("m.movie_id = OLD.movie_id")),
+    "movie_search_actor_au": ("AFTER UPDATE OF actor_name ON actor", _refresh(
+        "m.movie_id IN (SELECT movie_id FROM movie_actor WHERE actor_id = NEW.actor_id)")),
+    "movie_search_category_au": ("AFTER UPDATE OF category_name ON category", _refresh(
+        "m.movie_id IN (SELECT movie_id FROM movie_category WHERE category_id = NEW.category_id)")),
+}
+
+
+def create_search_index(conn):
+    """Create the FTS5 table and its sync triggers, then index every movie."""
+    conn.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS movie_search USING fts5(
+            title, description, actors, roles, categories,
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+    _create_triggers(conn)
+    rebuild_search_index(conn)
+
+
+def _create_triggers(conn):
+    for name, (event, body) in _TRIGGERS.items():
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+        conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n{body}\nEND")
+
+
+@contextmanager
+def bulk_load(conn, movie_ids):
+    """Suspend the sync triggers while a bulk write runs, then index once.
+
+    A movie inserted with three actors and two categories would otherwise
+    have its search document rewritten six times. Inside the block the
+    triggers are dropped; on the way out the documents of ``movie_ids``
+    (a list the block fills in) are rebuilt in one statement and the
+    triggers come back. Must run inside a write transaction, so no other
+    connection ever sees the triggers missing (and a failed block is
+    rolled back along with the DROP TRIGGERs).
+    """
+    for name in _TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+    yield movie_ids
+    ids = json.dumps(list(movie_ids))
+    conn.execute("DELETE FROM movie_search WHERE rowid IN (SELECT value FROM json_each(?))", (ids,))
+    conn.execute(
+        "INSERT INTO movie_search (rowid, title, description, actors, roles, categories)"
+        + _DOCUMENT.format(where="m.movie_id IN (SELECT value FROM json_each(?))"),
+        (ids,),
+    )
+    _create_triggers(conn)
+
+
+def rebuild_search_index(conn):
+    """Re-index every movie from scratch (repair / bulk loads)."""
+    conn.execute("DELETE FROM movie_search")
+    conn.execute(
+        "INSERT INTO movie_search (rowid, title, description, actors, roles, categories)"
+        + _DOCUMENT.format(where="1")
+    )
+    conn.execute("INSERT INTO movie_search (movie_search) VALUES ('optimize')")
+
+
+_TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def match_query(keyword):
+    """Turn what the clerk typed into an FTS5 MATCH expression.
+
+    Every word must match, and each one is a prefix query so "godf" already
+    finds The Godfather while typing. Returns None when there is nothing
+    searchable in ``keyword``.
+    """
+    tokens = _TOKEN.findall(keyword or "")
+    if not tokens:
+        return None
+    return " ".join(f'"{token}"*' for token in tokens)
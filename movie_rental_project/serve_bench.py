@@ -0,0 +1,154 @@
+"""Serving throughput: the development server against preforked gunicorn workers.
+
+Starts each server in turn on its own copy of the database, then drives it
+for ``--seconds`` with ``--clients`` client processes, each on one
+keep-alive connection, cycling through a read-mostly mix of pages: the
+catalog (with and without a keyword), movie detail pages, the JSON API
+and the reports. Servers:
+
+  * dev        - what ``python app.py`` runs: Flask's development server
+                 with the debugger on (threaded, reloader off here)
+  * gunicorn:N - ``gunicorn -c gunicorn.conf.py wsgi:app`` with N workers,
+                 preloaded and forked (gunicorn must be installed)
+
+Background maintenance is off during the runs. Clients and servers share
+the machine, so on a small box the numbers are a lower bound.
+
+    python serve_bench.py
+    python serve_bench.py --db /tmp/big.db --workers 1 2 4 --clients 8 --seconds 20
+"""
+import argparse
+import http.client
+import multiprocessing
+import os
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import benchmark
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PORT = 8799
+TOKEN = "serve-bench"    # API token for the protected /api/v1 collections
+DEV_SERVER = ("import app; app.configure_app().run(host='127.0.0.1', port={port}, "
+              "debug=True, use_reloader=False)")
+
+
+def urls(db_path):
+    """The request mix: fixed pages plus detail pages of random movies."""
+    conn = sqlite3.connect(db_path)
+    (top,) = conn.execute("SELECT MAX(movie_id) FROM movie").fetchone()
+    conn.close()
+    fixed = ["/", "/movies", "/movies?keyword=the&sort_by=rating&sort_dir=desc", "/movies?sort_by=year",
+             "/api/v1/movies?limit=50", "/api/v1/rentals?status=OPEN&limit=50",
+             "/reports/popular", "/reports/trends"]
+    rng = random.Random(7)
+    return fixed + [f"/movies/{rng.randint(1, top or 1)}" for _ in range(len(fixed))]
+
+
+def client(args):
+    """One client: GET the mix round-robin until ``deadline``; returns (latencies, errors)."""
+    port, paths, deadline, seed = args
+    rng = random.Random(seed)
+    paths = paths[:]
+    rng.shuffle(paths)
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    latencies, errors, i = [], 0, 0
+    while time.perf_counter() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            conn.request("GET", path, headers={"Authorization": f"Bearer {TOKEN}"})
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors += 1
+            if response.getheader("Connection", "").lower() == "close" or response.version == 10:
+                conn.close()
+        except (OSError, http.client.HTTPException):
+            errors += 1
+            conn.close()
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            continue
+        latencies.append(time.perf_counter() - started)
+    conn.close()
+    return latencies, errors
+
+
+def start(server, db_path, port):
+    env = dict(os.environ, MOVIE_RENTAL_DATABASE=db_path, MOVIE_RENTAL_MAINTENANCE_ENABLED="false",
+               MOVIE_RENTAL_SLOW_QUERY_LOG="null", MOVIE_RENTAL_API_TOKENS=f'["{TOKEN}"]')
+    if server == "dev":
+        command = [sys.executable, "-c", DEV_SERVER.format(port=port)]
+    else:
+        workers = server.split(":")[1]
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--workers", workers,
+                   "--bind", f"127.0.0.1:{port}", "wsgi:app"]
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{server} exited with {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            conn.request("GET", "/")
+            conn.getresponse().read()
+            conn.close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"{server} did not come up")
+
+
+def measure(server, db_path, paths, clients, seconds, port):
+    process = start(server, db_path, port)
+    try:
+        with multiprocessing.Pool(clients) as pool:
+            # one short round first, so every worker has its connections and caches
+            pool.map(client, [(port, paths, time.perf_counter() + 1.0, n) for n in range(clients)])
+            deadline = time.perf_counter() + seconds
+            results = pool.map(client, [(port, paths, deadline, n) for n in range(clients)])
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    latencies = sorted(s for result, _ in results for s in result)
+    errors = sum(e for _, e in results)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+    return {"requests": len(latencies), "rps": len(latencies) / seconds, "errors": errors,
+            "p50": statistics.median(latencies) * 1000 if latencies else 0.0, "p95": p95 * 1000}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", default=os.path.join(HERE, "movierental.db"))
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="gunicorn worker counts.")
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=15.0)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        sys.exit(f"{args.db} does not exist (python datagen.py {args.db})")
+    servers = ["dev"] + [f"gunicorn:{n}" for n in args.workers]
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.seconds:g} s per server, "
+          f"database {args.db}")
+    baseline = None
+    with tempfile.TemporaryDirectory() as workdir:
+        for server in servers:
+            db_path = os.path.join(workdir, f"{server.replace(':', '-')}.db")
+            benchmark.copy_database(args.db, db_path)
+            result = measure(server, db_path, urls(db_path), args.clients, args.seconds, args.port)
+            baseline = baseline or result["rps"]
+            print(f"{server:<12} {result['rps']:8.1f} req/s  x{result['rps'] / baseline:4.2f}  "
+                  f"p50 {result['p50']:7.2f} ms  p95 {result['p95']:7.2f} ms  "
+                  f"({result['requests']} requests, {result['errors']} errors)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""Startup benchmark: how long init_db() takes when a worker starts.
+
+Every start is timed as a new worker would see it: a fresh connection pool
+(new connections, PRAGMAs) followed by init_db(). Three kinds of start:
+
+  * cold   - a new, empty database file: tables, migrations, fingerprint;
+  * warm   - the fingerprint in PRAGMA user_version matches, so init_db()
+             only reads the database header;
+  * check  - what every start used to do: the full CREATE TABLE IF NOT
+             EXISTS script, the migration check, the movie COUNT(*) and the
+             default-user check (init_db(force=True) followed by seed_db()).
+
+With ``--busy`` another connection holds the write lock for ``--hold-ms``
+while the warm and check starts run, as when other workers are serving
+rentals.
+
+    python startup_bench.py
+    python startup_bench.py --db /tmp/big.db --starts 50 --busy
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+
+import app as movie_app
+
+
+def new_worker(db_path):
+    """Forget the pool, as a freshly started process would not have one."""
+    pool = movie_app.app.extensions.pop("db_pool", None)
+    if pool is not None:
+        pool.close()
+    movie_app.app.config["DATABASE"] = db_path
+
+
+def timed_start(db_path, check=False):
+    new_worker(db_path)
+    began = time.perf_counter()
+    with movie_app.app.app_context():
+        if check:
+            movie_app.init_db(force=True)
+            movie_app.seed_db()
+        else:
+            movie_app.init_db()
+    return time.perf_counter() - began
+
+
+class LockHolder(threading.Thread):
+    """Keeps taking the write lock for ``hold`` seconds at a time."""
+
+    def __init__(self, db_path, hold):
+        super().__init__(daemon=True)
+        self.db_path = db_path
+        self.hold = hold
+        self.stop = threading.Event()
+
+    def run(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        while not self.stop.is_set():
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute("UPDATE customer SET phone = phone WHERE customer_id = 1")
+            time.sleep(self.hold)
+            conn.execute("COMMIT")
+            time.sleep(0.005)
+        conn.close()
+
+
+def summary(label, seconds):
+    ms = sorted(s * 1000 for s in seconds)
+    p95 = ms[min(len(ms) - 1, int(len(ms) * 0.95))]
+    print(f"{label:<7} median {statistics.median(ms):8.2f} ms  p95 {p95:8.2f} ms  "
+          f"max {ms[-1]:8.2f} ms  ({len(ms)} starts)")
+    return statistics.median(ms)
+
+
+def run(source, starts, busy, hold, workdir):
+    cold = []
+    for number in range(starts):
+        path = os.path.join(workdir, f"cold{number}.db")
+        cold.append(timed_start(path))
+        if source is None and number == 0:
+            with movie_app.app.app_context():
+                movie_app.seed_db()
+            shutil.copy(path, os.path.join(workdir, "warm.db"))
+    new_worker(os.path.join(workdir, "none.db"))
+
+    warm_path = os.path.join(workdir, "warm.db")
+    if source is not None:
+        dst = sqlite3.connect(warm_path)
+        with sqlite3.connect(source) as src:
+            src.backup(dst)
+        dst.close()
+    timed_start(warm_path)   # stamp the fingerprint on a copy made before this change
+
+    holder = None
+    if busy:
+        holder = LockHolder(warm_path, hold)
+        holder.start()
+        time.sleep(0.05)
+    try:
+        warm = [timed_start(warm_path) for _ in range(starts)]
+        check = [timed_start(warm_path, check=True) for _ in range(starts)]
+    finally:
+        if holder is not None:
+            holder.stop.set()
+            holder.join()
+    new_worker(os.path.join(workdir, "none.db"))
+
+    print(f"database: {source or 'sample data'}" + (f", writer holding the lock {hold * 1000:g} ms at a time" if busy else ""))
+    summary("cold", cold)
+    warm_ms = summary("warm", warm)
+    check_ms = summary("check", check)
+    print(f"warm start is {check_ms / warm_ms:.1f}x faster than the full check")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--db", help="Time warm/check starts on a copy of this database (default: sample data).")
+    parser.add_argument("--starts", type=int, default=20)
+    parser.add_argument("--busy", action="store_true", help="Keep another connection writing meanwhile.")
+    parser.add_argument("--hold-ms", type=float, default=20.0, help="How long each write holds the lock.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        run(args.db, args.starts, args.busy, args.hold_ms / 1000, workdir)
+
+
+if __name__ == "__main__":
+    main()
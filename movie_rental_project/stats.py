@@ -0,0 +1,385 @@
+"""Materialized statistics for the /reports/popular dashboard.
+
+The report used to run a dozen whole-table aggregates over rental,
+inventory_copy, movie and payment on every page view. Instead, triggers keep
+running totals up to date as rows are written:
+
+    stats_counter   one row per named counter or sum (rentals, payment_sum, ...)
+    movie_stats     per-movie rental and copy counts
+    customer_stats  per-customer rental counts and payment totals
+
+so the report is a handful of primary-key / index lookups. Because the
+triggers live in the database, every write path (rent, return, add movie,
+imports, sqlite3 shell) keeps them current.
+
+Rentals moved to the archive database (archive.py) are still history: the
+delete triggers skip the rows listed in archive_batch, and rebuild()
+counts rental_history / payment_history, the views over both files.
+
+rebuild() recomputes everything from the base tables; run it with
+``flask --app app rebuild-stats`` if the numbers are ever suspected to have
+drifted (e.g. after editing rows with triggers disabled). It rewrites
+every summary row in one write transaction, so on a live store the
+``aggregates`` maintenance job runs refresh() instead: each summary table
+is recounted and compared with its stored rows in one read statement (one
+snapshot, no write lock), and only the rows that differ are corrected, by
+the difference, REFRESH_BATCH rows per short write transaction. Adding the
+difference rather than writing the recount keeps whatever the triggers
+added since the snapshot.
+"""
+import json
+import time
+
+# refresh(): summary rows corrected per write transaction
+REFRESH_BATCH = 500
+
+# name -> full aggregate that rebuild() uses to recompute it
+COUNTERS = {
+    "movies": "SELECT COUNT(*) FROM movie",
+    "movie_rate_sum": "SELECT COALESCE(SUM(rental_rate), 0) FROM movie",
+    "rated_movies": "SELECT COUNT(movie_rating) FROM movie",
+    "movie_rating_sum": "SELECT COALESCE(SUM(movie_rating), 0) FROM movie",
+    "customers": "SELECT COUNT(*) FROM customer",
+    "renting_customers": "SELECT COUNT(DISTINCT customer_id) FROM rental_history",
+    "rentals": "SELECT COUNT(*) FROM rental_history",
+    "open_rentals": "SELECT COUNT(*) FROM rental WHERE rental_status = 'OPEN'",
+    "timed_returns": "SELECT COUNT(julianday(return_date) - julianday(rental_date)) FROM rental_history",
+    "rental_days_sum": (
+        "SELECT COALESCE(SUM(julianday(return_date) - julianday(rental_date)), 0) FROM rental_history"),
+    "copies": "SELECT COUNT(*) FROM inventory_copy",
+    "movies_with_copies": "SELECT COUNT(DISTINCT movie_id) FROM inventory_copy",
+    "payments": "SELECT COUNT(*) FROM payment_history",
+    "payment_sum": "SELECT COALESCE(SUM(amount), 0) FROM payment_history",
+}
+
+TABLES = """
+CREATE TABLE IF NOT EXISTS stats_counter (
+    name  TEXT PRIMARY KEY,
+    value REAL NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS movie_stats (
+    movie_id     INTEGER PRIMARY KEY,
+    rental_count INTEGER NOT NULL DEFAULT 0,
+    copy_count   INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_movie_stats_rentals ON movie_stats (rental_count, movie_id);
+
+CREATE TABLE IF NOT EXISTS customer_stats (
+    customer_id   INTEGER PRIMARY KEY,
+    rental_count  INTEGER NOT NULL DEFAULT 0,
+    payment_total REAL NOT NULL DEFAULT 0
+);
+"""
+
+
+def _bump(name, delta):
+    return f"UPDATE stats_counter SET value = value + ({delta}) WHERE name = '{name}';"
+
+
+def _duration(row):
+    return f"julianday({row}.return_date) - julianday({row}.rental_date)"
+
+
+def _movie_of(copy_id):
+    return f"(SELECT movie_id FROM inventory_copy WHERE copy_id = {copy_id})"
+
+
+def _customer_of(rental_id):
+    return f"(SELECT customer_id FROM rental WHERE rental_id = {rental_id})"
+
+
+# a row being moved to the archive (archive.py) is not a deleted one
+_NOT_ARCHIVING = "WHEN OLD.rental_id NOT IN (SELECT rental_id FROM archive_batch)"
+
+
+TRIGGERS = {
+    # ---- movie ----
+    "stats_movie_ai": ("AFTER INSERT ON movie", [
+        _bump("movies", "1"),
+        _bump("movie_rate_sum", "NEW.rental_rate"),
+        _bump("rated_movies", "NEW.movie_rating IS NOT NULL"),
+        _bump("movie_rating_sum", "COALESCE(NEW.movie_rating, 0)"),
+        "INSERT OR IGNORE INTO movie_stats (movie_id) VALUES (NEW.movie_id);",
+    ]),
+    "stats_movie_au": ("AFTER UPDATE OF rental_rate, movie_rating ON movie", [
+        _bump("movie_rate_sum", "NEW.rental_rate - OLD.rental_rate"),
+        _bump("rated_movies", "(NEW.movie_rating IS NOT NULL) - (OLD.movie_rating IS NOT NULL)"),
+        _bump("movie_rating_sum", "COALESCE(NEW.movie_rating, 0) - COALESCE(OLD.movie_rating, 0)"),
+    ]),
+    "stats_movie_ad": ("AFTER DELETE ON movie", [
+        _bump("movies", "-1"),
+        _bump("movie_rate_sum", "-OLD.rental_rate"),
+        _bump("rated_movies", "-(OLD.movie_rating IS NOT NULL)"),
+        _bump("movie_rating_sum", "-COALESCE(OLD.movie_rating, 0)"),
+        _bump("movies_with_copies",
+              "-COALESCE((SELECT copy_count > 0 FROM movie_stats WHERE movie_id = OLD.movie_id), 0)"),
+        "DELETE FROM movie_stats WHERE movie_id = OLD.movie_id;",
+    ]),
+    # ---- customer ----
+    "stats_customer_ai": ("AFTER INSERT ON customer", [
+        _bump("customers", "1"),
+        "INSERT OR IGNORE INTO customer_stats (customer_id) VALUES (NEW.customer_id);",
+    ]),
+    "stats_customer_ad": ("AFTER DELETE ON customer", [
+        _bump("customers", "-1"),
+        "DELETE FROM customer_stats WHERE customer_id = OLD.customer_id AND rental_count = 0;",
+    ]),
+    # ---- inventory_copy ----
+    "stats_copy_ai": ("AFTER INSERT ON inventory_copy", [
+        _bump("copies", "1"),
+        _bump("movies_with_copies",
+              "COALESCE((SELECT copy_count FROM movie_stats WHERE movie_id = NEW.movie_id), 0) = 0"),
+        "INSERT INTO movie_stats (movie_id, copy_count) VALUES (NEW.movie_id, 1) "
+        "ON CONFLICT (movie_id) DO UPDATE SET copy_count = copy_count + 1;",
+    ]),
+    "stats_copy_ad": ("AFTER DELETE ON inventory_copy", [
+        _bump("copies", "-1"),
+        _bump("movies_with_copies",
+              "-(COALESCE((SELECT copy_count FROM movie_stats WHERE movie_id = OLD.movie_id), 0) = 1)"),
+        "UPDATE movie_stats SET copy_count = copy_count - 1 WHERE movie_id = OLD.movie_id;",
+    ]),
+    # ---- rental ----
+    "stats_rental_ai": ("AFTER INSERT ON rental", [
+        _bump("rentals", "1"),
+        _bump("open_rentals", "NEW.rental_status = 'OPEN'"),
+        _bump("timed_returns", f"({_duration('NEW')}) IS NOT NULL"),
+        _bump("rental_days_sum", f"COALESCE({_duration('NEW')}, 0)"),
+        _bump("renting_customers",
+              "COALESCE((SELECT rental_count FROM customer_stats WHERE customer_id = NEW.customer_id), 0) = 0"),
+        "INSERT INTO customer_stats (customer_id, rental_count) VALUES (NEW.customer_id, 1) "
+        "ON CONFLICT (customer_id) DO UPDATE SET rental_count = rental_count + 1;",
+        f"INSERT INTO movie_stats (movie_id, rental_count) VALUES ({_movie_of('NEW.copy_id')}, 1) "
+        "ON CONFLICT (movie_id) DO UPDATE SET rental_count = rental_count + 1;",
+    ]),
+    "stats_rental_au": ("AFTER UPDATE OF rental_status, rental_date, return_date ON rental", [
+        _bump("open_rentals", "(NEW.rental_status = 'OPEN') - (OLD.rental_status = 'OPEN')"),
+        _bump("timed_returns", f"(({_duration('NEW')}) IS NOT NULL) - (({_duration('OLD')}) IS NOT NULL)"),
+        _bump("rental_days_sum", f"COALESCE({_duration('NEW')}, 0) - COALESCE({_duration('OLD')}, 0)"),
+    ]),
+    "stats_rental_ad": (f"AFTER DELETE ON rental {_NOT_ARCHIVING}", [
+        _bump("rentals", "-1"),
+        _bump("open_rentals", "-(OLD.rental_status = 'OPEN')"),
+        _bump("timed_returns", f"-(({_duration('OLD')}) IS NOT NULL)"),
+        _bump("rental_days_sum", f"-COALESCE({_duration('OLD')}, 0)"),
+        _bump("renting_customers",
+              "-(COALESCE((SELECT rental_count FROM customer_stats WHERE customer_id = OLD.customer_id), 0) = 1)"),
+        "UPDATE customer_stats SET rental_count = rental_count - 1 WHERE customer_id = OLD.customer_id;",
+        f"UPDATE movie_stats SET rental_count = rental_count - 1 WHERE movie_id = {_movie_of('OLD.copy_id')};",
+    ]),
+    # ---- payment ----
+    "stats_payment_ai": ("AFTER INSERT ON payment", [
+        _bump("payments", "1"),
+        _bump("payment_sum", "NEW.amount"),
+        f"UPDATE customer_stats SET payment_total = payment_total + NEW.amount "
+        f"WHERE customer_id = {_customer_of('NEW.rental_id')};",
+    ]),
+    "stats_payment_au": ("AFTER UPDATE OF amount, rental_id ON payment", [
+        _bump("payment_sum", "NEW.amount - OLD.amount"),
+        f"UPDATE customer_stats SET payment_total = payment_total - OLD.amount "
+        f"WHERE customer_id = {_customer_of('OLD.rental_id')};",
+        f"UPDATE customer_stats SET payment_total = payment_total + NEW.amount "
+        f"WHERE customer_id = {_customer_of('NEW.rental_id')};",
+    ]),
+    "stats_payment_ad": (f"AFTER DELETE ON payment {_NOT_ARCHIVING}", [
+        _bump("payments", "-1"),
+        _bump("payment_sum", "-OLD.amount"),
+        f"UPDATE customer_stats SET payment_total = payment_total - OLD.amount "
+        f"WHERE customer_id = {_customer_of('OLD.rental_id')};",
+    ]),
+}
+
+
+def create_stats_tables(conn):
+    """Create the summary tables and triggers, then fill them (rebuild)."""
+    for statement in TABLES.split(";"):
+        if statement.strip():
+            conn.execute(statement)
+    create_triggers(conn)
+    rebuild(conn)
+
+
+def create_triggers(conn, names=None):
+    """(Re)create the triggers, or only those in ``names``."""
+    for name, (event, body) in TRIGGERS.items():
+        if names is None or name in names:
+            conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+            conn.execute(f"CREATE TRIGGER {name} {event} BEGIN\n" + "\n".join(body) + "\nEND")
+
+
+# whole-history aggregates, one GROUP BY per view: the views are a UNION
+# ALL, which SQLite cannot search with a correlated subquery. Payments are
+# archived with their rental, so each file joins its own (CROSS JOIN: scan
+# the payments, look their rental up by key)
+MOVIE_STATS = """
+    SELECT m.movie_id,
+           COALESCE(rented.n, 0),
+           (SELECT COUNT(*) FROM inventory_copy ic WHERE ic.movie_id = m.movie_id)
+    FROM movie m
+    LEFT JOIN (SELECT ic.movie_id, SUM(per_copy.n) AS n
+               FROM (SELECT copy_id, COUNT(*) AS n FROM rental_history GROUP BY copy_id) per_copy
+               JOIN inventory_copy ic ON ic.copy_id = per_copy.copy_id
+               GROUP BY ic.movie_id) rented ON rented.movie_id = m.movie_id
+"""
+CUSTOMER_STATS = """
+    SELECT ids.customer_id, COALESCE(rented.n, 0), COALESCE(paid.total, 0)
+    FROM (SELECT customer_id FROM customer UNION SELECT customer_id FROM rental_history) ids
+    LEFT JOIN (SELECT customer_id, COUNT(*) AS n FROM rental_history GROUP BY customer_id) rented
+           ON rented.customer_id = ids.customer_id
+    LEFT JOIN (SELECT customer_id, SUM(amount) AS total
+               FROM (SELECT r.customer_id, p.amount
+                     FROM main.payment p CROSS JOIN main.rental r ON p.rental_id = r.rental_id
+                     UNION ALL
+                     SELECT r.customer_id, p.amount
+                     FROM archive.payment p CROSS JOIN archive.rental r ON p.rental_id = r.rental_id)
+               GROUP BY customer_id) paid ON paid.customer_id = ids.customer_id
+"""
+
+# refresh(): (table, key, columns, recount, condition for a row to be kept)
+SUMMARIES = (
+    ("movie_stats", "movie_id", ("rental_count", "copy_count"), MOVIE_STATS,
+     "EXISTS (SELECT 1 FROM movie WHERE movie_id = :key)"),
+    ("customer_stats", "customer_id", ("rental_count", "payment_total"), CUSTOMER_STATS,
+     "EXISTS (SELECT 1 FROM customer WHERE customer_id = :key) "
+     "OR EXISTS (SELECT 1 FROM rental_history WHERE customer_id = :key)"),
+)
+
+# the rows of a summary table that differ from its recount (sums compared
+# to the cent), with both sides: (key, recounted?, recount..., stored...)
+_ROW_DRIFT = """
+    WITH recount (k, {columns}) AS MATERIALIZED ({recount}),
+         stored (k, {columns}) AS MATERIALIZED (SELECT {key}, {columns} FROM {table}),
+         changed (k) AS (SELECT k FROM (SELECT k, {rounded} FROM recount EXCEPT SELECT k, {rounded} FROM stored)
+                         UNION
+                         SELECT k FROM (SELECT k, {rounded} FROM stored EXCEPT SELECT k, {rounded} FROM recount))
+    SELECT c.k, r.k IS NOT NULL, {both}
+    FROM changed c
+    LEFT JOIN recount r ON r.k = c.k
+    LEFT JOIN stored s ON s.k = c.k
+"""
+
+
+def _changed(old, new):
+    return old is None or abs(old - new) > 1e-6 * max(1.0, abs(new))
+
+
+def rebuild(conn):
+    """Recompute every summary row from the base tables.
+
+    Returns {counter: (old_value, new_value)} for counters that had drifted.
+    """
+    old = dict(conn.execute("SELECT name, value FROM stats_counter").fetchall())
+    drift = {}
+    for name, query in COUNTERS.items():
+        value = conn.execute(query).fetchone()[0]
+        if _changed(old.get(name), value):
+            drift[name] = (old.get(name), value)
+        conn.execute(
+            "INSERT INTO stats_counter (name, value) VALUES (?, ?) "
+            "ON CONFLICT (name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+    conn.execute("DELETE FROM movie_stats")
+    conn.execute(f"INSERT INTO movie_stats (movie_id, rental_count, copy_count) {MOVIE_STATS}")
+    conn.execute("DELETE FROM customer_stats")
+    conn.execute(f"INSERT INTO customer_stats (customer_id, rental_count, payment_total) {CUSTOMER_STATS}")
+    return drift
+
+
+def _counter_drift(conn):
+    """{counter: (stored, recount)} of the counters that differ, read in one statement."""
+    values = conn.execute(
+        "SELECT " + ", ".join(f"({query})" for query in COUNTERS.values())
+        + ", (SELECT json_group_object(name, value) FROM stats_counter)").fetchone()
+    old = json.loads(values[-1])
+    return {name: (old.get(name), value) for name, value in zip(COUNTERS, values)
+            if _changed(old.get(name), value)}
+
+
+def _row_drift(conn, table, key, columns, recount):
+    sql = _ROW_DRIFT.format(
+        table=table, key=key, recount=recount, columns=", ".join(columns),
+        rounded=", ".join(f"ROUND({column}, 2)" for column in columns),
+        both=", ".join([f"r.{column}" for column in columns] + [f"s.{column}" for column in columns]))
+    return conn.execute(sql).fetchall()
+
+
+def refresh(conn, transaction, batch_size=REFRESH_BATCH, pause=0.0):
+    """rebuild() for a live store: recount without the write lock, correct the drift.
+
+    ``transaction(conn, immediate=True)`` takes the write lock
+    (app.write_transaction) for each batch of corrections, ``pause``
+    seconds apart. Returns ({counter: (old, new)}, {table: rows corrected}).
+    """
+    drift = _counter_drift(conn)
+    if drift:
+        with transaction(conn, immediate=True):
+            for name, (old, value) in drift.items():
+                conn.execute("INSERT INTO stats_counter (name, value) VALUES (?, ?) "
+                             "ON CONFLICT (name) DO UPDATE SET value = value + ?",
+                             (name, value, value - (old or 0)))
+            conn.commit()
+
+    corrected = {}
+    for table, key, columns, recount, keep in SUMMARIES:
+        rows = _row_drift(conn, table, key, columns, recount)
+        width = len(columns)
+        upsert = (f"INSERT INTO {table} ({key}, {', '.join(columns)}) VALUES (?{', ?' * width}) "
+                  f"ON CONFLICT ({key}) DO UPDATE SET "
+                  + ", ".join(f"{column} = {column} + ?" for column in columns))
+        orphan = f"DELETE FROM {table} WHERE {key} = :key AND NOT ({keep})"
+        for start in range(0, len(rows), batch_size):
+            with transaction(conn, immediate=True):
+                for row in rows[start:start + batch_size]:
+                    new, old = row[2:2 + width], [value or 0 for value in row[2 + width:]]
+                    if row[1]:
+                        conn.execute(upsert, (row[0], *new, *(n - o for n, o in zip(new, old))))
+                    else:
+                        conn.execute(orphan, {"key": row[0]})
+                conn.commit()
+            if pause:
+                time.sleep(pause)
+        if rows:
+            corrected[table] = len(rows)
+    return drift, corrected
+
+
+def counters(conn):
+    return dict(conn.execute("SELECT name, value FROM stats_counter").fetchall())
+
+
+def top_movies(conn, limit=10):
+    return conn.execute(
+        """
+        SELECT m.movie_id, m.title, ms.rental_count
+        FROM movie_stats ms
+        JOIN movie m ON ms.movie_id = m.movie_id
+        WHERE ms.rental_count > 0
+        ORDER BY ms.rental_count DESC, ms.movie_id DESC
+        LIMIT ?
+        """,
+        (limit,),
+    ).fetchall()
+
+
+def _ratio(total, count):
+    return round(total / count, 2) if count else 0
+
+
+def report(conn):
+    """Everything /reports/popular shows, read from the summary tables."""
+    c = counters(conn)
+    return {
+        "movies": top_movies(conn),
+        "avg_rental_duration": _ratio(c.get("rental_days_sum", 0), c.get("timed_returns", 0)),
+        "avg_rental_rate": _ratio(c.get("movie_rate_sum", 0), c.get("movies", 0)),
+        "avg_rentals_per_customer": _ratio(c.get("rentals", 0), c.get("renting_customers", 0)),
+        "avg_movie_rating": _ratio(c.get("movie_rating_sum", 0), c.get("rated_movies", 0)),
+        "avg_copies_per_movie": _ratio(c.get("copies", 0), c.get("movies_with_copies", 0)),
+        "avg_payment_amount": _ratio(c.get("payment_sum", 0), c.get("payments", 0)),
+        "total_movies": int(c.get("movies", 0)),
+        "total_customers": int(c.get("customers", 0)),
+        "total_rentals": int(c.get("rentals", 0)),
+        "active_rentals": int(c.get("open_rentals", 0)),
+    }
@@ -0,0 +1,181 @@
+"""Multi-threaded checkout stress test.
+
+Every round puts a new movie with ``--copies`` copies on the shelf and lets
+``--threads`` clerks race to rent it until it is sold out. After each round
+it checks that no copy was handed out twice:
+
+  * every successful checkout got a different copy,
+  * no copy has more than one OPEN rental,
+  * the number of RENTED copies equals the number of OPEN rentals.
+
+Each clerk has its own connection and its own writer queue, as if every
+clerk were a separate worker process, so the only thing keeping them apart
+is SQLite's write lock and rentals.checkout().
+
+    python stress_checkout.py --threads 16 --copies 50 --rounds 20
+    python stress_checkout.py --legacy    # the old SELECT-then-UPDATE checkout
+
+Exits non-zero when any double allocation is found.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import app as movie_app
+import db
+import rentals
+
+
+def legacy_checkout(conn, customer_id, movie_id):
+    """The checkout as it was before rentals.checkout(), for comparison."""
+    copy = conn.execute(
+        "SELECT copy_id FROM inventory_copy WHERE movie_id = ? AND status = 'AVAILABLE' LIMIT 1",
+        (movie_id,),
+    ).fetchone()
+    if not copy:
+        return None
+    now = time.strftime("%Y-%m-%dT%H:%M:%S")
+    conn.execute(
+        "INSERT INTO rental (customer_id, copy_id, rental_date, due_date, rental_status) "
+        "VALUES (?, ?, ?, ?, 'OPEN')",
+        (customer_id, copy["copy_id"], now, now),
+    )
+    conn.execute("UPDATE inventory_copy SET status = 'RENTED' WHERE copy_id = ?", (copy["copy_id"],))
+    conn.commit()
+    return copy["copy_id"]
+
+
+def clerk(db_path, movie_id, customer_id, legacy, start, results, lock):
+    conn = db.open_connection(db_path, db.storage_pragmas())
+    writer = db.WriterQueue()
+    copies, errors, retries = [], 0, 0
+    start.wait()
+    while True:
+        try:
+            if legacy:
+                copy_id = legacy_checkout(conn, customer_id, movie_id)
+            else:
+                rental = rentals.checkout(conn, writer.transaction, customer_id, movie_id)
+                copy_id = rental and rental.copy_id
+                retries += rental.attempts - 1 if rental else 0
+        except sqlite3.OperationalError:
+            if conn.in_transaction:
+                conn.rollback()
+            errors += 1
+            continue
+        if copy_id is None:
+            break
+        copies.append(copy_id)
+    conn.close()
+    with lock:
+        results["copies"].extend(copies)
+        results["errors"] += errors
+        results["retries"] += retries
+
+
+def stock_movie(conn, number, copies):
+    """Add a movie with ``copies`` available copies; return its movie_id."""
+    movie_id = conn.execute(
+        "INSERT INTO movie (title, rental_rate, late_fee) VALUES (?, 4.99, 1.00)",
+        (f"Stress Test {number}",),
+    ).lastrowid
+    conn.executemany(
+        "INSERT INTO inventory_copy (movie_id, status, store_location) VALUES (?, 'AVAILABLE', 'Stress Test')",
+        [(movie_id,)] * copies,
+    )
+    conn.commit()
+    return movie_id
+
+
+def verify(conn, movie_id, handed_out):
+    """Return a list of problems found after a round on ``movie_id``."""
+    problems = []
+    duplicates = len(handed_out) - len(set(handed_out))
+    if duplicates:
+        problems.append(f"{duplicates} checkouts got a copy someone else already had")
+    shared = conn.execute(
+        "SELECT COUNT(*) FROM (SELECT r.copy_id FROM rental r JOIN inventory_copy ic ON ic.copy_id = r.copy_id "
+        "WHERE ic.movie_id = ? AND r.rental_status = 'OPEN' GROUP BY r.copy_id HAVING COUNT(*) > 1)",
+        (movie_id,),
+    ).fetchone()[0]
+    if shared:
+        problems.append(f"{shared} copies have more than one open rental")
+    rented = conn.execute(
+        "SELECT COUNT(*) FROM inventory_copy WHERE movie_id = ? AND status = 'RENTED'", (movie_id,)
+    ).fetchone()[0]
+    open_rentals = conn.execute(
+        "SELECT COUNT(*) FROM rental r JOIN inventory_copy ic ON ic.copy_id = r.copy_id "
+        "WHERE ic.movie_id = ? AND r.rental_status = 'OPEN'",
+        (movie_id,),
+    ).fetchone()[0]
+    if rented != open_rentals:
+        problems.append(f"{rented} copies RENTED but {open_rentals} open rentals")
+    return problems
+
+
+def run(threads, copies, rounds, legacy, workdir):
+    db_path = os.path.join(workdir, "stress.db")
+    movie_app.app.config["DATABASE"] = db_path
+    with movie_app.app.app_context():
+        movie_app.init_db()
+        movie_app.seed_db()
+    conn = db.open_connection(db_path, db.storage_pragmas())
+    customer_ids = [r[0] for r in conn.execute("SELECT customer_id FROM customer")]
+
+    total, failures, errors, retries, elapsed = 0, 0, 0, 0, 0.0
+    for number in range(1, rounds + 1):
+        movie_id = stock_movie(conn, number, copies)
+        results = {"copies": [], "errors": 0, "retries": 0}
+        lock = threading.Lock()
+        start = threading.Barrier(threads + 1)
+        workers = [
+            threading.Thread(target=clerk, args=(
+                db_path, movie_id, customer_ids[i % len(customer_ids)], legacy, start, results, lock))
+            for i in range(threads)
+        ]
+        for t in workers:
+            t.start()
+        start.wait()
+        began = time.perf_counter()
+        for t in workers:
+            t.join()
+        elapsed += time.perf_counter() - began
+
+        problems = verify(conn, movie_id, results["copies"])
+        if len(results["copies"]) != copies:
+            problems.append(f"{len(results['copies'])} checkouts for {copies} copies")
+        for problem in problems:
+            print(f"round {number}: {problem}")
+        failures += bool(problems)
+        total += len(results["copies"])
+        errors += results["errors"]
+        retries += results["retries"]
+    conn.close()
+
+    label = "legacy" if legacy else "atomic"
+    print(
+        f"{label}: {total / elapsed:8.1f} checkouts/s  {total} checkouts in {rounds} rounds  "
+        f"{failures} rounds with double allocations  {errors} lock errors  {retries} retries  "
+        f"({threads} clerks, {copies} copies)"
+    )
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--copies", type=int, default=50)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="Run the old SELECT-then-UPDATE checkout.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        failures = run(args.threads, args.copies, args.rounds, args.legacy, workdir)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
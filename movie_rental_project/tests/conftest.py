@@ -0,0 +1,44 @@
+"""Shared fixtures: every test gets the app on a fresh, seeded database."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as movie_app  # noqa: E402
+
+
+@pytest.fixture
+def app(tmp_path):
+    """The app on ``tmp_path/store.db`` with the sample data, maintenance off."""
+    saved = dict(movie_app.app.config)
+    movie_app.app.config.update(
+        TESTING=True,
+        DATABASE=str(tmp_path / "store.db"),
+        ARCHIVE_DATABASE=None,
+        MAINTENANCE_ENABLED=False,
+        SLOW_QUERY_LOG=None,
+    )
+    with movie_app.app.app_context():
+        movie_app.init_db()
+        movie_app.seed_db()
+    yield movie_app.app
+    pool = movie_app.app.extensions.pop("db_pool", None)
+    if pool is not None:
+        pool.close()
+    movie_app.app.config.clear()
+    movie_app.app.config.update(saved)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def admin_client(client):
+    """A test client logged in as the seeded admin."""
+    response = client.post("/login", data={"username": "admin", "password": "admin123"})
+    assert response.status_code == 302
+    return client
@@ -0,0 +1,40 @@
+"""Access to the /api/v1 collections (api.py)."""
+import pytest
+
+PROTECTED = ["/api/v1/customers", "/api/v1/customers/1", "/api/v1/rentals", "/api/v1/payments",
+             "/api/v1/rentals?format=ndjson", "/api/v1/changes"]
+
+
+@pytest.mark.parametrize("url", PROTECTED)
+def test_anonymous_requests_are_refused(client, url):
+    response = client.get(url)
+    assert response.status_code == 401
+    assert response.headers["WWW-Authenticate"].startswith("Bearer")
+    assert b"customer_id" not in response.data
+
+
+@pytest.mark.parametrize("url", PROTECTED)
+def test_non_admin_users_are_refused(app, client, url):
+    with client.session_transaction() as session:
+        session["user_id"], session["username"], session["role"] = 99, "clerk", "user"
+    assert client.get(url).status_code == 403
+
+
+def test_admins_and_api_tokens_are_let_in(app, client, admin_client):
+    assert admin_client.get("/api/v1/customers").status_code == 200
+    admin_client.get("/logout")
+    app.config["API_TOKENS"] = ["terminal-1"]
+    assert client.get("/api/v1/rentals", headers={"Authorization": "Bearer terminal-1"}).status_code == 200
+    assert client.get("/api/v1/rentals", headers={"Authorization": "Bearer wrong"}).status_code == 401
+
+
+def test_catalog_stays_public(client):
+    assert client.get("/api/v1/").status_code == 200
+    assert client.get("/api/v1/movies").status_code == 200
+    assert client.get("/api/v1/movies/1").status_code == 200
+
+
+def test_non_ascii_tokens_are_refused(app, client):
+    app.config["API_TOKENS"] = ["terminal-1", "café"]
+    assert client.get("/api/v1/rentals", headers={"Authorization": "Bearer crème"}).status_code == 401
+    assert client.get("/api/v1/rentals", headers={"Authorization": "Bearer café"}).status_code == 200
@@ -0,0 +1,66 @@
+"""Snapshots and restores (backup.py, app.restore_backup)."""
+import os
+import subprocess
+import sys
+
+import pytest
+
+import app as movie_app
+import backup
+import changelog
+
+
+def _rename_customer(conn, name):
+    with movie_app.write_transaction(conn):
+        conn.execute("UPDATE customer SET first_name = ? WHERE customer_id = 1", (name,))
+        conn.commit()
+
+
+def test_restore_fences_the_change_log(app, tmp_path):
+    conn = movie_app.get_connection()
+    _rename_customer(conn, "Before")
+    snapshot = backup.snapshot(conn, str(tmp_path / "backups"))
+    _rename_customer(conn, "After")
+    _rename_customer(conn, "Later")
+    # a sync reader that has applied everything, including the changes the restore undoes
+    reader_since = changelog.read_changes(conn).next_since
+    assert reader_since == changelog.last_seq(conn) > 0
+    conn.close()
+
+    movie_app.restore_backup(snapshot["path"])
+
+    conn = movie_app.get_connection()
+    assert conn.execute("SELECT first_name FROM customer WHERE customer_id = 1").fetchone()[0] == "Before"
+    _rename_customer(conn, "New")
+    (new_seq,) = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()
+    assert new_seq > reader_since    # no seq the reader has passed is handed out again
+    with pytest.raises(changelog.Purged):
+        changelog.read_changes(conn, since=reader_since)
+    # a reader starting over follows from last_seq() and sees the new change
+    batch = changelog.read_changes(conn, since=changelog.status(conn)["purged_through"])
+    assert [change["seq"] for change in batch.changes] == [new_seq]
+    conn.close()
+
+
+def test_restore_refuses_a_damaged_snapshot(app, tmp_path):
+    conn = movie_app.get_connection()
+    snapshot = backup.snapshot(conn, str(tmp_path / "backups"))
+    conn.close()
+    with open(f"{snapshot['path']}/main.db", "r+b") as fh:
+        fh.seek(4096)
+        byte = fh.read(1)
+        fh.seek(4096)
+        fh.write(bytes([byte[0] ^ 1]))
+    with pytest.raises(backup.SnapshotError):
+        movie_app.restore_backup(snapshot["path"])
+
+
+def test_cli_reads_the_database_from_the_environment(tmp_path):
+    project = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    database = tmp_path / "env.db"
+    env = dict(os.environ, MOVIE_RENTAL_DATABASE=str(database))
+    result = subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"],
+                            cwd=project, env=env, capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
+    assert f"Database ready at {database}" in result.stdout
+    assert database.exists()
@@ -0,0 +1,59 @@
+"""The connection pool and the writer queue (db.py)."""
+import threading
+
+import pytest
+
+import db
+
+
+def test_pool_stats_while_connections_open(tmp_path):
+    pool = db.ConnectionPool(str(tmp_path / "pool.db"), max_size=32)
+    errors, done = [], threading.Event()
+
+    def open_some():
+        try:
+            for conn in [pool.acquire() for _ in range(4)]:
+                pool.release(conn)
+        except Exception as exc:  # pragma: no cover - the failure being tested for
+            errors.append(exc)
+
+    def read_stats():
+        while not done.is_set():
+            try:
+                pool.stats()
+            except Exception as exc:  # pragma: no cover
+                errors.append(exc)
+                return
+
+    reader = threading.Thread(target=read_stats)
+    reader.start()
+    workers = [threading.Thread(target=open_some) for _ in range(8)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    done.set()
+    reader.join()
+    pool.close()
+    assert not errors
+    assert pool.stats()["checkouts"] == 32
+
+
+@pytest.mark.parametrize("enabled", [True, False])
+def test_writer_queue_refuses_an_open_transaction(tmp_path, enabled):
+    conn = db.open_connection(str(tmp_path / "writer.db"))
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    conn.commit()
+    writer = db.WriterQueue(enabled=enabled)
+    conn.execute("INSERT INTO t VALUES (1)")    # an outer unit of work, not committed
+    with pytest.raises(RuntimeError):
+        with writer.transaction(conn, immediate=True):
+            conn.commit()
+    conn.rollback()
+    assert conn.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
+    # the queue is still usable afterwards
+    with writer.transaction(conn, immediate=True):
+        conn.execute("INSERT INTO t VALUES (2)")
+        conn.commit()
+    assert [row[0] for row in conn.execute("SELECT x FROM t")] == [2]
+    conn.close()
@@ -0,0 +1,23 @@
+"""Per-request SQL instrumentation (instrument.py)."""
+import sqlite3
+
+import instrument
+
+
+def test_with_block_statements_are_timed():
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE t (x INTEGER)")
+    stats = instrument.RequestStats(slow_threshold=0.0)
+    timed = instrument.TimedConnection(conn, stats)
+
+    with timed as inner:
+        assert inner is timed
+        inner.execute("INSERT INTO t (x) VALUES (?)", (1,))
+
+    stats.finish()
+    recorded = [sql for _, sql, _ in stats.slow]
+    assert recorded == ["INSERT INTO t (x) VALUES (?)", "COMMIT"]
+    assert stats.queries >= 1
+    assert conn.execute("SELECT x FROM t").fetchall() == [(1,)]
+    timed.detach()
+    conn.close()
@@ -0,0 +1,38 @@
+"""Keyset cursors (pagination.py) and the pages that read them."""
+import base64
+import json
+
+import pytest
+
+import pagination
+
+CRAFTED = [
+    [{"a": 1}, 2],
+    [[1], 2],
+    [1, 2, 3],
+    [],
+    [1],
+    {"after": 1},
+    "title",
+]
+
+
+@pytest.mark.parametrize("values", CRAFTED[:3])
+def test_decode_cursor_rejects_non_scalars_and_wrong_lengths(values):
+    assert pagination.decode_cursor(pagination.encode_cursor(values), 2) is None
+
+
+def test_decode_cursor_round_trip():
+    assert pagination.decode_cursor(pagination.encode_cursor(["Heat", 12]), 2) == ["Heat", 12]
+    assert pagination.decode_cursor(pagination.encode_cursor([None, 1.5])) == [None, 1.5]
+    assert pagination.decode_cursor("not a cursor!") is None
+
+
+@pytest.mark.parametrize("url", ["/movies", "/api/v1/movies", "/customers", "/return"])
+@pytest.mark.parametrize("values", CRAFTED, ids=range(len(CRAFTED)))
+def test_crafted_cursors_fall_back_to_the_first_page(admin_client, url, values):
+    if isinstance(values, list):
+        token = pagination.encode_cursor(values)
+    else:
+        token = base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+    assert admin_client.get(url, query_string={"after": token}).status_code == 200
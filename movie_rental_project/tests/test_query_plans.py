@@ -0,0 +1,17 @@
+"""Every route query and registry statement uses an index (query_plans.py)."""
+import pytest
+
+import app as movie_app
+import query_plans
+
+
+@pytest.mark.parametrize("analyzed", [False, True], ids=["no statistics", "analyzed"])
+def test_no_full_scans(app, analyzed):
+    conn = movie_app.get_connection()
+    if analyzed:
+        # what the optimize maintenance job does on its first run
+        conn.execute("ANALYZE")
+        conn.commit()
+    failures = query_plans.check(conn) + query_plans.check_registry(conn)
+    conn.close()
+    assert [(route, name, scans) for route, name, scans, _ in failures] == []
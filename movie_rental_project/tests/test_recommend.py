@@ -0,0 +1,86 @@
+"""Folding checkouts into the "also rented" lists (recommend.fold)."""
+import sqlite3
+import threading
+import time
+
+import app as movie_app
+import db
+import recommend
+import rentals
+
+BOTH = """
+    SELECT COUNT(*) FROM (
+        SELECT r.customer_id FROM rental_history r JOIN inventory_copy ic ON ic.copy_id = r.copy_id
+        WHERE ic.movie_id IN (?, ?) GROUP BY r.customer_id HAVING COUNT(DISTINCT ic.movie_id) = 2)
+"""
+
+
+def _fold_all(conn):
+    while movie_app.fold_recommendations(conn):
+        pass
+
+
+def test_concurrent_folds_of_the_same_pair(app, monkeypatch, caplog):
+    # the legacy, non-serialized writers the race was reproduced with
+    app.config["DB_SERIALIZE_WRITES"] = False
+    app.extensions["db_writer"] = db.WriterQueue(enabled=False)
+    conn = movie_app.get_connection()
+    _fold_all(conn)
+    a, b = (row[0] for row in conn.execute(
+        "SELECT movie_id FROM movie WHERE available_copies > 0 ORDER BY movie_id LIMIT 2"))
+    first = rentals.checkout(conn, movie_app.write_transaction, None, a,
+                             new_customer={"first_name": "Pat", "last_name": "Fold", "email": "pat@fold.test",
+                                           "phone": "", "address": ""})
+    assert rentals.checkout(conn, movie_app.write_transaction, first.customer_id, b)
+    conn.close()
+
+    # widen the read-modify-write window so both folds would read the same lists
+    listed = recommend._listed
+    monkeypatch.setattr(recommend, "_listed", lambda *args: (time.sleep(0.05), listed(*args))[1])
+    start = threading.Barrier(2)
+    folded, errors = [], []
+
+    def fold():
+        own = movie_app.get_connection()
+        start.wait()
+        try:
+            folded.append(movie_app.fold_recommendations(own))
+        except Exception as exc:  # pragma: no cover - the failure being tested for
+            errors.append(exc)
+        finally:
+            own.close()
+
+    threads = [threading.Thread(target=fold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    assert not [r for r in caplog.records if r.levelname == "ERROR"]
+    conn = movie_app.get_connection()
+    _fold_all(conn)
+    (expected,) = conn.execute(BOTH, (a, b)).fetchone()
+    for movie_id, similar_id in ((a, b), (b, a)):
+        row = conn.execute("SELECT customers FROM movie_similar WHERE movie_id = ? AND similar_id = ?",
+                           (movie_id, similar_id)).fetchone()
+        assert row is not None and row[0] == expected
+    conn.close()
+
+
+def test_failed_fold_does_not_fail_the_checkout(app, client, monkeypatch, caplog):
+    def broken(conn, *args, **kwargs):
+        raise sqlite3.IntegrityError("UNIQUE constraint failed: movie_similar.movie_id, movie_similar.similar_id")
+
+    monkeypatch.setattr(recommend, "fold", broken)
+    conn = movie_app.get_connection()
+    (movie_id,) = conn.execute("SELECT movie_id FROM movie WHERE available_copies > 0 LIMIT 1").fetchone()
+    (before,) = conn.execute("SELECT COUNT(*) FROM rental").fetchone()
+    conn.close()
+
+    response = client.post("/rent", data={"customer_id": "1", "movie_id": str(movie_id)})
+    assert response.status_code == 302
+    conn = movie_app.get_connection()
+    assert conn.execute("SELECT COUNT(*) FROM rental").fetchone()[0] == before + 1
+    conn.close()
+    assert any("recommendations failed" in r.getMessage() for r in caplog.records)
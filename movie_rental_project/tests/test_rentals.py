@@ -0,0 +1,142 @@
+"""Checkout and the batch rent/return endpoints (rentals.py)."""
+import sqlite3
+import threading
+
+import pytest
+
+import app as movie_app
+import db
+import rentals
+
+
+@pytest.mark.parametrize("value, expected", [
+    (3, 3), ("3", 3), (" 12 ", 12),
+    (1.5, None), (1.0, None), (True, None), (False, None), ("1_0", None), ("1.5", None),
+    ("", None), ("²", None), (None, None), ([1], None), ({"id": 1}, None),
+])
+def test_parse_id(value, expected):
+    assert rentals.parse_id(value) == expected
+
+
+def test_batch_rent_reports_non_ids(admin_client):
+    response = admin_client.post("/rent/batch", json={"customer_id": 1, "movie_ids": [3, 1.5, True, "x"]})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert [item["ok"] for item in results] == [True, False, False, False]
+    assert {item["error"] for item in results[1:]} == {"invalid movie id"}
+
+
+def test_batch_return_reports_non_ids(admin_client):
+    rented = admin_client.post("/rent/batch", json={"customer_id": 1, "movie_ids": [3]}).get_json()
+    rental_id = rented["results"][0]["rental_id"]
+    response = admin_client.post("/return/batch", json={"rental_ids": [float(rental_id), rental_id]})
+    results = response.get_json()["results"]
+    assert [item["ok"] for item in results] == [False, True]
+    assert results[0]["error"] == "invalid rental id"
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"customer_id": [1]}, "Unknown customer."),
+    ({"customer_id": {"id": 1}}, "Unknown customer."),
+    ({"customer_id": 1.5}, "Unknown customer."),
+    ({"new_customer": ["Ann", "Lee"]}, "new_customer must be an object"),
+    ({"new_customer": {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com", "phone": 5551234}},
+     "new_customer must be an object"),
+    ({"new_customer": {"first_name": {"x": 1}, "last_name": "Lee", "email": "ann@example.com"}},
+     "new_customer must be an object"),
+])
+def test_batch_rent_rejects_malformed_customers(admin_client, body, error):
+    response = admin_client.post("/rent/batch", json=dict(body, movie_ids=[3]))
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith(error)
+
+
+def test_batch_rent_without_rentals_creates_no_customer(admin_client):
+    new_customer = {"first_name": "Ann", "last_name": "Lee", "email": "ann@example.com"}
+    response = admin_client.post("/rent/batch", json={"new_customer": new_customer, "movie_ids": [999]})
+    body = response.get_json()
+    assert body["succeeded"] == 0
+    assert body["customer_id"] is None
+
+    response = admin_client.post("/rent/batch", json={"new_customer": new_customer, "movie_ids": [3]})
+    body = response.get_json()
+    assert body["succeeded"] == 1
+    assert body["customer_id"] is not None
+
+
+def _available(conn, movie_id):
+    return conn.execute("SELECT COUNT(*) FROM inventory_copy WHERE movie_id = ? AND status = 'AVAILABLE'",
+                        (movie_id,)).fetchone()[0]
+
+
+def test_rent_form_tells_unknown_customers_from_duplicate_emails(app, admin_client):
+    response = admin_client.post("/rent", data={"customer_id": "9999", "movie_id": "3"}, follow_redirects=True)
+    assert b"Unknown customer." in response.data
+    assert b"already exists" not in response.data
+
+    conn = movie_app.get_connection()
+    email = conn.execute("SELECT email FROM customer WHERE customer_id = 1").fetchone()[0]
+    conn.close()
+    response = admin_client.post("/rent", data={"customer_id": "new", "movie_id": "3", "new_first_name": "Ann",
+                                                "new_last_name": "Lee", "new_email": email},
+                                 follow_redirects=True)
+    assert b"A customer with that email already exists." in response.data
+
+
+def test_concurrent_checkouts_never_rent_the_same_copy(app):
+    # one connection and one writer per thread, like clerks in separate
+    # worker processes: only SQLite's write lock keeps them apart
+    path = app.config["DATABASE"]
+    conn = db.open_connection(path)
+    copies = _available(conn, 3)
+    conn.close()
+    assert copies > 1
+    clerks = copies + 4
+    barrier, results, errors = threading.Barrier(clerks), [], []
+
+    def clerk():
+        conn = db.open_connection(path)
+        try:
+            barrier.wait()
+            results.append(rentals.checkout(conn, db.WriterQueue(enabled=False).transaction, 1, 3))
+        except Exception as exc:  # pragma: no cover - the failure being tested for
+            errors.append(exc)
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=clerk) for _ in range(clerks)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    rented = [result.copy_id for result in results if result is not None]
+    assert len(rented) == copies == len(set(rented))
+    assert results.count(None) == clerks - copies
+    conn = db.open_connection(path)
+    assert _available(conn, 3) == 0
+    placeholders = ", ".join("?" * len(rented))
+    assert conn.execute(f"SELECT COUNT(*) FROM rental WHERE rental_status = 'OPEN' AND copy_id IN ({placeholders})",
+                        rented).fetchone()[0] == copies
+    conn.close()
+
+
+def test_checkout_retries_while_another_writer_holds_the_lock(app, monkeypatch):
+    monkeypatch.setattr(rentals, "backoff_delay", lambda attempt: 0.05)
+    path = app.config["DATABASE"]
+    blocker = db.open_connection(path)
+    blocker.execute("BEGIN IMMEDIATE")
+    conn = db.open_connection(path, pragmas=("PRAGMA busy_timeout = 0;", "PRAGMA foreign_keys = ON;"))
+    writer = db.WriterQueue(enabled=False)
+
+    with pytest.raises(sqlite3.OperationalError):
+        rentals.checkout(conn, writer.transaction, 1, 3, max_attempts=2)
+
+    releaser = threading.Timer(0.12, blocker.rollback)
+    releaser.start()
+    result = rentals.checkout(conn, writer.transaction, 1, 3, max_attempts=20)
+    releaser.join()
+    assert result is not None and result.attempts > 1
+    blocker.close()
+    conn.close()
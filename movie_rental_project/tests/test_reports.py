@@ -0,0 +1,32 @@
+"""Conditional GETs of the report pages."""
+from datetime import datetime
+
+import pytest
+
+import app as movie_app
+
+
+class _Tomorrow(datetime):
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.now(tz).replace(microsecond=0) + (datetime(2000, 1, 2) - datetime(2000, 1, 1))
+
+
+@pytest.mark.parametrize("url", ["/reports/trends", "/reports/overdue"])
+def test_date_relative_reports_revalidate_after_midnight(admin_client, monkeypatch, url):
+    admin_client.get("/")   # shows the login message; pages with one are not cached
+    first = admin_client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    assert admin_client.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    # no writes, but a new day: yesterday's window must not be revalidated
+    monkeypatch.setattr(movie_app, "datetime", _Tomorrow)
+    response = admin_client.get(url, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_popular_report_still_revalidates(client):
+    etag = client.get("/reports/popular").headers["ETag"]
+    assert client.get("/reports/popular", headers={"If-None-Match": etag}).status_code == 304
@@ -0,0 +1,62 @@
+"""Report summary tables (stats.py) and late fee balances (latefees.py)."""
+import app as movie_app
+import latefees
+import maintenance
+import stats
+
+
+def _summaries(conn):
+    """Every summary row, sums to the cent; all-zero balances are the same as none."""
+    rows = {table: sorted(tuple(round(v, 2) if isinstance(v, float) else v for v in row)
+                          for row in conn.execute(f"SELECT * FROM {table}"))
+            for table in ("stats_counter", "movie_stats", "customer_stats", "customer_balance")}
+    rows["customer_balance"] = [row for row in rows["customer_balance"] if any(row[1:])]
+    return rows
+
+
+def test_aggregates_job_corrects_only_the_drift(app):
+    conn = movie_app.get_connection()
+    with movie_app.write_transaction(conn):
+        conn.execute("UPDATE stats_counter SET value = value + 3 WHERE name = 'rentals'")
+        conn.execute("UPDATE movie_stats SET rental_count = rental_count + 2 WHERE movie_id = 1")
+        conn.execute("DELETE FROM movie_stats WHERE movie_id = 2")
+        conn.execute("INSERT INTO movie_stats (movie_id, rental_count, copy_count) VALUES (9999, 1, 1)")
+        conn.execute("UPDATE customer_stats SET payment_total = payment_total + 1.25 WHERE customer_id = 1")
+        conn.execute("INSERT INTO customer_balance (customer_id, charged) VALUES (1, 4.5) "
+                     "ON CONFLICT (customer_id) DO UPDATE SET charged = charged + 4.5")
+        conn.commit()
+
+    detail = maintenance.aggregates(conn, movie_app.write_transaction)
+    assert detail["corrected"] == ["rentals"]
+    assert detail["rows_corrected"] == {"movie_stats": 3, "customer_stats": 1}
+    assert detail["balances_corrected"] == 1
+
+    refreshed = _summaries(conn)
+    with movie_app.write_transaction(conn):
+        assert stats.rebuild(conn) == {}
+        assert latefees.rebuild(conn) == 0
+        conn.commit()
+    assert _summaries(conn) == refreshed
+    conn.close()
+
+
+def test_overdue_compares_due_dates_written_either_way(app):
+    conn = movie_app.get_connection()
+    with movie_app.write_transaction(conn):
+        copy_id = conn.execute("SELECT copy_id FROM inventory_copy WHERE status = 'AVAILABLE' LIMIT 1").fetchone()[0]
+        # the older format, with a space; checkout writes a 'T' like assess()'s now
+        rental_id = conn.execute(
+            "INSERT INTO rental (customer_id, copy_id, rental_date, due_date, rental_status) "
+            "VALUES (1, ?, '2026-03-05 18:00:00', '2026-03-10 18:00:00', 'OPEN')", (copy_id,)).lastrowid
+        conn.commit()
+
+    def flagged(now):
+        latefees.assess(conn, movie_app.write_transaction, now=now)
+        row = conn.execute("SELECT days_late FROM overdue_rental WHERE rental_id = ?", (rental_id,)).fetchone()
+        return None if row is None else row[0]
+
+    assert flagged("2026-03-10T09:00:00") is None       # due tonight: not overdue yet
+    assert flagged("2026-03-10T19:00:00") == 0
+    assert flagged("2026-03-12T09:00:00") == 2
+    assert flagged("2026-03-10T09:00:00") is None       # and cleared again
+    conn.close()
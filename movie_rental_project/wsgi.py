@@ -0,0 +1,13 @@
+"""WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app          preloaded, forked workers
+    waitress-serve --threads 8 wsgi:app            one process, threads
+
+configure_app() runs once when this module is imported: with preloading that
+is in the gunicorn master, before the workers are forked. Settings come
+from MOVIE_RENTAL_* environment variables (see app.configure_app), e.g.
+MOVIE_RENTAL_DATABASE and MOVIE_RENTAL_SECRET_KEY.
+"""
+from app import configure_app
+
+app = configure_app()